@@ -23,6 +23,7 @@ Host Group information on AppResponse appliance:
 4. Create multiple host groups by uploading a file
 5. Delete one host group
 6. Clear all host groups
+7. Sync host groups with a file, only applying the differences
 """
 import optparse
 
@@ -61,6 +62,8 @@ class HostGroupApp(AppResponseApp):
                                '                        '
                                'upload: upload a file with hostgroups'
                                '                '
+                               'sync: make hostgroups match a file'
+                               '                   '
                                'delete: delete one hostgroup'
                                '                         '
                                'clear: clear all hostgroups'
@@ -71,14 +74,16 @@ class HostGroupApp(AppResponseApp):
         super(HostGroupApp, self).validate_args()
 
         if self.options.operation not in ['show', 'add', 'update',
-                                          'delete', 'clear', 'upload']:
+                                          'delete', 'clear', 'upload',
+                                          'sync']:
             self.parser.error("Operation should be set as one of "
                               "'show', 'add', 'update', 'upload', "
-                              "'delete', 'clear'")
+                              "'sync', 'delete', 'clear'")
 
-        if self.options.operation == 'upload' and not self.options.file:
-            self.parser.error("File needs to be specified for 'upload' "
-                              "operation")
+        if self.options.operation in ('upload', 'sync') and \
+                not self.options.file:
+            self.parser.error("File needs to be specified for '{}' "
+                              "operation".format(self.options.operation))
 
         if self.options.operation == 'add' and \
                 (not self.options.name or not self.options.hosts):
@@ -96,6 +101,18 @@ class HostGroupApp(AppResponseApp):
             self.parser.error("Hostgroup name or ID is needed for 'delete' "
                               "operation.")
 
+    def read_file(self):
+        with open(self.options.file) as f:
+            hgs = []
+            for ln in f.readlines():
+                if not ln.strip():
+                    continue
+                name, hosts = ln.split()
+                hgs.append(HostGroupConfig(name=name,
+                                           hosts=hosts.split(','),
+                                           enabled=True))
+        return hgs
+
     def main(self):
 
         enabled = not self.options.disabled
@@ -132,18 +149,14 @@ class HostGroupApp(AppResponseApp):
             print("Successfully updated hostgroup '{}'".format(hg.name))
 
         elif self.options.operation == 'upload':
-            with open(self.options.file) as f:
-                hgs = []
-                for ln in f.readlines():
-                    if not ln:
-                        continue
-                    name, hosts = ln.split()
-                    hgs.append(HostGroupConfig(name=name,
-                                               hosts=hosts.split(','),
-                                               enabled=True))
-                self.appresponse.classification.create_hostgroups(hgs)
-                print("Successfully uploaded {} hostgroup definitions."
-                      .format(len(hgs)))
+            hgs = self.read_file()
+            self.appresponse.classification.create_hostgroups(hgs)
+            print("Successfully uploaded {} hostgroup definitions."
+                  .format(len(hgs)))
+
+        elif self.options.operation == 'sync':
+            result = self.appresponse.classification.sync(self.read_file())
+            print("Successfully synced hostgroups: {}".format(result))
 
         elif self.options.operation == 'delete':
             if self.options.id:
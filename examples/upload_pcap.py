@@ -19,6 +19,7 @@ Upload a pcap file to AppResponse 11 appliance
 """
 
 import os
+import sys
 
 from steelscript.appresponse.core.app import AppResponseApp
 
@@ -42,14 +43,24 @@ class UploadPcap(AppResponseApp):
                                os.path.basename(self.options.filepath))
             self.options.destname = dst
 
+    def show_progress(self, stream):
+        sys.stdout.write('\r{:5.1f}% ({} of {} bytes)'
+                         .format(stream.percent, stream.bytes_sent,
+                                 stream.total))
+        if stream.done:
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+
     def main(self):
         print("Uploading {}".format(self.options.filepath))
-        self.appresponse.upload(
+        _, checksum = self.appresponse.upload(
             dest_path=self.options.destname,
-            local_file=self.options.filepath
+            local_file=self.options.filepath,
+            progress_callback=self.show_progress,
+            return_checksum=True
         )
-        print("File '{}' successfully uploaded."
-              .format(self.options.filepath))
+        print("File '{}' successfully uploaded, sha256 {}."
+              .format(self.options.filepath, checksum))
         res = self.appresponse.fs.get_file_by_id(self.options.destname).data
         print("The properties are {}".format(res))
 
@@ -49,9 +49,8 @@ def appresponse_source_choices(form, id_, field_kwargs, params):
 
             if params['include_msa_files_only']:
                 choices = []
-                for f in ar.fs.get_files(force=True):
-                    if f.is_msa():
-                        choices.append((SourceProxy(f).path, f.id))
+                for f in ar.fs.get_msa_files(force=True):
+                    choices.append((SourceProxy(f).path, f.id))
 
     field_kwargs['label'] = 'Source'
     field_kwargs['choices'] = choices
@@ -19,6 +19,11 @@ from steelscript.common._fs import SteelScriptDir
 from sleepwalker.connection import ConnectionManager, ConnectionHook
 from sleepwalker.service import ServiceManager
 from steelscript.appresponse.core.types import InstanceDescriptorMixin
+from steelscript.appresponse.core.scheduler import PRIORITY_INTERACTIVE
+from steelscript.appresponse.core.http_cache import ResponseCache, \
+    CachingConnection
+from steelscript.appresponse.core.transfer import UploadStream, \
+    ResumableDownload, DEFAULT_CHUNK_SIZE
 from reschema.exceptions import ParseError, UnsupportedSchema
 
 logger = logging.getLogger(__name__)
@@ -105,6 +110,14 @@ class AppResponseServiceDefLoader(ServiceDefLoadHook):
 
 class AppResponseConnectionHook(ConnectionHook):
 
+    def __init__(self, response_cache=None):
+        """Initialize the hook.
+
+        :param response_cache: optional ResponseCache answering collection
+            listings with conditional requests
+        """
+        self.response_cache = response_cache
+
     def connect(self, host, auth):
         """Create a connection to the server"""
 
@@ -114,6 +127,8 @@ class AppResponseConnectionHook(ConnectionHook):
         svc = Service("AppResponse", host=host, auth=auth)
         # svc.conn.REST_DEBUG = 2
         # svc.conn.REST_BODY_LINES = 20
+        if self.response_cache is not None:
+            return CachingConnection(svc.conn, self.response_cache)
         return svc.conn
 
 
@@ -146,6 +161,7 @@ class AppResponse(InstanceDescriptorMixin):
         self._versions = None
         self.req_versions = versions
         self._service_manager = None
+        self.response_cache = ResponseCache()
         self._init_services()
         logger.info("Initialized AppResponse object with %s" % self.host)
 
@@ -157,7 +173,8 @@ class AppResponse(InstanceDescriptorMixin):
             return self._service_manager
 
         conn_mgr = ConnectionManager()
-        conn_mgr.add_conn_hook(AppResponseConnectionHook())
+        conn_mgr.add_conn_hook(
+            AppResponseConnectionHook(self.response_cache))
 
         appl_conn = conn_mgr.find(host=self.host, auth=self.auth)
 
@@ -240,20 +257,33 @@ class AppResponse(InstanceDescriptorMixin):
         """
         return self.reports.get_column_objects(source_name, columns)
 
-    def create_report(self, data_def_request):
+    def create_report(self, data_def_request,
+                      priority=PRIORITY_INTERACTIVE, timeout=None):
         """Helper method to initiate an AppResponse report.
 
         :param DataDef data_def_request: Single DataDef object defining
             the report criteria.
+        :param str priority: 'interactive' or 'batch' scheduling class
+        :param timeout: seconds the report may take before it is cancelled
         """
-        return self.reports.create_report(data_def_request)
+        return self.reports.create_report(data_def_request,
+                                          priority=priority, timeout=timeout)
 
-    def upload(self, dest_path, local_file):
+    def upload(self, dest_path, local_file, chunk_size=DEFAULT_CHUNK_SIZE,
+               progress_callback=None, return_checksum=False):
         """Upload a local file to the AppResponse 11 device.
 
+        The file is streamed in binary mode `chunk_size` bytes at a time,
+        computing its SHA-256 on the way.
+
         :param dest_path: path where local file will be stored
             at AppResponse device
         :param local_file: path to local file to be uploaded
+        :param int chunk_size: number of bytes read and sent at a time
+        :param progress_callback: callable receiving the UploadStream
+            after each chunk, see UploadStream
+        :param bool return_checksum: True to return a tuple of the
+            response and the SHA-256 hex digest of the bytes sent
         :return: location information if resource has been created,
             otherwise the response body (if any).
         """
@@ -271,23 +301,53 @@ class AppResponse(InstanceDescriptorMixin):
 
         uri = '{}/fs/{}'.format(self.fs.servicedef.servicepath, dest_dir)
 
-        with open(local_file) as f:
+        with open(local_file, 'rb') as f:
             logger.debug("Uploading file {}".format(local_file))
-            resp = conn.upload(uri, f, extra_headers=headers)
-            logger.debug("File {} successfully uploaded.".format(local_file))
-
+            stream = UploadStream(f, chunk_size=chunk_size,
+                                  progress_callback=progress_callback)
+            resp = conn.upload(uri, stream, extra_headers=headers)
+            logger.debug("File {} successfully uploaded, {} bytes in {:.1f}s, "
+                         "sha256 {}".format(local_file, stream.bytes_sent,
+                                            stream.elapsed, stream.checksum))
+
+            if return_checksum:
+                return resp, stream.checksum
             return resp
 
     def create_export(self, source, timefilter, filters):
         return self.export.create(source, timefilter, filters)
 
-    def download(self, id_, dest_path, overwrite):
+    def download(self, id_, dest_path, overwrite, resume=False,
+                 progress_callback=None):
+        """Download the packets of an export.
+
+        The SHA-256 and the packet count of the export are computed while
+        it is written, so the file does not need to be read again to be
+        verified.
+
+        :param id_: id of the export
+        :param dest_path: local file, or directory unless resuming
+        :param bool overwrite: true if existing file can be overwritten
+        :param bool resume: continue from where a previous attempt
+            stopped, see ResumableDownload
+        :param progress_callback: callable receiving the
+            ResumableDownload after each chunk
+        :return: path of the downloaded file, as a DownloadResult: a str
+            which also has the size, sha256 and number of packets of the
+            file as attributes
+        """
 
         conn = self.service_manager.connection_manager.\
             find(host=self.host, auth=self.auth)
         uri = '{}/packets/items/{}'.\
             format(self.export.servicedef.servicepath, id_)
-        return conn.download(uri, dest_path, overwrite=overwrite)
+        result = ResumableDownload(conn, uri, dest_path, overwrite=overwrite,
+                                   progress_callback=progress_callback,
+                                   persist=resume).run()
+        logger.debug('Downloaded export {} to {}, {} packets, sha256 {}'
+                     .format(id_, result.path, result.packets,
+                             result.sha256))
+        return result
 
     def get_file_by_id(self, id_):
         return self.fs.get_file_by_id(id_)
@@ -4,12 +4,12 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import time
 import logging
 
 from steelscript.appresponse.core.types import ServiceClass, \
     AppResponseException, ResourceObject
 from steelscript.common.api_helpers import APIVersion
-from steelscript.common.datastructures import DictObject
 from steelscript.common.exceptions import RvbdHTTPException
 
 logger = logging.getLogger(__name__)
@@ -28,6 +28,9 @@ def CaptureJobService(appresponse):
 class CaptureServiceBase(ServiceClass):
     """This class manages packet capture jobs."""
 
+    # Seconds the cached list of capture jobs is considered fresh
+    JOBS_TTL = 60
+
     def __init__(self, appresponse):
         self.appresponse = appresponse
         self.servicedef = None
@@ -36,6 +39,15 @@ class CaptureServiceBase(ServiceClass):
         self.interfaces = None
         self._job_objs = None
         self._interface_objs = None
+        self._jobs_token = None
+        self._interfaces_token = None
+
+        # indexes over the cached jobs, rebuilt on every refresh
+        self._jobs_by_id = {}
+        self._jobs_by_name = {}
+        self._jobs_fetched = 0
+        # incremented every time the cached jobs change
+        self.jobs_generation = 0
 
     def _bind_resources(self):
 
@@ -55,36 +67,102 @@ class CaptureServiceBase(ServiceClass):
 
             resp = self.interfaces.execute('get')
 
-            self._interface_objs = [Interface(data=item,
-                                              servicedef=self.servicedef)
-                                    for item in resp.data['items']]
+            # Only rebuild the objects if the listing changed
+            token = self._listing_token(self.interfaces)
+            if (token is None or token != self._interfaces_token or
+                    not self._interface_objs):
+                self._interface_objs = [Interface(data=item,
+                                                  servicedef=self.servicedef)
+                                        for item in resp.data['items']]
+            self._interfaces_token = token
 
         return self._interface_objs
 
+    def create_stats_poller(self, interval=10, capacity=360):
+        """Return a poller computing job and interface packet/drop rates.
+
+        **Requires `numpy` library to be available in environment.**
+
+        :param interval: seconds between two samples once started
+        :param capacity: number of samples kept for each job and interface
+        :return: CaptureStatsPoller object, call its `start` method to poll
+            in the background or `poll` to take single samples
+        """
+        try:
+            from steelscript.appresponse.core.capture_stats import \
+                CaptureStatsPoller
+        except ImportError as e:
+            raise AppResponseException("Numpy module is required to poll "
+                                       "capture statistics. %s" % e)
+
+        return CaptureStatsPoller(self, interval=interval, capacity=capacity)
+
     def get_jobs(self, force=False):
+        """Return a list of Job objects.
+
+        The list is cached and fetched again once it is older than
+        `JOBS_TTL` seconds, or when `force` is True.
+        """
 
-        if not self._job_objs or force:
+        if self._job_objs is None or force or self._jobs_expired():
             logger.debug("Getting capture jobs via resource "
                          "'jobs' link 'get'...")
 
             resp = self.jobs.execute('get')
 
-            self._job_objs = [Job(data=item, servicedef=self.servicedef)
-                              for item in resp.data['items']]
+            # Only rebuild the objects if the listing changed
+            token = self._listing_token(self.jobs)
+            if (token is None or token != self._jobs_token or
+                    self._job_objs is None):
+                self._set_jobs([Job(data=item, servicedef=self.servicedef)
+                                for item in resp.data['items']])
+            else:
+                self._jobs_fetched = time.time()
+            self._jobs_token = token
 
         return self._job_objs
 
+    def _jobs_expired(self):
+        return time.time() - self._jobs_fetched > self.JOBS_TTL
+
+    def _set_jobs(self, jobs):
+        self._jobs_by_id = dict((j.id, j) for j in jobs)
+        self._jobs_by_name = dict((j.name, j) for j in jobs)
+        self._job_objs = jobs
+        self._jobs_fetched = time.time()
+        self.jobs_generation += 1
+
+    def _add_job(self, job):
+        jobs = [j for j in (self._job_objs or []) if j.id != job.id]
+        jobs.append(job)
+        self._job_objs = jobs
+        self._jobs_by_id[job.id] = job
+        self._jobs_by_name[job.name] = job
+        self._jobs_token = None
+        self.jobs_generation += 1
+
+    def invalidate_jobs(self):
+        """Drop the cached jobs so the next lookup fetches them again."""
+        self._job_objs = None
+        self._jobs_by_id = {}
+        self._jobs_by_name = {}
+        self._jobs_token = None
+        self.jobs_generation += 1
+
     def create_job(self, config):
         full_config = {'config': config}
 
         logger.debug("Creating one capture job via resource "
                      "'jobs' link 'create' with data {}".format(full_config))
         resp = self.jobs.execute('create', _data=full_config)
-        self.get_jobs(force=True)
+        if self._job_objs is not None:
+            self._add_job(Job(data=resp.data, servicedef=self.servicedef))
         return Job(data=resp.data, datarep=resp)
 
     def delete_jobs(self):
-        return self.jobs.execute('bulk_delete')
+        resp = self.jobs.execute('bulk_delete')
+        self.invalidate_jobs()
+        return resp
 
     def bulk_start(self):
         return self.jobs.execute('bulk_start')
@@ -93,21 +171,49 @@ class CaptureServiceBase(ServiceClass):
         return self.jobs.execute('bulk_stop')
 
     def get_job_by_id(self, id_):
+        """Return the Job object with the given id.
+
+        Jobs are looked up in the cached index; a job missing from it is
+        fetched on its own rather than reloading all jobs.
+        """
+        logger.debug("Obtaining Job object with id '{}'".format(id_))
+        self.get_jobs()
+
+        job = self._jobs_by_id.get(id_)
+        if job is not None:
+            return job
+
         try:
-            logger.debug("Obtaining Job object with id '{}'".format(id_))
-            return next((j for j in self.get_jobs() if j.id == id_))
-        except StopIteration:
-            raise AppResponseException(
-                "No capture job found with ID '{}'".format(id_))
+            datarep = self.servicedef.bind('job', id=id_)
+            job = Job(data=datarep.data, datarep=datarep)
+        except RvbdHTTPException as e:
+            if str(e).startswith('404'):
+                raise AppResponseException(
+                    "No capture job found with ID '{}'".format(id_))
+            raise
+
+        self._add_job(job)
+        return job
 
     def get_job_by_name(self, name):
+        """Return the Job object with the given name.
 
-        try:
-            logger.debug("Obtaining Job object with name '{}'".format(name))
-            return next((j for j in self.get_jobs() if j.name == name))
-        except StopIteration:
+        As jobs can not be fetched by name, a miss reloads all jobs unless
+        they were just fetched.
+        """
+        logger.debug("Obtaining Job object with name '{}'".format(name))
+        fetched = self._jobs_fetched
+        self.get_jobs()
+
+        job = self._jobs_by_name.get(name)
+        if job is None and self._jobs_fetched == fetched:
+            self.get_jobs(force=True)
+            job = self._jobs_by_name.get(name)
+
+        if job is None:
             raise AppResponseException(
                 "No capture job found with name '{}'".format(name))
+        return job
 
 
 class PacketCapture10(CaptureServiceBase):
@@ -145,25 +251,20 @@ class PacketCapture20(CaptureServiceBase):
 
 class Interface(ResourceObject):
     """This class manages single packet capture job."""
+    __slots__ = ()
+
     resource = 'phys_interface'
 
-    def __init__(self, data, servicedef=None, datarep=None):
+    def _bind(self, servicedef):
         # Override super class to use name instead of id
-        logger.debug('Initialized {} object with data {}'
-                     .format(self.__class__.__name__, data))
-        self.data = DictObject.create_from_dict(data)
-        if not datarep:
-            self.datarep = servicedef.bind(self.resource,
-                                           name=self.data.name)
-        else:
-            self.datarep = datarep
+        return servicedef.bind(self.resource, name=self._raw['name'])
 
     def __repr__(self):
         return '<Interface {}/{}>'.format(self.name, self.status)
 
     @property
     def name(self):
-        return self.data.name
+        return self._raw['name']
 
     @property
     def status(self):
@@ -177,11 +278,14 @@ class Interface(ResourceObject):
 
 class Job(ResourceObject):
     """This class manages single packet capture job."""
+    __slots__ = ()
+
     resource = 'job'
 
-    def __init__(self, *args, **kwargs):
-        super(Job, self).__init__(*args, **kwargs)
-        self._version = self.datarep.service.servicedef.version
+    @property
+    def _version(self):
+        service = self._servicedef or self.datarep.service
+        return service.servicedef.version
 
     def __repr__(self):
         if self._version == '1.0':
@@ -238,6 +342,7 @@ class Job(ResourceObject):
 
 
 class MIFG(ResourceObject):
+    __slots__ = ()
 
     resource = 'mifg'
 
@@ -246,6 +351,7 @@ class MIFG(ResourceObject):
 
 
 class VIFG(ResourceObject):
+    __slots__ = ()
 
     resource = 'vifg'
 
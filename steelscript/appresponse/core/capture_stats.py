@@ -0,0 +1,219 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+import time
+import logging
+import threading
+
+import numpy
+
+from steelscript.appresponse.core.types import AppResponseException
+
+logger = logging.getLogger(__name__)
+
+
+JOB = 'job'
+INTERFACE = 'interface'
+
+
+def flatten_counters(stats, prefix=''):
+    """Return the numeric leaves of a nested stats dict keyed by their
+    dotted path, i.e. {'packets.dropped': 3}."""
+    ret = {}
+    for k, v in stats.items():
+        name = prefix + k
+        if isinstance(v, dict):
+            ret.update(flatten_counters(v, name + '.'))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            ret[name] = v
+        elif isinstance(v, str) and v.isdigit():
+            ret[name] = int(v)
+    return ret
+
+
+class CounterRing(object):
+    """Fixed size ring buffer of counter samples and their rates.
+
+    Rates are computed against the previous sample; a counter going
+    backwards (reset or wrap) yields NaN for that interval.
+    """
+
+    def __init__(self, counters, capacity):
+        self.counters = list(counters)
+        self.capacity = capacity
+        self.times = numpy.full(capacity, numpy.nan)
+        self.values = numpy.full((capacity, len(self.counters)), numpy.nan)
+        self.rates = numpy.full((capacity, len(self.counters)), numpy.nan)
+        self._count = 0
+        self._pos = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, counters):
+        values = numpy.array([counters.get(c, numpy.nan)
+                              for c in self.counters], dtype=float)
+
+        if self._count:
+            last = (self._pos - 1) % self.capacity
+            elapsed = timestamp - self.times[last]
+            delta = values - self.values[last]
+            delta[delta < 0] = numpy.nan
+            if elapsed > 0:
+                rates = delta / elapsed
+            else:
+                rates = numpy.full(len(self.counters), numpy.nan)
+        else:
+            rates = numpy.full(len(self.counters), numpy.nan)
+
+        self.times[self._pos] = timestamp
+        self.values[self._pos] = values
+        self.rates[self._pos] = rates
+        self._pos = (self._pos + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _ordered(self, arr):
+        if self._count < self.capacity:
+            return arr[:self._count].copy()
+        return numpy.roll(arr, -self._pos, axis=0)
+
+    def series(self, rates=True):
+        """Return {'time': array, <counter>: array, ...} oldest first."""
+        data = self._ordered(self.rates if rates else self.values)
+        ret = {'time': self._ordered(self.times)}
+        for i, c in enumerate(self.counters):
+            ret[c] = data[:, i]
+        return ret
+
+
+class CaptureStatsPoller(object):
+    """Periodically sample capture job and interface counters.
+
+    Each tick fetches all capture jobs and all physical interfaces with
+    one request each, and appends their counters to per-job and
+    per-interface ring buffers of `capacity` samples, so memory stays
+    bounded however long the poller runs.
+    """
+
+    def __init__(self, capture, interval=10, capacity=360):
+        """Initialize a CaptureStatsPoller object.
+
+        :param capture: CaptureJobService of the AppResponse to poll
+        :param interval: seconds between two ticks when started
+        :param capacity: number of samples kept for each job and interface
+        """
+        self.capture = capture
+        self.interval = interval
+        self.capacity = capacity
+        self._rings = {JOB: {}, INTERFACE: {}}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return '<{} jobs:{} interfaces:{} running:{}>'.format(
+            self.__class__.__name__, len(self._rings[JOB]),
+            len(self._rings[INTERFACE]), self.running)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def poll(self):
+        """Take one sample of all jobs and interfaces."""
+        capture = self.capture
+
+        timestamp = time.time()
+        jobs = capture.jobs.execute('get').data.get('items', [])
+        interfaces = (capture.interfaces.execute('get')
+                      .data.get('items', []))
+
+        job_stats = {}
+        for item in jobs:
+            stats = item.get('state', {}).get('stats')
+            if stats is None:
+                # 1.0 jobs do not carry stats in the collection
+                stats = capture.servicedef.bind(
+                    'job', id=item['id']).execute('get_stats').data
+            job_stats[item['id']] = flatten_counters(stats)
+
+        iface_stats = {}
+        for item in interfaces:
+            stats = item.get('state', {}).get('stats') or {}
+            iface_stats[item['name']] = flatten_counters(stats)
+
+        with self._lock:
+            self._append(JOB, timestamp, job_stats)
+            self._append(INTERFACE, timestamp, iface_stats)
+
+    def _append(self, kind, timestamp, samples):
+        rings = self._rings[kind]
+        # forget jobs and interfaces that are gone
+        for key in list(rings):
+            if key not in samples:
+                del rings[key]
+
+        for key, counters in samples.items():
+            if key not in rings:
+                rings[key] = CounterRing(sorted(counters), self.capacity)
+            rings[key].append(timestamp, counters)
+
+    def start(self):
+        """Poll every `interval` seconds in a background thread."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='CaptureStatsPoller')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread started by `start`."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Failed to poll capture statistics')
+            self._stop.wait(max(0, self.interval - (time.time() - started)))
+
+    def _series(self, kind, key, rates):
+        with self._lock:
+            ring = self._rings[kind].get(key)
+            if ring is None:
+                msg = 'No statistics collected for {} {}'.format(kind, key)
+                raise AppResponseException(msg)
+            return ring.series(rates=rates)
+
+    def get_job_series(self, job_id, rates=True):
+        """Return the time series of one capture job.
+
+        :param job_id: id of the capture job
+        :param bool rates: True for per-second rates, False for the raw
+            counter values
+        :return: dict of numpy arrays keyed by 'time' and counter name
+        """
+        return self._series(JOB, job_id, rates)
+
+    def get_interface_series(self, name, rates=True):
+        """Return the time series of one physical interface, see
+        `get_job_series`."""
+        return self._series(INTERFACE, name, rates)
+
+    def get_jobs(self):
+        """Return the ids of the jobs with collected samples."""
+        return list(self._rings[JOB])
+
+    def get_interfaces(self):
+        """Return the names of the interfaces with collected samples."""
+        return list(self._rings[INTERFACE])
@@ -71,6 +71,7 @@ class CertificateService(ServiceClass):
 
 
 class Certificate(ResourceObject):
+    __slots__ = ()
 
     resource = 'certificate'
 
@@ -86,9 +87,6 @@ class Certificate(ResourceObject):
                                                     self.issuer(),
                                                     self.expires_at())
 
-    def get_properties(self):
-        return self.__dict__
-
     def get_property_values(self):
         return [
             self.subject(), self.fingerprint(),
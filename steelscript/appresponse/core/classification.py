@@ -4,15 +4,36 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import time
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from steelscript.common.datastructures import DictObject
-from steelscript.appresponse.core.types import ServiceClass, ResourceObject
+from steelscript.appresponse.core.types import ServiceClass, ResourceObject, \
+    AppResponseException
+from steelscript.appresponse.core.transfer import TRANSIENT_ERRORS
 from steelscript.common.exceptions import RvbdHTTPException
 
 logger = logging.getLogger(__name__)
 
 
+# Hostgroups sent per bulk_create request by sync
+SYNC_CHUNK_SIZE = 500
+
+# Hostgroups updated at a time by sync
+SYNC_WORKERS = 4
+
+# Appliances synced at a time by replicate_hostgroups
+REPLICATION_WORKERS = 8
+
+# HTTP statuses after which replicate_hostgroups tries an appliance again
+TRANSIENT_STATUSES = (429, 502, 503, 504)
+
+# Attributes compared regardless of the order of their items
+_UNORDERED_ATTRS = ('hosts', 'member_hostgroups', 'tags')
+
+
 class HostGroupConfig(DictObject):
     """Encapsulating HostGroup Config data, this class is used to
     create objects as arguments for creating Hostgroups.
@@ -30,6 +51,45 @@ class HostGroupConfig(DictObject):
                 raise KeyError("'%s' is not a valid attribute "
                                "for hostgroup" % k)
 
+    def compact(self, preview=False):
+        """Merge adjacent and overlapping hosts into the fewest CIDRs.
+
+        Addresses, CIDRs and ranges of `hosts` are combined per address
+        family, so for instance 10.0.0.0 to 10.0.0.255 given as 256
+        addresses becomes 10.0.0.0/24, covering exactly the same addresses.
+
+        :param bool preview: True to leave `hosts` as they are
+        :return: list of the compacted hosts
+        """
+        from steelscript.appresponse.core.iptools import compact_hosts
+        hosts = compact_hosts(self.get('hosts') or [])
+        if not preview and 'hosts' in self:
+            self.hosts = hosts
+        return hosts
+
+
+def compact_hostgroups(objs, preview=False):
+    """Compact the hosts of many HostGroupConfig objects.
+
+    :param objs: a list of HostGroupConfig objects
+    :param bool preview: True to only count the hosts entries saved
+    :return: tuple of the number of hosts entries before and after
+    """
+    before = after = 0
+    for obj in objs:
+        before += len(obj.get('hosts') or [])
+        after += len(obj.compact(preview=preview))
+    logger.debug('Compacting {} hostgroups: {} hosts entries to {}'
+                 .format(len(objs), before, after))
+    return before, after
+
+
+def _compacted(obj):
+    """Return a compacted copy of a HostGroupConfig object or dict."""
+    obj = HostGroupConfig(**obj)
+    obj.compact()
+    return obj
+
 
 class ClassificationService(ServiceClass):
     """ This class provides an interface to manage classification
@@ -38,10 +98,20 @@ class ClassificationService(ServiceClass):
 
     SERVICE_NAME = 'npm.classification'
 
+    # Seconds the cached list of hostgroups is considered fresh
+    HOSTGROUPS_TTL = 60
+
     def __init__(self, appresponse):
         self.appresponse = appresponse
         self.servicedef = None
         self.hostgroups = None
+        self._hostgroup_objs = None
+        self._hostgroups_token = None
+
+        # indexes over the cached hostgroups, rebuilt on every refresh
+        self._hostgroups_by_id = {}
+        self._hostgroups_by_name = {}
+        self._hostgroups_fetched = 0
 
     def _bind_resources(self):
 
@@ -51,62 +121,146 @@ class ClassificationService(ServiceClass):
         # Init resources
         self.hostgroups = self.servicedef.bind('hostgroups')
 
-    def get_hostgroups(self):
-        """Return all hostgroups as a list of HostGroup objects."""
+    def get_hostgroups(self, force=False):
+        """Return all hostgroups as a list of HostGroup objects.
 
-        resp = self.hostgroups.execute('get')
-
-        if 'items' in resp.data:
+        The list is cached and fetched again once it is older than
+        `HOSTGROUPS_TTL` seconds, after hostgroups are changed through
+        this service, or when `force` is True.
+        """
 
-            return [HostGroup(data=item, servicedef=self.servicedef)
-                    for item in resp.data['items']]
+        if (self._hostgroup_objs is None or force or
+                self._hostgroups_expired()):
+            resp = self.hostgroups.execute('get')
 
-        return []
+            # Only rebuild the objects if the listing changed
+            token = self._listing_token(self.hostgroups)
+            if (token is None or token != self._hostgroups_token or
+                    self._hostgroup_objs is None):
+                self._set_hostgroups([self._hostgroup(item)
+                                      for item in resp.data.get('items', [])])
+            else:
+                self._hostgroups_fetched = time.time()
+            self._hostgroups_token = token
+
+        return self._hostgroup_objs
+
+    def _hostgroup(self, data):
+        return HostGroup(data=data, servicedef=self.servicedef, service=self)
+
+    def _hostgroups_expired(self):
+        return time.time() - self._hostgroups_fetched > self.HOSTGROUPS_TTL
+
+    def _set_hostgroups(self, hostgroups):
+        self._hostgroups_by_id = dict((str(hg.id), hg) for hg in hostgroups)
+        self._hostgroups_by_name = dict((hg.name, hg) for hg in hostgroups)
+        self._hostgroup_objs = hostgroups
+        self._hostgroups_fetched = time.time()
+
+    def _add_hostgroups(self, hostgroups):
+        if self._hostgroup_objs is None:
+            return
+        self._hostgroup_objs = self._hostgroup_objs + hostgroups
+        for hg in hostgroups:
+            self._hostgroups_by_id[str(hg.id)] = hg
+            self._hostgroups_by_name[hg.name] = hg
+        self._hostgroups_token = None
+
+    def invalidate_hostgroups(self):
+        """Drop the cached hostgroups so the next lookup fetches them
+        again."""
+        self._hostgroup_objs = None
+        self._hostgroups_by_id = {}
+        self._hostgroups_by_name = {}
+        self._hostgroups_token = None
+
+    def get_ip_index(self):
+        """Return a HostGroupIndex of the current hostgroups, to map
+        addresses to hostgroups locally."""
+        from steelscript.appresponse.core.iptools import HostGroupIndex
+        return HostGroupIndex(self.get_hostgroups())
 
     def get_hostgroup_by_id(self, id_):
+        """Return the HostGroup object with the given id.
+
+        Hostgroups are looked up in the cached index; a hostgroup missing
+        from it is fetched on its own rather than reloading all of them.
+        """
+        self.get_hostgroups()
+
+        hg = self._hostgroups_by_id.get(str(id_))
+        if hg is not None:
+            return hg
+
         try:
             resp = self.servicedef.bind('hostgroup', id=id_)
-            return HostGroup(data=resp.data, datarep=resp)
+            hg = HostGroup(data=resp.data, datarep=resp, service=self)
         except RvbdHTTPException as e:
             if str(e).startswith('404'):
                 raise ValueError('No hostgroup found with id %s' % id_)
+            raise
+
+        self._add_hostgroups([hg])
+        return hg
 
     def get_hostgroup_by_name(self, name):
-        try:
-            return next((hg for hg in self.get_hostgroups()
-                         if hg.name == name))
-        except StopIteration:
+        """Return the HostGroup object with the given name.
+
+        As hostgroups can not be fetched by name, a miss reloads all
+        hostgroups unless they were just fetched.
+        """
+        fetched = self._hostgroups_fetched
+        self.get_hostgroups()
+
+        hg = self._hostgroups_by_name.get(name)
+        if hg is None and self._hostgroups_fetched == fetched:
+            self.get_hostgroups(force=True)
+            hg = self._hostgroups_by_name.get(name)
+
+        if hg is None:
             raise ValueError("No hostgroups found with name "
                              "'%s'." % name)
+        return hg
 
-    def create_hostgroup(self, obj):
+    def create_hostgroup(self, obj, compact=False):
         """Create a Hostgroup on the appresponse appliance.
 
         :param obj: an HostGroupConfig object.
+        :param bool compact: True to send the hosts compacted, see
+            HostGroupConfig.compact. `obj` is left unchanged.
         :return : an HostGroup object.
         """
+        if compact:
+            obj = _compacted(obj)
 
         resp = self.hostgroups.execute('create', _data=obj)
-        return HostGroup(data=resp.data, datarep=resp)
+        hg = HostGroup(data=resp.data, datarep=resp, service=self)
+        self._add_hostgroups([hg])
+        return hg
 
-    def create_hostgroups(self, objs):
+    def create_hostgroups(self, objs, compact=False):
         """Create multiple hostgroup objects in one go.
 
         :param objs: a list of HostGroupConfig objects.
+        :param bool compact: True to send the hosts compacted, see
+            HostGroupConfig.compact. `objs` are left unchanged.
         :return: a list of HostGroup objects.
         """
+        if compact:
+            objs = [_compacted(obj) for obj in objs]
 
         resp = self.hostgroups.execute('bulk_create', _data=dict(items=objs))
 
-        return [HostGroup(data=item, servicedef=self.servicedef)
-                for item in resp.data['items']]
+        hostgroups = [self._hostgroup(item) for item in resp.data['items']]
+        self._add_hostgroups(hostgroups)
+        return hostgroups
 
     def hierarchy_hostgroups(self, objs):
 
         resp = self.hostgroups.execute('bulk_hierarchy',
                                        _data=dict(items=objs))
-        return [HostGroup(data=item, servicedef=self.servicedef)
-                for item in resp.data['items']]
+        self.invalidate_hostgroups()
+        return [self._hostgroup(item) for item in resp.data['items']]
 
     def bulk_delete(self, ids=None, delete_all=False):
         """Delete Hostgroups on an appresponse appliance.
@@ -121,15 +275,270 @@ class ClassificationService(ServiceClass):
         else:
             data = dict(delete_ids=ids)
 
-        self.hostgroups.execute('bulk_delete', _data=data)
+        try:
+            self.hostgroups.execute('bulk_delete', _data=data)
+        finally:
+            self.invalidate_hostgroups()
+
+    def sync(self, desired_configs, chunk_size=SYNC_CHUNK_SIZE,
+             max_workers=SYNC_WORKERS, delete=True, dry_run=False,
+             compact=False):
+        """Make the hostgroups on the appliance match `desired_configs`.
+
+        Hostgroups are matched by name. The current hostgroups are fetched
+        once and only the differences are applied: missing hostgroups are
+        created with bulk_create, `chunk_size` at a time, hostgroups whose
+        definition differs are updated `max_workers` at a time, and the
+        hostgroups not desired are removed with a single bulk_delete.
+
+        Only the attributes given in a desired config are compared, the
+        order of hosts, member hostgroups and tags is ignored.
+
+        :param desired_configs: list of HostGroupConfig objects or dicts
+        :param int chunk_size: number of hostgroups per bulk_create request
+        :param int max_workers: number of hostgroups updated at a time
+        :param bool delete: False to keep the hostgroups not desired
+        :param bool dry_run: True to only compute the differences
+        :param bool compact: True to compact the hosts of the desired
+            configs first, see HostGroupConfig.compact
+        :return: SyncResult object
+        """
+        result = SyncResult(dry_run)
+        if compact:
+            desired_configs = [_compacted(c) for c in desired_configs]
+
+        start = time.time()
+        current = self.get_hostgroups(force=True)
+        result.timings['fetch'] = time.time() - start
+
+        to_create, to_update, to_delete = _diff_hostgroups(
+            desired_configs, current, result)
+        if not delete:
+            result.unchanged.extend(hg.name for hg in to_delete)
+            to_delete = []
+        result.created = [c['name'] for c in to_create]
+        result.updated = [hg.name for hg, _ in to_update]
+        result.deleted = [hg.name for hg in to_delete]
+
+        if dry_run:
+            return result
+
+        start = time.time()
+        for i in range(0, len(to_create), chunk_size):
+            self.create_hostgroups(to_create[i:i + chunk_size])
+        result.timings['create'] = time.time() - start
+
+        start = time.time()
+        if to_update:
+            workers = min(max_workers, len(to_update))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda u: u[0].update(u[1]), to_update))
+        result.timings['update'] = time.time() - start
+
+        start = time.time()
+        if to_delete:
+            self.bulk_delete(ids=[hg.id for hg in to_delete])
+        result.timings['delete'] = time.time() - start
+
+        logger.info('Synced hostgroups: {}'.format(result))
+        return result
+
+
+def replicate_hostgroups(appresponses, desired_configs,
+                         max_workers=REPLICATION_WORKERS, retries=2, delay=1,
+                         compact=False, **kwargs):
+    """Make the hostgroups of many appliances match `desired_configs`.
+
+    The desired configs are checked, and compacted if asked, once; each
+    appliance is then synced with ClassificationService.sync,
+    `max_workers` appliances at a time. As sync only applies what still
+    differs, an appliance failing with a connection error or a transient
+    HTTP status is simply synced again, up to `retries` times. A failed
+    appliance does not stop the others.
+
+    :param appresponses: AppResponse objects
+    :param desired_configs: list of HostGroupConfig objects or dicts
+    :param int max_workers: number of appliances synced at a time
+    :param int retries: number of times a transient failure is retried
+    :param delay: seconds before the first retry, doubled each time
+    :param bool compact: True to compact the hosts of the desired configs
+    :param kwargs: other arguments of ClassificationService.sync, such as
+        `delete` or `dry_run`
+    :return: list of ReplicationResult objects, in the order of
+        `appresponses`
+    """
+    if compact:
+        desired_configs = [_compacted(c) for c in desired_configs]
+    desired = list(_desired_configs(desired_configs).values())
+
+    results = [ReplicationResult(ar) for ar in appresponses]
+    if results:
+        workers = min(max_workers, len(results))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(
+                lambda r: _replicate_one(r, desired, retries, delay, kwargs),
+                results))
+
+    logger.info('Replicated {} hostgroups to {} of {} appliances'
+                .format(len(desired), sum(r.ok for r in results),
+                        len(results)))
+    return results
+
+
+def _is_transient(exc):
+    if isinstance(exc, RvbdHTTPException):
+        return exc.status in TRANSIENT_STATUSES
+    return isinstance(exc, TRANSIENT_ERRORS)
+
+
+def _replicate_one(result, desired, retries, delay, kwargs):
+    start = time.time()
+    while True:
+        result.attempts += 1
+        try:
+            result.result = result.appresponse.classification.sync(
+                desired, **kwargs)
+            result.error = None
+            break
+        except Exception as e:
+            result.error = e
+            if result.attempts > retries or not _is_transient(e):
+                logger.error('Hostgroup replication to {} failed: {}'
+                             .format(result.host, e))
+                break
+            wait = delay * 2 ** (result.attempts - 1)
+            logger.info('Hostgroup replication to {} failed ({}), retrying '
+                        'in {}s'.format(result.host, e, wait))
+            time.sleep(wait)
+    result.elapsed = time.time() - start
+
+
+class ReplicationResult(object):
+    """Outcome of replicate_hostgroups on one appliance."""
+
+    def __init__(self, appresponse):
+        self.appresponse = appresponse
+        self.host = getattr(appresponse, 'host', None)
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(self.__class__.__name__, self.host,
+                                   self.error or self.result)
+
+    @property
+    def ok(self):
+        return self.result is not None and self.error is None
+
+
+class SyncResult(object):
+    """Names of the hostgroups changed by ClassificationService.sync and
+    the seconds spent in each of its phases."""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        self.unchanged = []
+        self.timings = OrderedDict()
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self)
+
+    def __str__(self):
+        timings = ', '.join('{} {:.2f}s'.format(k, v)
+                            for k, v in self.timings.items())
+        return ('{} created, {} updated, {} deleted, {} unchanged{} ({})'
+                .format(len(self.created), len(self.updated),
+                        len(self.deleted), len(self.unchanged),
+                        ' (dry run)' if self.dry_run else '', timings))
+
+    @property
+    def changed(self):
+        return bool(self.created or self.updated or self.deleted)
+
+
+def _normalize(attr, value):
+    if attr in _UNORDERED_ATTRS and isinstance(value, (list, tuple)):
+        return sorted(value, key=repr)
+    return value
+
+
+def _config_matches(config, data):
+    """Return True if the hostgroup `data` has the attributes set in
+    `config`."""
+    for attr, value in config.items():
+        if attr == 'id':
+            continue
+        if _normalize(attr, value) != _normalize(attr, data.get(attr)):
+            return False
+    return True
+
+
+def _desired_configs(desired_configs):
+    """Return an OrderedDict of HostGroupConfig objects by name, checking
+    every config has a distinct name."""
+    desired = OrderedDict()
+    for config in desired_configs:
+        if not isinstance(config, HostGroupConfig):
+            config = HostGroupConfig(**config)
+        name = config.get('name')
+        if not name:
+            raise AppResponseException('Hostgroup configs need a name')
+        if name in desired:
+            msg = "Hostgroup '{}' is defined more than once".format(name)
+            raise AppResponseException(msg)
+        desired[name] = config
+    return desired
+
+
+def _diff_hostgroups(desired_configs, current, result):
+    """Compare desired configs with the current HostGroup objects.
+
+    Names of the hostgroups left as they are go to `result.unchanged`.
+
+    :return: tuple of the list of configs to create, the list of
+        (HostGroup, config) to update and the list of HostGroup to delete
+    """
+    desired = _desired_configs(desired_configs)
+
+    existing = {}
+    to_delete = []
+    for hg in current:
+        if hg.name in desired and hg.name not in existing:
+            existing[hg.name] = hg
+        else:
+            to_delete.append(hg)
+
+    to_create = []
+    to_update = []
+    for name, config in desired.items():
+        hg = existing.get(name)
+        if hg is None:
+            to_create.append(config)
+        elif _config_matches(config, hg.data):
+            result.unchanged.append(name)
+        else:
+            to_update.append((hg, config))
+    return to_create, to_update, to_delete
 
 
 class HostGroup(ResourceObject):
     """This class provides an interface to interact with one hostgroup
     on an appresponse appliance.
     """
+    __slots__ = ('service',)
+
     resource = 'hostgroup'
 
+    def __init__(self, data, servicedef=None, datarep=None, service=None):
+        super(HostGroup, self).__init__(data, servicedef, datarep)
+        # ClassificationService whose cache is invalidated on changes
+        self.service = service
+
     def __repr__(self):
         return '<%s id: %s, name: %s>'\
                % (self.__class__.__name__, self.id, self.name)
@@ -142,10 +551,20 @@ class HostGroup(ResourceObject):
             HostGroup object.
         """
 
-        resp = self.datarep.execute('set', _data=obj)
-        self.data = DictObject.create_from_dict(resp.data)
+        try:
+            resp = self.datarep.execute('set', _data=obj)
+            self.data = DictObject.create_from_dict(resp.data)
+        finally:
+            self._invalidate()
 
     def delete(self):
         """Delete the HostGroup on the appresponse appliance."""
-        self.datarep.execute('delete')
-        self.datarep = None
+        try:
+            self.datarep.execute('delete')
+            self.datarep = None
+        finally:
+            self._invalidate()
+
+    def _invalidate(self):
+        if self.service is not None:
+            self.service.invalidate_hostgroups()
@@ -4,7 +4,12 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import atexit
 import logging
+import weakref
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 
 from steelscript.appresponse.core.types import ServiceClass, ResourceObject, \
     AppResponseException
@@ -12,6 +17,22 @@ from steelscript.appresponse.core.capture import Job
 
 logger = logging.getLogger(__name__)
 
+# Seconds an unused clip is kept around for reuse by later reports
+CLIP_GRACE_PERIOD = 30
+
+# Maximum number of clips created concurrently for one report
+CLIP_WORKERS = 4
+
+# Live ClipCache objects, flushed at exit. Held weakly so the hook does
+# not keep caches and their clips alive.
+_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_caches():
+    for cache in list(_caches):
+        cache.flush()
+
 
 class ClipService(ServiceClass):
     """This class provides an interface to manage the clip service on
@@ -23,6 +44,8 @@ class ClipService(ServiceClass):
         self.servicedef = None
         self.clips = None
         self._clip_objs = None
+        self._clips_token = None
+        self.clip_cache = ClipCache()
 
     def _bind_resources(self):
 
@@ -40,6 +63,13 @@ class ClipService(ServiceClass):
 
             resp = self.clips.execute('get')
 
+            # Only rebuild the objects if the listing changed
+            token = self._listing_token(self.clips)
+            if (token is not None and token == self._clips_token and
+                    self._clip_objs is not None):
+                return self._clip_objs
+            self._clips_token = token
+
             if 'items' not in resp.data:
                 self._clip_objs = []
             else:
@@ -74,39 +104,236 @@ class ClipService(ServiceClass):
 
         return Clip(data=resp.data, datarep=resp, from_job=from_job)
 
-    def create_clips(self, data_defs):
+    def create_clips(self, data_defs, max_workers=CLIP_WORKERS):
         """Create a Clips object from a list of data definition requests.
         When some DataDef objects are using sources other than capture jobs,
         then those sources will stay the same. The capture job sources will
-        be converted into Clip objects.
+        be converted into Clip objects. Only Job objects are capture job
+        sources here; a SourceProxy of a job path is left as it is.
+
+        Clips are shared through `clip_cache`: data definitions over the
+        same capture job and time window reuse one live clip, which is
+        deleted a grace period after the last Clips object using it is
+        released.
+
+        Clips for different data definitions are created concurrently by
+        up to `max_workers` threads. As soon as one of them fails (e.g.
+        no packets were written), pending creations are cancelled and the
+        clips already acquired are released before the error is raised.
 
         :param data_defs: list of DataDef objects
+        :param int max_workers: maximum number of clips created at once
         :return: a Clips object
         """
-        clips = []
-        for dd in data_defs:
-            if isinstance(dd.source, Job):
-                logger.debug("Creating a Clip object for one data def request "
-                             "with capture job '{}'"
-                             .format(dd.source.name))
-
-                clip = self.create_clip(dd.source, dd.timefilter,
-                                        from_job=True)
-                if clip.data.status.packets_written == 0:
-                    msg = ('No packets found for job {} and {}'
-                           .format(dd.source.name, dd.timefilter))
-                    raise AppResponseException(msg)
-
-                clips.append(clip)
+        clip_objs = [dd.source for dd in data_defs]
+        jobs = {}
+        for i, dd in enumerate(data_defs):
+            if (isinstance(dd.source, Job) and dd.timefilter is not None and
+                    dd.timefilter.start):
+                jobs[i] = dd.source.id
+
+        clips = Clips(clip_objs, cache=self.clip_cache)
+        if not jobs:
+            return clips
+
+        if len(jobs) == 1 or max_workers <= 1:
+            acquired = {}
+            try:
+                for i, job_id in jobs.items():
+                    acquired[i] = self._acquire_job_clip(
+                        job_id, data_defs[i].timefilter)
+            except Exception:
+                Clips(list(acquired.values()), cache=self.clip_cache).release()
+                raise
+        else:
+            acquired = self._acquire_job_clips_parallel(data_defs, jobs,
+                                                        max_workers)
+
+        for i, clip in acquired.items():
+            clip_objs[i] = clip
+        return clips
+
+    def _acquire_job_clips_parallel(self, data_defs, jobs, max_workers):
+        """Acquire clips for `jobs`, a dict of data def index to job id,
+        using a bounded thread pool and failing fast."""
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(jobs)))
+        futures = dict((executor.submit(self._acquire_job_clip, job_id,
+                                        data_defs[i].timefilter), i)
+                       for i, job_id in jobs.items())
+        try:
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for f in pending:
+                f.cancel()
+        finally:
+            # let in-flight creations finish so their clips get released
+            executor.shutdown(wait=True)
+
+        acquired = {}
+        error = None
+        for f, i in futures.items():
+            if f.cancelled():
+                continue
+            if f.exception() is not None:
+                error = error or f.exception()
             else:
-                clips.append(dd.source)
+                acquired[i] = f.result()
+
+        if error is not None:
+            Clips(list(acquired.values()), cache=self.clip_cache).release()
+            raise error
+
+        return acquired
+
+    def _acquire_job_clip(self, job_id, timefilter):
+        """Return a cached clip for the job and time window, creating one
+        if needed."""
+
+        def create():
+            logger.debug("Creating a Clip object for capture job '{}' "
+                         "and {}".format(job_id, timefilter))
+            config = dict(job_id=job_id,
+                          start_time=timefilter.start,
+                          end_time=timefilter.end,
+                          description='')
+            resp = self.clips.execute('create', _data=dict(config=config))
+            clip = Clip(data=resp.data, datarep=resp, from_job=True)
+
+            if clip.data.status.packets_written == 0:
+                clip.delete()
+                msg = ('No packets found for job {} and {}'
+                       .format(job_id, timefilter))
+                raise AppResponseException(msg)
+            return clip
+
+        key = (job_id, timefilter.start, timefilter.end)
+        return self.clip_cache.acquire(key, create)
+
+
+class _ClipCacheEntry(object):
+
+    def __init__(self):
+        self.clip = None
+        self.refcount = 1
+        self.timer = None
+        self.ready = threading.Event()
+
+
+class ClipCache(object):
+    """Reference-counted cache of clips created from capture jobs.
 
-        return Clips(clips)
+    Clips are keyed by (job id, start, end). A clip is shared by every
+    user acquiring the same key and is deleted `grace_period` seconds
+    after the last user released it, unless it is acquired again in the
+    meantime. Clips still idle when the process exits are deleted.
+    """
+
+    def __init__(self, grace_period=CLIP_GRACE_PERIOD):
+        self.grace_period = grace_period
+        self._lock = threading.Lock()
+        self._entries = {}
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def acquire(self, key, create):
+        """Return the clip for `key`, calling `create()` to make it if it
+        is not cached. Each acquire must be paired with a `release`."""
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = _ClipCacheEntry()
+                    self._entries[key] = entry
+                    owner = True
+                else:
+                    entry.refcount += 1
+                    if entry.timer is not None:
+                        entry.timer.cancel()
+                        entry.timer = None
+                    owner = False
+
+            if owner:
+                try:
+                    entry.clip = create()
+                except Exception:
+                    with self._lock:
+                        del self._entries[key]
+                    raise
+                finally:
+                    entry.ready.set()
+                return entry.clip
+
+            entry.ready.wait()
+            if entry.clip is not None:
+                logger.debug("Reusing Clip object with id {} for {}"
+                             .format(entry.clip.id, key))
+                return entry.clip
+            # creation by the other user failed, try on our own
+
+    def release(self, clip):
+        """Drop one reference to `clip`, scheduling its deletion when no
+        references are left. Clips not in the cache are deleted."""
+        delete = False
+        with self._lock:
+            key, entry = self._find(clip)
+            if entry is None:
+                delete = True
+            else:
+                entry.refcount -= 1
+                if entry.refcount == 0:
+                    if self.grace_period > 0:
+                        entry.timer = threading.Timer(
+                            self.grace_period, self._expire, (key, entry))
+                        entry.timer.daemon = True
+                        entry.timer.start()
+                    else:
+                        del self._entries[key]
+                        delete = True
+
+        if delete:
+            _delete_clip(clip)
+
+    def flush(self):
+        """Delete all clips that are not in use right now."""
+        with self._lock:
+            idle = [(k, e) for k, e in self._entries.items()
+                    if e.refcount == 0]
+            for key, entry in idle:
+                if entry.timer is not None:
+                    entry.timer.cancel()
+                del self._entries[key]
+
+        for _, entry in idle:
+            _delete_clip(entry.clip)
+
+    def _find(self, clip):
+        for key, entry in self._entries.items():
+            if entry.clip is clip:
+                return key, entry
+        return None, None
+
+    def _expire(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is not entry or entry.refcount > 0:
+                return
+            del self._entries[key]
+        _delete_clip(entry.clip)
+
+
+def _delete_clip(clip):
+    logger.debug("Deleting Clip object with id {}".format(clip.id))
+    try:
+        clip.delete()
+    except Exception:
+        logger.exception("Failed to delete Clip object with id {}"
+                         .format(clip.id))
 
 
 class Clips(object):
-    def __init__(self, clip_objs):
+    def __init__(self, clip_objs, cache=None):
         self.clip_objs = clip_objs
+        self.cache = cache
 
     def __iter__(self):
         for clip_obj in self.clip_objs:
@@ -116,16 +343,24 @@ class Clips(object):
         return self.clip_objs
 
     def __exit__(self, passed_type, value, traceback):
-        for clip in self.clip_objs:
-            if isinstance(clip, Clip) and clip.from_job:
-                logger.debug("Deleting Clip object with id {}"
-                             .format(clip.id))
-                clip.delete()
+        self.release()
+
+    def release(self):
+        """Release the clips that were created from capture jobs."""
+        if self.clip_objs is None:
+            return
 
-        self.clip_objs = None
+        clip_objs, self.clip_objs = self.clip_objs, None
+        for clip in clip_objs:
+            if isinstance(clip, Clip) and clip.from_job:
+                if self.cache is not None:
+                    self.cache.release(clip)
+                else:
+                    _delete_clip(clip)
 
 
 class Clip(ResourceObject):
+    __slots__ = ('from_job',)
 
     resource = 'clip'
 
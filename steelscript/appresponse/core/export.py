@@ -4,22 +4,203 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import os
+import atexit
+import shutil
 import logging
+import tempfile
+import threading
 
 import time
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from steelscript.appresponse.core import pcap
+from steelscript.appresponse.core.filters import check_filter
 from steelscript.appresponse.core.reports import SourceProxy
-from steelscript.appresponse.core.types import ServiceClass
+from steelscript.appresponse.core.types import ServiceClass, \
+    AppResponseException, AppResponseTimeout, TimeFilter, TrafficFilter
 from steelscript.common.exceptions import RvbdHTTPException
 
 logger = logging.getLogger(__name__)
 
+# Export states in which packets can be downloaded: still writing, or
+# done with all of them
+READY_STATES = ('RUNNING', 'DONE', 'COMPLETED', 'STOPPED')
+
+# Terminal export states without packets to download
+FAILED_STATES = ('FAILED', 'ERROR', 'ABORTED', 'CANCELLED', 'CANCELED')
+
+# Default seconds Export.download waits for the export to be ready
+READY_TIMEOUT = 300
+
+# Seconds between two checks of an export that is not ready yet,
+# doubled up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2
+
+# Default number of concurrent exports of download_parallel
+EXPORT_SLICES = 4
+
+NANOSECOND = Decimal('1e-9')
+
+# Bytes read at a time when streaming packets
+STREAM_CHUNK_SIZE = 256 * 1024
+
+DEFAULT_MAX_EXPORTS = 8
+
+# Seconds ExportManager.acquire waits for a free export unless told
+# otherwise, so an export never deleted cannot block creations forever
+DEFAULT_ACQUIRE_TIMEOUT = 600
+
+# Exports deleted at a time by a cleanup
+CLEANUP_WORKERS = 4
+
+
+def _not_initialized(exc):
+    return 'state is not RUNNING' in (getattr(exc, 'error_text', None) or '')
+
+
+class ExportManager(object):
+    """Bookkeeping of the exports a process creates on one appliance.
+
+    At most `max_exports` exports are alive at a time; creating another
+    one waits for an export to be deleted. Every export created through
+    PacketExportService is registered until it is deleted, so the ones
+    a failing script leaves behind can be deleted by `cleanup`, which
+    also runs when the interpreter exits.
+
+    `acquire_timeout` is the default number of seconds to wait for an
+    export to be deleted, None to wait forever.
+    """
+
+    def __init__(self, host, max_exports=DEFAULT_MAX_EXPORTS,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        self.host = host
+        self.max_exports = max_exports
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+        # exp_id -> (Export, creation time)
+        self._exports = OrderedDict()
+        # slots acquired by exports being created
+        self._pending = 0
+
+    def __repr__(self):
+        return '<{} host:{} exports:{}/{}>'.format(
+            self.__class__.__name__, self.host, len(self._exports),
+            self.max_exports)
+
+    def __len__(self):
+        return len(self._exports)
+
+    @property
+    def exports(self):
+        with self._cond:
+            return [e for e, _ in self._exports.values()]
+
+    def set_max_exports(self, max_exports):
+        with self._cond:
+            self.max_exports = max_exports
+            self._cond.notify_all()
+
+    def acquire(self, timeout=None):
+        """Wait until one more export may be created.
+
+        :param timeout: seconds to wait before raising AppResponseTimeout,
+            defaults to `acquire_timeout`
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while len(self._exports) + self._pending >= self.max_exports:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        msg = ('Timed out after {}s waiting for one of {} '
+                               'exports on {} to be deleted'
+                               .format(timeout, self.max_exports, self.host))
+                        raise AppResponseTimeout(msg)
+                self._cond.wait(remaining)
+            self._pending += 1
+
+    def release(self):
+        """Give back a slot whose export could not be created."""
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify_all()
+
+    def register(self, export):
+        """Turn an acquired slot into a registered export."""
+        with self._cond:
+            self._pending -= 1
+            self._exports[export.exp_id] = (export, time.time())
+
+    def unregister(self, export):
+        with self._cond:
+            if self._exports.pop(export.exp_id, None) is not None:
+                self._cond.notify_all()
+
+    def cleanup(self, max_age=None, max_workers=CLEANUP_WORKERS):
+        """Delete the registered exports concurrently.
+
+        :param max_age: only delete exports created more than `max_age`
+            seconds ago, None deletes all of them
+        :param int max_workers: number of exports deleted at a time, 1
+            deletes them one after the other in the calling thread
+        :return: number of exports deleted
+        """
+        now = time.time()
+        with self._cond:
+            stale = [e for e, created in self._exports.values()
+                     if max_age is None or now - created > max_age]
+        if not stale:
+            return 0
+
+        logger.info('Deleting {} stale exports on {}'
+                    .format(len(stale), self.host))
+        if max_workers <= 1 or len(stale) == 1:
+            return sum(e.delete() for e in stale)
+        with ThreadPoolExecutor(max_workers=min(max_workers,
+                                                len(stale))) as executor:
+            return sum(executor.map(lambda e: e.delete(), stale))
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_export_manager(host):
+    """Return the ExportManager shared by all clients of `host`."""
+    with _managers_lock:
+        if host not in _managers:
+            _managers[host] = ExportManager(host)
+        return _managers[host]
+
+
+@atexit.register
+def _cleanup_exports():
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        try:
+            # no new threads can be started once the interpreter is
+            # shutting down, delete sequentially
+            manager.cleanup(max_workers=1)
+        except Exception:
+            logger.exception('Failed to clean up exports on {}'
+                             .format(manager.host))
+
 
 class PacketExportService(ServiceClass):
 
     def __init__(self, appresponse):
         self.appresponse = appresponse
         self.exports = None
+        self.manager = get_export_manager(appresponse.host)
 
     def _bind_resources(self):
 
@@ -27,22 +208,188 @@ class PacketExportService(ServiceClass):
 
         self.exports = self.servicedef.bind('exports')
 
-    def create(self, source, timefilter, filters):
+    def set_max_exports(self, max_exports):
+        """Set how many exports may be alive at a time on the appliance,
+        shared by all clients of this process."""
+        self.manager.set_max_exports(max_exports)
+
+    def create(self, source, timefilter, filters, timeout=None):
+        """Create a packet export.
+
+        Waits while this process already has `max_exports` exports on
+        the appliance, see ExportManager. The syntax of the filters is
+        checked first, see filters.check_filter, except for TrafficFilter
+        objects created with `validate` False.
+
+        :param list filters: TrafficFilter objects or their dicts
+        :param timeout: seconds to wait for an export to be deleted
+            before raising AppResponseTimeout, defaults to the manager's
+            `acquire_timeout`
+        :return: Export object, to be deleted once downloaded
+        """
+
+        items = []
+        for f in filters:
+            if isinstance(f, TrafficFilter):
+                if f.validate:
+                    check_filter(f.type, f.value)
+                f = f.as_dict()
+            else:
+                check_filter(f.get('type'), f['value'])
+            items.append(f)
 
         config = dict(path=SourceProxy(source).path,
                       start_time=str(timefilter.start),
                       end_time=str(timefilter.end),
-                      filters=dict(items=filters))
+                      filters=dict(items=items))
+
+        self.manager.acquire(timeout)
+        try:
+            resp = self.exports.execute('create', _data=dict(config=config))
+        except Exception:
+            self.manager.release()
+            raise
 
-        resp = self.exports.execute('create', _data=dict(config=config))
+        export = Export(self.appresponse, exp_id=resp.data['id'],
+                        manager=self.manager)
+        self.manager.register(export)
+        return export
 
-        return Export(self.appresponse, exp_id=resp.data['id'])
+    def cleanup(self, max_age=None):
+        """Delete the exports this process left on the appliance, see
+        ExportManager.cleanup."""
+        return self.manager.cleanup(max_age=max_age)
+
+    def analyze_microbursts(self, source, timefilter, filters=None,
+                            resolutions=None, timeout=None):
+        """Export packets and compute their microbursts locally.
+
+        The export is streamed through Export.iter_packets, so no report
+        instance is created on the appliance and no file is written.
+
+        **Requires `numpy` library to be available in environment.**
+
+        :param source: packet source, as for `create`
+        :param TimeFilter timefilter: time window to analyze
+        :param list filters: export filters, as for `create`
+        :param resolutions: bin widths in nanoseconds, defaults to 10us,
+            100us and 1ms
+        :param timeout: seconds the export may take to be ready
+        :return: MicroburstAnalyzer holding the exported packets
+        """
+        try:
+            from steelscript.appresponse.core.microburst import \
+                MicroburstAnalyzer, DEFAULT_RESOLUTIONS
+        except ImportError as e:
+            raise AppResponseException("Numpy module is required to analyze "
+                                       "microbursts. %s" % e)
+
+        analyzer = MicroburstAnalyzer(resolutions or DEFAULT_RESOLUTIONS)
+        with self.create(source, timefilter, filters or []) as exp:
+            analyzer.add_packets(exp.iter_packets(timeout=timeout))
+
+        logger.debug('Analyzed {} packets for microbursts'
+                     .format(len(analyzer)))
+        return analyzer
+
+    def download_parallel(self, source, timefilter, filters, filename,
+                          slices=EXPORT_SLICES, overwrite=False,
+                          timeout=None):
+        """Export packets in time slices concurrently into one pcap file.
+
+        `timefilter` is split into `slices` contiguous windows, one export
+        is created and downloaded per window in parallel, and the slice
+        files are merged into `filename` in time order with a streaming
+        merge, see pcap.merge. Slices may be pcap or pcapng, `filename`
+        is always a classic pcap file. The slice files are written next
+        to `filename` and removed afterwards. Each window but the last
+        ends a nanosecond before the next one starts, so a packet stamped
+        exactly on a boundary is exported once.
+
+        :param source: packet source, as for `create`
+        :param TimeFilter timefilter: time window to export
+        :param list filters: export filters, as for `create`
+        :param str filename: path of the merged pcap file
+        :param int slices: number of concurrent exports
+        :param bool overwrite: true if existing file can be overwritten
+        :param timeout: seconds each export may take to be ready, see
+            Export.download
+        :return: number of packets written to `filename`
+        """
+        if os.path.exists(filename) and not overwrite:
+            msg = 'The file {} already exists'.format(filename)
+            raise AppResponseException(msg)
+
+        windows = split_timefilter(timefilter, slices)
+        tmpdir = tempfile.mkdtemp(prefix='.export-', dir=os.path.dirname(
+            os.path.abspath(filename)))
+        paths = [os.path.join(tmpdir, '{}.pcap'.format(i))
+                 for i in range(len(windows))]
+
+        def export_slice(window, path):
+            with self.create(source, window, filters) as exp:
+                exp.download(path, overwrite=True, timeout=timeout)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(windows)) as executor:
+                futures = [executor.submit(export_slice, w, p)
+                           for w, p in zip(windows, paths)]
+                for f in futures:
+                    f.result()
+
+            files = [open(p, 'rb') for p in paths]
+            try:
+                with open(filename, 'wb') as output:
+                    count = pcap.merge(files, output)
+            finally:
+                for f in files:
+                    f.close()
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        logger.info('Exported {} packets to {} in {} slices'
+                    .format(count, filename, len(windows)))
+        return count
+
+
+def split_timefilter(timefilter, slices):
+    """Split `timefilter` into at most `slices` contiguous TimeFilters of
+    equal length.
+
+    Time filters include both their start and end, so each window but the
+    last ends one nanosecond before the next one starts and no instant
+    falls in two windows.
+    """
+    if timefilter.start is None or timefilter.end is None:
+        raise AppResponseException('Parallel exports need a time window')
+
+    start = Decimal(timefilter.start)
+    end = Decimal(timefilter.end)
+    if end <= start:
+        msg = 'Invalid time window {}'.format(timefilter)
+        raise AppResponseException(msg)
+
+    slices = max(1, min(slices, int(end - start) or 1))
+    step = (end - start) / slices
+    bounds = [(start + step * i).quantize(NANOSECOND)
+              for i in range(slices)]
+    ends = [b - NANOSECOND for b in bounds[1:]] + [end]
+    return [TimeFilter(start=_format_time(s), end=_format_time(e))
+            for s, e in zip(bounds, ends)]
+
+
+def _format_time(t):
+    # whole seconds stay integers, fractions keep nanosecond precision
+    t = t.quantize(NANOSECOND)
+    return str(t.to_integral_value()) if t == t.to_integral_value() \
+        else str(t.normalize())
 
 
 class Export(object):
-    def __init__(self, appresponse, exp_id):
+    def __init__(self, appresponse, exp_id, manager=None):
         self.appresponse = appresponse
         self.exp_id = exp_id
+        self.manager = manager
         self.datarep = appresponse.export.servicedef.bind('export', id=exp_id)
 
     def __enter__(self):
@@ -51,52 +398,148 @@ class Export(object):
     def __exit__(self, type, value, traceback):
         self.delete()
 
-    def download(self, filename, overwrite, retries=3, delay=5):
+    @property
+    def state(self):
+        """Current state of the export, None if not reported."""
+        status = self.datarep.execute('get').data.get('status') or {}
+        return status.get('state')
+
+    def wait_until_ready(self, timeout=None):
+        """Poll the export until packets can be downloaded.
+
+        The export is ready in one of READY_STATES and raises
+        AppResponseException at once in one of FAILED_STATES; states are
+        compared regardless of case. Other states, such as UNINITIALIZED,
+        are polled again.
+
+        Polls start at POLL_INTERVAL seconds and back off up to
+        MAX_POLL_INTERVAL, so a quick export is picked up almost at once
+        while a slow one is not hammered.
+
+        :param timeout: seconds to wait before raising AppResponseTimeout,
+            None waits forever
+        :return: state of the export
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        interval = POLL_INTERVAL
+        while True:
+            state = self.state
+            # without a state let the download find out
+            if state is None or state.upper() in READY_STATES:
+                return state
+            if state.upper() in FAILED_STATES:
+                msg = 'Export {} failed with state {}'.format(self.exp_id,
+                                                              state)
+                raise AppResponseException(msg)
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    msg = ('Export {} not ready after {}s, state {}'
+                           .format(self.exp_id, timeout, state))
+                    raise AppResponseTimeout(msg)
+
+            logger.debug('Export {} is {}, checking again in {}s'
+                         .format(self.exp_id, state, interval))
+            time.sleep(interval if remaining is None
+                       else min(interval, remaining))
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def download(self, filename, overwrite, retries=None, delay=None,
+                 resume=False, timeout=None):
         """Download a created export.
 
+        The download starts as soon as the export is ready, see
+        `wait_until_ready`. An export reporting no state is downloaded
+        at once, and retried while still initializing with the same
+        backoff as the polls.
+
         :param str filename: path to save downloaded file
         :param bool overwrite: true if existing file can be overwritten
-        :param int retries: number of times to retry if export isn't ready
-        :param int delay: time to sleep between retries
+        :param int retries: with `delay`, bounds the time waited for the
+            export to be ready to `retries` * `delay` seconds, kept for
+            callers of the retry loop this replaces
+        :param int delay: see `retries`
+        :param bool resume: continue an interrupted download of
+            `filename` instead of starting over
+        :param timeout: seconds to wait for the export to be ready,
+            defaults to READY_TIMEOUT
+        :return: path of the downloaded file, as a DownloadResult with
+            its size, sha256 and number of packets, see
+            AppResponse.download
+        """
+        if timeout is None:
+            if retries is not None and delay is not None:
+                timeout = retries * delay
+            else:
+                timeout = READY_TIMEOUT
+        deadline = time.time() + timeout
+
+        interval = POLL_INTERVAL
+        while True:
+            self.wait_until_ready(max(0, deadline - time.time()))
+            try:
+                return self.appresponse.download(self.exp_id, filename,
+                                                 overwrite, resume=resume)
+            except RvbdHTTPException as e:
+                # the export may still be initializing when its state is
+                # not reported, or flip back while starting
+                if not _not_initialized(e) or time.time() >= deadline:
+                    raise
+                logger.info('Export {} not ready, re-trying in {}s ...'
+                            .format(self.exp_id, interval))
+                time.sleep(max(0, min(interval, deadline - time.time())))
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def iter_packets(self, chunk_size=STREAM_CHUNK_SIZE, timeout=None):
+        """Stream the packets of the export without writing them to disk.
 
-        TODO: [mzetea]: refactor this to proper recursion
+        The export is downloaded as it is read and parsed incrementally,
+        pcap or pcapng alike, see pcap.StreamParser.
+
+        :param int chunk_size: number of bytes read from the response at
+            a time
+        :param timeout: seconds to wait for the export to be ready
+        :return: iterator of (timestamp, origlen, data) tuples, timestamp
+            in nanoseconds since the epoch, origlen the length of the
+            packet on the wire and data a memoryview of the captured bytes
         """
+        self.wait_until_ready(timeout)
+
+        conn = self.appresponse.export.servicedef.connection
+        uri = '{}/packets/items/{}'.format(
+            self.appresponse.export.servicedef.servicepath, self.exp_id)
+        headers = conn._prepare_headers(None)
+        # same as Connection.download, avoid hanging on Keep-Alive responses
+        headers['Connection'] = 'Close'
+        r = conn._request('GET', uri, None, None, headers, stream=True)
+
+        parser = pcap.StreamParser()
         try:
-            self.appresponse.download(self.exp_id, filename, overwrite)
-            return
-        except RvbdHTTPException as e:
-            # while we are waiting for the export to finish initializing,
-            # retry the query checking the exception to make sure something
-            # else didn't go wrong
-
-            def not_initialized(exc):
-                return ('state is not RUNNING: state UNINITIALIZED'
-                        in exc.error_text)
-
-            if not_initialized(e):
-                while retries > 0:
-                    logger.info('Export %s not ready, re-trying ...' %
-                                self.exp_id)
-                    time.sleep(delay)
-                    try:
-                        self.appresponse.download(self.exp_id,
-                                                  filename, overwrite)
-                        return
-                    except RvbdHTTPException as inner_e:
-                        # renamed the exception variable
-                        # not to shadow the upper except
-                        if not_initialized(inner_e):
-                            retries = retries - 1
-                            continue
-                        else:
-                            raise RvbdHTTPException(inner_e)
-                # if we get here, the export still isn't ready
-                raise RvbdHTTPException(e)
-            else:
-                raise RvbdHTTPException(e)
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield from parser.feed(chunk)
+            parser.close()
+        finally:
+            r.close()
 
     def delete(self):
+        """Delete the export from the appliance.
+
+        Failures are logged rather than raised; the export then stays
+        registered so a later cleanup can try again.
+
+        :return: True if the export is gone
+        """
         try:
             self.datarep.execute('delete')
-        except:
-            pass
+        except Exception as e:
+            if not (isinstance(e, RvbdHTTPException) and e.status == 404):
+                logger.warning('Failed to delete export {}: {}'
+                               .format(self.exp_id, e))
+                return False
+
+        if self.manager is not None:
+            self.manager.unregister(self)
+        return True
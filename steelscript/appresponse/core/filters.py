@@ -0,0 +1,390 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+"""Client-side parsing of traffic filter expressions.
+
+STEELFILTER expressions are parsed into a small AST which can be printed
+back in a canonical form, e.g. for cache keys, and whose column ids can
+be checked against the columns of a report source. BPF expressions only
+get a structural syntax check. The parsers cover the common syntax only,
+so by default an expression they do not understand is logged as a
+warning and left for the appliance to judge, see `check_filter`.
+"""
+
+import re
+import logging
+import functools
+
+from steelscript.appresponse.core.types import AppResponseException
+
+logger = logging.getLogger(__name__)
+
+
+class FilterSyntaxError(AppResponseException):
+    pass
+
+
+# '=' is the same as '==', '~' and '!~' match regular expressions
+COMPARISONS = ('==', '!=', '<=', '>=', '<', '>', '=', '~', '!~')
+
+_KEYWORDS = {'and': 'and', '&&': 'and',
+             'or': 'or', '||': 'or',
+             'not': 'not', '!': 'not',
+             'in': 'in'}
+
+# brackets enclosing the values of 'in'
+_LISTS = {'[': ']', '{': '}', '(': ')'}
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+      (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    | (?P<op>==|!=|!~|<=|>=|&&|\|\||[<>!()=~\[\]{},])
+    | (?P<word>[^\s"'()<>=!~&|\[\]{},]+)
+    )''', re.VERBOSE)
+
+
+def _tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        m = _TOKEN_RE.match(expression, pos)
+        if m is None or m.end() == pos:
+            msg = 'Unexpected character {!r} at position {} in filter {!r}'
+            raise FilterSyntaxError(msg.format(expression[pos], pos,
+                                               expression))
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'word' and value.lower() in _KEYWORDS:
+            kind, value = 'op', _KEYWORDS[value.lower()]
+        elif kind == 'op' and value in _KEYWORDS:
+            value = _KEYWORDS[value]
+        tokens.append((kind, value, m.start(kind)))
+        pos = m.end()
+    return tokens
+
+
+class Node(object):
+    """Node of a parsed filter expression; `str` gives its canonical
+    form."""
+
+    def columns(self):
+        """Return the set of column ids used by the expression."""
+        return set()
+
+
+class Comparison(Node):
+
+    def __init__(self, column, op, value):
+        self.column = column
+        # '=' is kept as '==' so both spellings canonicalize the same
+        self.op = '==' if op == '=' else op
+        self.value = value
+
+    def __str__(self):
+        return '{}{}{}'.format(self.column, self.op, _canonical_value(
+            self.value))
+
+    def columns(self):
+        return set([self.column])
+
+
+class Membership(Node):
+    """Column compared to a list of values with 'in'."""
+
+    def __init__(self, column, values):
+        self.column = column
+        self.values = values
+
+    def __str__(self):
+        values = sorted(_canonical_value(v) for v in self.values)
+        return '{} in {{{}}}'.format(self.column, ' '.join(values))
+
+    def columns(self):
+        return set([self.column])
+
+
+class Field(Node):
+    """Column used on its own, true when the column has a value."""
+
+    def __init__(self, column):
+        self.column = column
+
+    def __str__(self):
+        return self.column
+
+    def columns(self):
+        return set([self.column])
+
+
+class Not(Node):
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def __str__(self):
+        return 'not {}'.format(_wrap(self.operand))
+
+    def columns(self):
+        return self.operand.columns()
+
+
+class BoolOp(Node):
+    """'and' or 'or' of two or more operands.
+
+    Nested operations of the same kind are flattened and the operands
+    sorted in the canonical form, so equivalent expressions written in
+    another order give the same string.
+    """
+
+    def __init__(self, op, operands):
+        self.op = op
+        self.operands = []
+        for operand in operands:
+            if isinstance(operand, BoolOp) and operand.op == op:
+                self.operands.extend(operand.operands)
+            else:
+                self.operands.append(operand)
+
+    def __str__(self):
+        parts = sorted(_wrap(o) for o in self.operands)
+        return ' {} '.format(self.op).join(parts)
+
+    def columns(self):
+        ret = set()
+        for operand in self.operands:
+            ret |= operand.columns()
+        return ret
+
+
+def _wrap(node):
+    if isinstance(node, BoolOp):
+        return '({})'.format(node)
+    return str(node)
+
+
+def _canonical_value(value):
+    if value[0] in '"\'':
+        # Quote strings the same way whatever quotes were used, keeping
+        # other escapes as they are, e.g. in regular expressions
+        return '"{}"'.format(re.sub(r'\\(.)|"', _requote, value[1:-1]))
+    return value
+
+
+def _requote(match):
+    if match.group(1) is None:
+        return '\\"'
+    if match.group(1) == "'":
+        return "'"
+    return match.group(0)
+
+
+class _Parser(object):
+    """Recursive descent parser, `or` binding looser than `and`, which
+    binds looser than `not`."""
+
+    def __init__(self, expression, tokens):
+        self.expression = expression
+        self.tokens = tokens
+        self.pos = 0
+
+    def error(self, msg):
+        if self.pos < len(self.tokens):
+            where = 'at position {}'.format(self.tokens[self.pos][2])
+        else:
+            where = 'at end'
+        raise FilterSyntaxError('{} {} in filter {!r}'.format(
+            msg, where, self.expression))
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None, None, None
+
+    def accept(self, kind, value=None):
+        tkind, tvalue, _ = self.peek()
+        if tkind == kind and (value is None or tvalue == value):
+            self.pos += 1
+            return tvalue
+        return None
+
+    def parse(self):
+        if not self.tokens:
+            self.error('Empty expression')
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            self.error('Unexpected {!r}'.format(self.tokens[self.pos][1]))
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.accept('op', 'or'):
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else BoolOp('or', operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.accept('op', 'and'):
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else BoolOp('and', operands)
+
+    def parse_not(self):
+        if self.accept('op', 'not'):
+            return Not(self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        if self.accept('op', '('):
+            node = self.parse_or()
+            if not self.accept('op', ')'):
+                self.error('Missing closing parenthesis')
+            return node
+
+        column = self.accept('word')
+        if column is None:
+            self.error('Expected a column id')
+
+        if self.accept('op', 'in'):
+            return Membership(column, self.parse_list())
+
+        kind, op, _ = self.peek()
+        if kind != 'op' or op not in COMPARISONS:
+            return Field(column)
+        self.pos += 1
+
+        value = self.accept('string') or self.accept('word')
+        if value is None:
+            self.error('Expected a value after {!r}'.format(op))
+        return Comparison(column, op, value)
+
+    def parse_list(self):
+        """Parse the values of 'in', e.g. {80 443} or [80, 443]."""
+        kind, opening, _ = self.peek()
+        if kind != 'op' or opening not in _LISTS:
+            self.error("Expected a list of values after 'in'")
+        self.pos += 1
+
+        values = []
+        while not self.accept('op', _LISTS[opening]):
+            value = self.accept('string') or self.accept('word')
+            if value is None:
+                self.error('Expected a value or {!r}'.format(
+                    _LISTS[opening]))
+            values.append(value)
+            self.accept('op', ',')
+        if not values:
+            self.error("Empty list of values for 'in'")
+        return values
+
+
+@functools.lru_cache(maxsize=256)
+def parse_steelfilter(expression):
+    """Parse a STEELFILTER expression.
+
+    :param str expression: e.g. 'tcp.port==80 or not ip.addr=="1.2.3.4"'
+    :return: root Node of the expression, `str` of which is canonical
+    :raises FilterSyntaxError: if the expression is malformed
+    """
+    return _Parser(expression, _tokenize(expression)).parse()
+
+
+def canonicalize(expression):
+    """Return the canonical form of a STEELFILTER expression."""
+    return str(parse_steelfilter(expression))
+
+
+def validate_columns(node, source):
+    """Check the columns used by a parsed STEELFILTER expression exist in
+    a report source and can be filtered on.
+
+    :param node: root Node returned by parse_steelfilter
+    :param dict source: report source, as in ReportService.sources
+    :raises AppResponseException: naming the offending columns
+    """
+    columns = source['columns']
+    unknown = sorted(c for c in node.columns() if c not in columns)
+    if unknown:
+        msg = ('Filter column(s) {} not found in source {}'
+               .format(', '.join(unknown), source.get('name')))
+        raise AppResponseException(msg)
+
+    if not source.get('filters_on_metrics', True):
+        metrics = sorted(c for c in node.columns()
+                         if not columns[c].get('grouped_by'))
+        if metrics:
+            msg = ('Source {} does not support filters on metric column(s) '
+                   '{}'.format(source.get('name'), ', '.join(metrics)))
+            raise AppResponseException(msg)
+
+
+# BPF primitives are sequences of words joined by and/or/not; only the
+# boolean structure and the parentheses are checked
+_BPF_TOKEN_RE = re.compile(r'\(|\)|&&|\|\||[&|]|[^\s()&|]+')
+
+
+def check_bpf(expression):
+    """Check the structure of a BPF expression.
+
+    This catches unbalanced parentheses, empty expressions and dangling
+    'and'/'or', which are the usual typos; the primitives themselves are
+    left for the appliance to validate.
+
+    :raises FilterSyntaxError: if the expression is malformed
+    """
+    depth = 0
+    # whether an operand is expected next, i.e. after a binary operator
+    expect_operand = True
+    for token in _BPF_TOKEN_RE.findall(expression):
+        lower = token.lower()
+        if token == '(':
+            depth += 1
+            expect_operand = True
+        elif token == ')':
+            if depth == 0 or expect_operand:
+                msg = 'Unbalanced or empty parentheses in BPF filter {!r}'
+                raise FilterSyntaxError(msg.format(expression))
+            depth -= 1
+            expect_operand = False
+        elif lower in ('and', 'or', '&&', '||'):
+            if expect_operand:
+                msg = 'Dangling {!r} in BPF filter {!r}'
+                raise FilterSyntaxError(msg.format(token, expression))
+            expect_operand = True
+        elif lower not in ('not', '!'):
+            expect_operand = False
+
+    if depth:
+        msg = 'Missing closing parenthesis in BPF filter {!r}'
+        raise FilterSyntaxError(msg.format(expression))
+    if expect_operand:
+        msg = 'Incomplete BPF filter {!r}'.format(expression)
+        raise FilterSyntaxError(msg)
+
+
+def check_filter(type_, value, strict=False):
+    """Check the syntax of a filter expression of any type.
+
+    WIRESHARK expressions are not checked. The appliance accepts more
+    than the parsers here know about, so an expression they reject is
+    only logged as a warning, and sent as is, unless `strict` is True.
+
+    :param bool strict: raise FilterSyntaxError for an expression that
+        could not be parsed
+    :return: parsed Node for STEELFILTER expressions, None otherwise or
+        if the expression could not be parsed
+    """
+    type_ = (type_ or 'STEELFILTER').upper()
+    try:
+        if type_ == 'STEELFILTER':
+            return parse_steelfilter(value)
+        if type_ == 'BPF':
+            check_bpf(value)
+    except FilterSyntaxError as e:
+        if strict:
+            raise
+        logger.warning('{}, leaving it for the appliance to check'
+                       .format(e))
+    return None
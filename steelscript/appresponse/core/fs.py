@@ -4,13 +4,27 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import time
 import logging
 import os
 
-from steelscript.appresponse.core.types import ServiceClass, ResourceObject
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+from steelscript.appresponse.core.types import ServiceClass, ResourceObject, \
+    AppResponseException
 
 logger = logging.getLogger(__name__)
 
+# Default number of files uploaded at a time by upload_many
+UPLOAD_WORKERS = 4
+
+UPLOADED = 'uploaded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
 
 class FileSystemService(ServiceClass):
     """This class provides an interface to manage directories and files on
@@ -22,6 +36,11 @@ class FileSystemService(ServiceClass):
         self.servicedef = None
         self.filesystem = None
         self._file_objs = None
+        self._files_token = None
+        self._index = None
+
+        # directory -> (raw file items, File objects) of the last listing
+        self._dirs = {}
 
     def _bind_resources(self):
 
@@ -37,33 +56,160 @@ class FileSystemService(ServiceClass):
         if not self._file_objs or force:
             resp = self.filesystem.execute('get')
 
-            def find_files(data, files=None):
-                """Recursive function which traverses directories."""
-                if files is None:
-                    files = []
-
-                if list(data.keys()) == ['items']:
-                    data = data['items']
+            # Only rebuild the objects if the listing changed
+            token = self._listing_token(self.filesystem)
+            if (token is not None and token == self._files_token and
+                    self._file_objs is not None):
+                return self._file_objs
+            self._files_token = token
 
-                for element in data:
-                    # [mzetea] - rather than searching in a list
-                    # (log(n)) we can try dict access O(1)
-                    # dirs = element.get('dirs')
-                    # if dirs is not None: find_files(dirs, files=files)
-                    # same goes below unless it's not a dict we expect...
-                    if 'dirs' in element and element['dirs']:
-                        find_files(element['dirs'], files=files)
-
-                    if 'files' in element and element['files']:
-                        filelist = [File(data=f, servicedef=self.servicedef)
-                                    for f in element['files']['items']]
-                        files.extend(filelist)
-                return files
-
-            self._file_objs = find_files(resp.data)
+            self._refresh(resp.data)
 
         return self._file_objs
 
+    def iter_files(self, data=None):
+        """Yield a File object for each file on the filesystem.
+
+        The directory tree is walked with an explicit stack, so deep trees
+        do not hit the recursion limit and files are produced as they are
+        found rather than collected first.
+
+        :param data: filesystem listing to walk, fetched if not given
+        """
+        if data is None:
+            data = self.filesystem.execute('get').data
+
+        for _, items in _walk_dirs(data):
+            for f in items:
+                yield File(data=f, servicedef=self.servicedef)
+
+    def _refresh(self, data):
+        """Update the file objects and the path index from a filesystem
+        listing, only rebuilding the directories whose files changed."""
+        if self._index is None:
+            self._index = FileIndex()
+
+        dirs = {}
+        for key, items in _walk_dirs(data):
+            old = self._dirs.pop(key, None)
+            if old is not None and old[0] == items:
+                dirs[key] = old
+                continue
+
+            if old is not None:
+                for f in old[1]:
+                    self._index.remove(f.path)
+            files = [File(data=f, servicedef=self.servicedef) for f in items]
+            for f in files:
+                self._index.add(f)
+            dirs[key] = (items, files)
+
+        # whatever is left is gone from the appliance
+        for _, files in self._dirs.values():
+            for f in files:
+                self._index.remove(f.path)
+
+        self._dirs = dirs
+        self._file_objs = [f for _, files in dirs.values() for f in files]
+
+    def find_files(self, path='/', type_=None, force=False):
+        """Find files below a directory using the path index.
+
+        :param str path: directory to search, '/' for the whole filesystem
+        :param str type_: only return files of this type, e.g.
+            'MULTISEGMENT_FILE'
+        :param bool force: refresh the listing first
+        :return: list of File objects
+        """
+        self.get_files(force=force)
+        return list(self._index.find(path, type_=type_))
+
+    def get_msa_files(self, force=False):
+        """Get all multi-segment files on the filesystem."""
+        return self.find_files(type_=File.MSA_TYPE, force=force)
+
+    def upload_many(self, paths, dest_dir, max_concurrency=UPLOAD_WORKERS,
+                    chunk_size=None):
+        """Upload local files into one directory of the appliance.
+
+        Missing directories of `dest_dir` are created first. Files already
+        present in `dest_dir` with the same name and size are skipped, the
+        others are uploaded `max_concurrency` at a time. A failed upload
+        does not stop the others.
+
+        :param list paths: paths of the local files
+        :param str dest_dir: directory on the appliance, e.g. '/uploads'
+        :param int max_concurrency: number of files uploaded at a time
+        :param int chunk_size: number of bytes sent at a time per file,
+            defaults to AppResponse.upload's
+        :return: list of UploadResult objects, in the order of `paths`
+        """
+        dest_dir = '/' + dest_dir.strip('/')
+
+        results = []
+        for path in paths:
+            dest_path = '{}/{}'.format(dest_dir, os.path.basename(path))
+            results.append(UploadResult(path, dest_path,
+                                        os.path.getsize(path)))
+
+        dest_paths = [r.dest_path for r in results]
+        if len(set(dest_paths)) != len(dest_paths):
+            msg = 'Files to upload to {} need distinct names'.format(dest_dir)
+            raise AppResponseException(msg)
+
+        self.get_files(force=True)
+        self._create_missing_dirs(dest_dir)
+
+        pending = []
+        for result in results:
+            existing = self._index.get(result.dest_path)
+            if existing is not None and existing.size == result.size:
+                logger.debug('Skipping {}, already present as {}'
+                             .format(result.path, result.dest_path))
+                result.status = SKIPPED
+            else:
+                pending.append(result)
+
+        if pending:
+            workers = _ensure_pool_size(self.servicedef.connection,
+                                        min(max_concurrency, len(pending)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(
+                    lambda r: self._upload_one(r, chunk_size), pending))
+
+        logger.info('Uploaded {} of {} files to {}, {} skipped, {} failed'
+                    .format(sum(r.status == UPLOADED for r in results),
+                            len(results), dest_dir,
+                            sum(r.status == SKIPPED for r in results),
+                            sum(r.status == FAILED for r in results)))
+        return results
+
+    def _create_missing_dirs(self, dest_dir):
+        parts = dest_dir.strip('/').split('/')
+        for i in range(1, len(parts) + 1):
+            path = '/' + '/'.join(parts[:i])
+            if path not in self._dirs:
+                logger.debug('Creating directory {}'.format(path))
+                self.create_dir(path)
+
+    def _upload_one(self, result, chunk_size):
+        kwargs = {'return_checksum': True}
+        if chunk_size is not None:
+            kwargs['chunk_size'] = chunk_size
+
+        started = time.time()
+        try:
+            _, result.checksum = self.appresponse.upload(
+                result.dest_path, result.path, **kwargs)
+        except Exception as e:
+            logger.warning('Failed to upload {}: {}'.format(result.path, e))
+            result.status = FAILED
+            result.error = e
+        else:
+            result.status = UPLOADED
+        result.elapsed = time.time() - started
+        return result
+
     def get_file_by_id(self, id_):
 
         logger.debug("Get file object with id {}".format(id_))
@@ -98,10 +244,178 @@ class FileSystemService(ServiceClass):
             return self.get_file_by_id(fullpath)
 
 
+def _walk_dirs(data):
+    """Yield (directory key, list of raw file items) for every directory
+    of a filesystem listing, parents before children."""
+    if list(data.keys()) == ['items']:
+        data = data['items']
+
+    # directories without an id are keyed by their position in the tree
+    stack = deque(reversed([(str(i), e) for i, e in enumerate(data)]))
+    while stack:
+        key, element = stack.pop()
+        key = element.get('id', key)
+
+        files = element.get('files')
+        yield key, (files['items'] if files else [])
+
+        dirs = element.get('dirs')
+        if dirs:
+            if isinstance(dirs, dict):
+                dirs = dirs.get('items', [])
+            stack.extend(reversed([('{}/{}'.format(key, i), e)
+                                   for i, e in enumerate(dirs)]))
+
+
+class _PathNode(object):
+    __slots__ = ('children', 'file')
+
+    def __init__(self):
+        self.children = {}
+        self.file = None
+
+
+class FileIndex(object):
+    """Trie of File objects keyed by the components of their path, for
+    fast lookups of everything below a directory."""
+
+    def __init__(self):
+        self._root = _PathNode()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return self.find('/')
+
+    @staticmethod
+    def _split(path):
+        return [p for p in path.split('/') if p]
+
+    def _node(self, path):
+        node = self._root
+        for part in self._split(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def add(self, file_):
+        node = self._root
+        for part in self._split(file_.path):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = _PathNode()
+            node = child
+        if node.file is None:
+            self._count += 1
+        node.file = file_
+
+    def remove(self, path):
+        parts = self._split(path)
+        trail = [self._root]
+        for part in parts:
+            node = trail[-1].children.get(part)
+            if node is None:
+                return
+            trail.append(node)
+
+        if trail[-1].file is None:
+            return
+        trail[-1].file = None
+        self._count -= 1
+
+        # prune the nodes left empty
+        for i in range(len(parts), 0, -1):
+            if trail[i].file is not None or trail[i].children:
+                break
+            del trail[i - 1].children[parts[i - 1]]
+
+    def get(self, path):
+        node = self._node(path)
+        return node.file if node is not None else None
+
+    def find(self, path='/', type_=None):
+        """Yield the files at or below `path`, optionally of one type."""
+        node = self._node(path)
+        if node is None:
+            return
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.file is not None and (type_ is None or
+                                          node.file.type == type_):
+                yield node.file
+            # visit children in path order
+            children = node.children
+            stack.extend(children[k] for k in sorted(children, reverse=True))
+
+
+class UploadResult(object):
+    """Outcome of uploading one file with upload_many."""
+
+    def __init__(self, path, dest_path, size):
+        self.path = path
+        self.dest_path = dest_path
+        self.size = size
+        self.status = None
+        self.checksum = None
+        self.elapsed = 0.0
+        self.error = None
+
+    def __repr__(self):
+        return '<{} {} -> {} {}>'.format(self.__class__.__name__, self.path,
+                                         self.dest_path, self.status)
+
+    @property
+    def ok(self):
+        return self.status != FAILED
+
+
+def _ensure_pool_size(conn, size):
+    """Make sure the HTTP connection pool of `conn` can hold `size`
+    connections to the appliance, so parallel requests reuse them.
+
+    A plain HTTPAdapter is replaced by one with the same settings and a
+    larger pool. Other adapters, which may carry their own TLS or retry
+    setup, are kept and the caller is told to use fewer connections.
+
+    :return: number of requests to run in parallel, at most `size`
+    """
+    session = conn.conn
+    prefix = conn.hostname
+    adapter = session.get_adapter(prefix)
+    poolmanager = getattr(adapter, 'poolmanager', None)
+    if poolmanager is None:
+        return size
+
+    current = poolmanager.connection_pool_kw.get('maxsize', 1)
+    if current >= size:
+        return size
+
+    if type(adapter) is not HTTPAdapter:
+        logger.debug('Keeping {} for {}, limited to {} connections'
+                     .format(adapter.__class__.__name__, prefix, current))
+        return current
+
+    # rebuilt from the pickled state so every setting carries over
+    state = adapter.__getstate__()
+    state['_pool_maxsize'] = size
+    grown = HTTPAdapter.__new__(HTTPAdapter)
+    grown.__setstate__(state)
+    session.mount(prefix, grown)
+    return size
+
+
 class File(ResourceObject):
+    __slots__ = ()
 
     resource = 'file'
 
+    MSA_TYPE = 'MULTISEGMENT_FILE'
+
     def __str__(self):
         return '<File {}:{}>'.format(self.type, self.path)
 
@@ -116,8 +430,12 @@ class File(ResourceObject):
     def path(self):
         return self.data.id
 
+    @property
+    def size(self):
+        return self.data.get('size')
+
     def is_msa(self):
-        return self.type == 'MULTISEGMENT_FILE'
+        return self.type == self.MSA_TYPE
 
     def delete(self):
         self.datarep.delete()
@@ -0,0 +1,163 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+import json
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+# Last path segment of the collection resources whose listings are cached
+CACHED_COLLECTIONS = ('jobs', 'phys_interfaces', 'clips', 'fs', 'filesystem',
+                      'hostgroups', 'keys', 'images')
+
+
+class _CacheEntry(object):
+
+    def __init__(self, data, digest, etag, last_modified):
+        self.data = data
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache(object):
+    """Cache of collection listings fetched from an AppResponse appliance.
+
+    Each listing is stored with its ETag/Last-Modified validators and a
+    hash of the response body. Listings are then fetched with conditional
+    requests; a 304 response, or a body whose hash did not change when
+    the appliance sends no validators, returns the cached parsed data
+    without parsing it again.
+
+    `token` returns the body hash of a listing, so services can tell
+    that a listing did not change and keep the objects they built from
+    it. Cached data is shared between callers and must not be modified.
+    """
+
+    def __init__(self, collections=CACHED_COLLECTIONS, max_entries=64):
+        self.collections = set(collections)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<{} entries:{} hits:{} misses:{}>'.format(
+            self.__class__.__name__, len(self._entries), self.hits,
+            self.misses)
+
+    def cacheable(self, method, path):
+        if method != 'GET':
+            return False
+        segment = urlparse(path).path.rstrip('/').rsplit('/', 1)[-1]
+        return segment in self.collections
+
+    def _key(self, path, params):
+        path = urlparse(path).path
+        if params:
+            return path, tuple(sorted(params.items()))
+        return path, ()
+
+    def get(self, path, params=None):
+        with self._lock:
+            return self._entries.get(self._key(path, params))
+
+    def token(self, path, params=None):
+        """Return a token which changes only when the listing at `path`
+        changes, None if the listing is not cached."""
+        entry = self.get(path, params)
+        return entry.digest if entry is not None else None
+
+    def invalidate(self, path=None):
+        """Forget the listings at `path` or above it, or every listing."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                return
+            path = urlparse(path).path
+            for key in list(self._entries):
+                if path.startswith(key[0]):
+                    del self._entries[key]
+
+    def request(self, conn, path, params=None, extra_headers=None):
+        """Send a conditional GET for `path` through `conn`.
+
+        :return: tuple of the parsed data and the requests response
+        """
+        key = self._key(path, params)
+        entry = self.get(path, params)
+
+        headers = conn._prepare_headers(extra_headers)
+        headers['Accept'] = 'application/json'
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        r = conn._request('GET', path, '', params, headers)
+
+        if r.status_code == 304 and entry is not None:
+            logger.debug('{} not modified'.format(path))
+            self.hits += 1
+            return entry.data, r
+
+        content = r.content
+        digest = hashlib.sha1(content).hexdigest()
+        if entry is not None and entry.digest == digest:
+            logger.debug('{} unchanged'.format(path))
+            self.hits += 1
+            return entry.data, r
+
+        self.misses += 1
+        data = json.loads(r.text) if content else None
+        entry = _CacheEntry(data, digest, r.headers.get('ETag'),
+                            r.headers.get('Last-Modified'))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data, r
+
+
+class CachingConnection(object):
+    """Connection wrapper answering collection listings from a
+    ResponseCache. Everything else is passed to the wrapped connection."""
+
+    def __init__(self, conn, cache):
+        self._wrapped = conn
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __repr__(self):
+        return '<{} to {}>'.format(self.__class__.__name__,
+                                   self._wrapped.hostname)
+
+    def json_request(self, method, path, body=None, params=None,
+                     extra_headers=None, raw_response=False):
+        if body is not None or not self.cache.cacheable(method, path):
+            # Any change to a collection or its items invalidates
+            # its listing
+            if method != 'GET':
+                self.cache.invalidate(path)
+            return self._wrapped.json_request(method, path, body, params,
+                                              extra_headers, raw_response)
+
+        data, r = self.cache.request(self._wrapped, path, params,
+                                     extra_headers)
+        if raw_response:
+            return data, r
+        return data
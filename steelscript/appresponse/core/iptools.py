@@ -0,0 +1,295 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+"""Mapping of IP addresses to hostgroups, locally.
+
+Hostgroup definitions are loaded into a binary radix tree per address
+family, which answers longest prefix match lookups one address at a time.
+For report data, the IPv4 tree is flattened into sorted intervals so whole
+columns of addresses are matched at once with numpy.
+"""
+
+import socket
+import logging
+import ipaddress
+
+from steelscript.appresponse.core.types import AppResponseException
+
+logger = logging.getLogger(__name__)
+
+
+# Report columns enriched by default, and the suffix of the new columns
+ADDRESS_COLUMNS = ('src_ip.addr', 'dst_ip.addr')
+HOSTGROUP_SUFFIX = '.hostgroup'
+
+
+def parse_hosts(spec):
+    """Return the networks covered by one entry of a hostgroup's hosts.
+
+    :param str spec: address, CIDR such as '10.0.0.0/8' or range such as
+        '10.0.0.1-10.0.0.20'
+    :return: list of IPv4Network or IPv6Network objects
+    """
+    try:
+        if '-' in spec:
+            first, last = spec.split('-', 1)
+            return list(ipaddress.summarize_address_range(
+                ipaddress.ip_address(first.strip()),
+                ipaddress.ip_address(last.strip())))
+        return [ipaddress.ip_network(spec.strip(), strict=False)]
+    except (TypeError, ValueError) as e:
+        msg = 'Invalid hostgroup hosts {!r}: {}'.format(spec, e)
+        raise AppResponseException(msg)
+
+
+def compact_hosts(hosts):
+    """Merge adjacent and overlapping hosts into the fewest CIDRs.
+
+    :param list hosts: addresses, CIDRs and ranges, as in parse_hosts
+    :return: list of CIDRs, IPv4 then IPv6, in address order; single
+        addresses are given without a prefix length
+    """
+    networks = {4: [], 6: []}
+    for spec in hosts:
+        for network in parse_hosts(spec):
+            networks[network.version].append(network)
+
+    ret = []
+    for version in (4, 6):
+        for network in ipaddress.collapse_addresses(networks[version]):
+            if network.prefixlen == network.max_prefixlen:
+                ret.append(str(network.network_address))
+            else:
+                ret.append(str(network))
+    return ret
+
+
+class _Node(object):
+    __slots__ = ('children', 'value')
+
+    def __init__(self):
+        self.children = [None, None]
+        self.value = None
+
+
+class RadixTree(object):
+    """Binary radix tree of IPv4 and IPv6 prefixes, each with a value.
+
+    Lookups return the value of the longest prefix containing the address.
+    Values cannot be None.
+    """
+
+    def __init__(self):
+        self._roots = {4: _Node(), 6: _Node()}
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def insert(self, network, value, replace=False):
+        """Add a prefix.
+
+        :param network: IPv4Network or IPv6Network
+        :param value: value returned by lookups matching the prefix
+        :param bool replace: True to replace the value of a prefix already
+            present, by default the first value is kept
+        :return: True if the value was stored
+        """
+        node = self._roots[network.version]
+        bits = network.max_prefixlen
+        addr = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (addr >> (bits - 1 - i)) & 1
+            child = node.children[bit]
+            if child is None:
+                child = node.children[bit] = _Node()
+            node = child
+
+        if node.value is None:
+            self._len += 1
+        elif not replace:
+            return False
+        node.value = value
+        return True
+
+    def lookup(self, address):
+        """Return the value of the longest prefix containing `address`,
+        None if there is none."""
+        address = ipaddress.ip_address(address)
+        return self._lookup_int(address.version, int(address))
+
+    def _lookup_int(self, version, addr):
+        node = self._roots[version]
+        bits = 32 if version == 4 else 128
+        ret = node.value
+        for i in range(bits - 1, -1, -1):
+            node = node.children[(addr >> i) & 1]
+            if node is None:
+                break
+            if node.value is not None:
+                ret = node.value
+        return ret
+
+    def prefixes(self, version):
+        """Yield (start, end, value) of the prefixes of an address family,
+        as integers."""
+        bits = 32 if version == 4 else 128
+        stack = [(self._roots[version], 0, 0)]
+        while stack:
+            node, addr, depth = stack.pop()
+            if node.value is not None:
+                span = 1 << (bits - depth)
+                yield addr, addr + span - 1, node.value
+            for bit in (1, 0):
+                child = node.children[bit]
+                if child is not None:
+                    stack.append((child, addr | bit << (bits - depth - 1),
+                                  depth + 1))
+
+
+class HostGroupIndex(object):
+    """Index of hostgroups by the addresses they contain.
+
+    An address in several hostgroups maps to the one with the most
+    specific prefix; between identical prefixes the hostgroup added first
+    wins. Only the `hosts` of hostgroups are indexed, not their member
+    hostgroups.
+    """
+
+    def __init__(self, hostgroups=()):
+        """Initialize a HostGroupIndex object.
+
+        :param hostgroups: HostGroup objects, e.g. from
+            ClassificationService.get_hostgroups
+        """
+        self.tree = RadixTree()
+        self._intervals = None
+        for hg in hostgroups:
+            self.add(hg.name, hg.data.get('hosts') or [])
+
+    def __len__(self):
+        return len(self.tree)
+
+    def __repr__(self):
+        return '<{} prefixes:{}>'.format(self.__class__.__name__, len(self))
+
+    def add(self, name, hosts):
+        """Add a hostgroup.
+
+        :param str name: hostgroup name
+        :param list hosts: addresses, CIDRs and ranges of the hostgroup
+        """
+        for spec in hosts:
+            for network in parse_hosts(spec):
+                self.tree.insert(network, name)
+        self._intervals = None
+
+    def lookup(self, address):
+        """Return the name of the hostgroup of `address`, None if it is in
+        none."""
+        return self.tree.lookup(address)
+
+    def lookup_many(self, addresses):
+        """Return the hostgroup names of many addresses.
+
+        IPv4 addresses are matched together against the flattened
+        intervals of the tree; other addresses are looked up one by one.
+        Invalid or missing addresses map to None.
+
+        :param addresses: sequence of address strings
+        :return: numpy array of objects, the names or None
+        """
+        numpy = _numpy()
+        addresses = list(addresses)
+        ret = numpy.full(len(addresses), None, dtype=object)
+        if not addresses:
+            return ret
+
+        try:
+            # fast path, all addresses are IPv4
+            packed = b''.join([socket.inet_pton(socket.AF_INET, a)
+                               for a in addresses])
+            positions = numpy.arange(len(addresses))
+        except (OSError, TypeError, ValueError):
+            packed = []
+            positions = []
+            for i, address in enumerate(addresses):
+                try:
+                    packed.append(socket.inet_pton(socket.AF_INET, address))
+                    positions.append(i)
+                except (OSError, TypeError, ValueError):
+                    try:
+                        ret[i] = self.lookup(address)
+                    except ValueError:
+                        pass
+            packed = b''.join(packed)
+
+        if len(positions):
+            starts, labels = self._flatten()
+            values = numpy.frombuffer(packed, dtype='>u4')
+            ret[positions] = labels[numpy.searchsorted(starts, values,
+                                                       side='right') - 1]
+        return ret
+
+    def _flatten(self):
+        """Return the IPv4 tree as sorted interval starts and the name
+        of each interval."""
+        if self._intervals is None:
+            numpy = _numpy()
+            bounds = set([0])
+            for start, end, _ in self.tree.prefixes(4):
+                bounds.add(start)
+                if end < 0xffffffff:
+                    bounds.add(end + 1)
+
+            starts = []
+            labels = []
+            for bound in sorted(bounds):
+                label = self.tree._lookup_int(4, bound)
+                if not labels or labels[-1] != label:
+                    starts.append(bound)
+                    labels.append(label)
+
+            label_array = numpy.empty(len(labels), dtype=object)
+            label_array[:] = labels
+            self._intervals = (numpy.array(starts, dtype=numpy.uint32),
+                               label_array)
+        return self._intervals
+
+    def enrich(self, df, columns=ADDRESS_COLUMNS, suffix=HOSTGROUP_SUFFIX):
+        """Add the hostgroup of address columns to a DataFrame.
+
+        Each distinct address is looked up once, so the cost depends
+        mostly on the number of distinct addresses rather than of rows.
+
+        :param df: pandas DataFrame, e.g. from Report.get_dataframe
+        :param columns: names of the address columns, the ones missing
+            from `df` are skipped
+        :param str suffix: appended to the name of an address column, less
+            its '.addr' ending, to name its hostgroup column, e.g.
+            'src_ip.hostgroup'
+        :return: `df`, modified in place
+        """
+        numpy = _numpy()
+        for column in columns:
+            if column not in df:
+                continue
+            codes, uniques = df[column].factorize()
+            # code -1 marks missing values, picking the None appended
+            names = numpy.append(self.lookup_many(uniques), None)
+            base = column[:-len('.addr')] if column.endswith('.addr') \
+                else column
+            df[base + suffix] = names[codes]
+        return df
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise AppResponseException("Numpy module is required to look up "
+                                   "many addresses. %s" % e)
+    return numpy
@@ -0,0 +1,145 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+import logging
+
+import numpy
+
+from steelscript.appresponse.core.types import AppResponseException
+
+logger = logging.getLogger(__name__)
+
+
+# Resolutions in nanoseconds, matching the appliance's microburst metrics
+RESOLUTION_10US = 10000
+RESOLUTION_100US = 100000
+RESOLUTION_1MS = 1000000
+
+DEFAULT_RESOLUTIONS = (RESOLUTION_10US, RESOLUTION_100US, RESOLUTION_1MS)
+
+# Packets buffered before being appended to the arrays
+BATCH_SIZE = 65536
+
+
+class MicroburstAnalyzer(object):
+    """Compute microburst byte series from packets, locally.
+
+    Packets are accumulated as arrays of timestamps (nanoseconds) and
+    sizes. Bursts are computed by grouping packets into bins of the
+    requested resolution with numpy; only the bins holding packets are
+    materialised, so an hour at 10us resolution costs memory in proportion
+    to the packets rather than to the 360 million bins.
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS):
+        self.resolutions = tuple(resolutions)
+        self._times = []
+        self._sizes = []
+        self._cache = None
+
+    def __len__(self):
+        return sum(len(t) for t in self._times)
+
+    def __repr__(self):
+        return '<{} packets:{}>'.format(self.__class__.__name__, len(self))
+
+    def add(self, timestamps, sizes):
+        """Add packets given as sequences of timestamps and sizes."""
+        times = numpy.asarray(timestamps, dtype=numpy.int64)
+        sizes = numpy.asarray(sizes, dtype=numpy.int64)
+        if times.shape != sizes.shape:
+            raise AppResponseException('Timestamps and sizes need the same '
+                                       'length')
+        if len(times):
+            self._times.append(times)
+            self._sizes.append(sizes)
+            self._cache = None
+
+    def add_packets(self, packets, batch_size=BATCH_SIZE):
+        """Add packets from an iterator of (timestamp, origlen, data)
+        tuples such as Export.iter_packets.
+
+        Packets count with their length on the wire, as in the appliance's
+        metrics, so packets sliced to a snap length are not under-counted.
+        Packets without a timestamp are skipped.
+        """
+        times = numpy.empty(batch_size, dtype=numpy.int64)
+        sizes = numpy.empty(batch_size, dtype=numpy.int64)
+        n = 0
+        for timestamp, origlen, _ in packets:
+            if timestamp is None:
+                continue
+            times[n] = timestamp
+            sizes[n] = origlen
+            n += 1
+            if n == batch_size:
+                self.add(times.copy(), sizes.copy())
+                n = 0
+        self.add(times[:n].copy(), sizes[:n].copy())
+
+    def _arrays(self):
+        if self._cache is None:
+            if self._times:
+                times = numpy.concatenate(self._times)
+                sizes = numpy.concatenate(self._sizes)
+            else:
+                times = numpy.empty(0, dtype=numpy.int64)
+                sizes = numpy.empty(0, dtype=numpy.int64)
+            # keep the concatenated arrays for the next call
+            self._times, self._sizes = [times], [sizes]
+            self._cache = times, sizes
+        return self._cache
+
+    def series(self, resolution=RESOLUTION_1MS):
+        """Return the bytes sent in each bin holding packets.
+
+        :param int resolution: bin width in nanoseconds
+        :return: tuple of arrays (bin start in nanoseconds, bytes), ordered
+            by time; empty bins are left out
+        """
+        times, sizes = self._arrays()
+        bins, inverse = numpy.unique(times // resolution,
+                                     return_inverse=True)
+        counts = numpy.bincount(inverse.ravel(), weights=sizes,
+                                minlength=len(bins))
+        return bins * resolution, counts.astype(numpy.int64)
+
+    def max_bursts(self):
+        """Return the largest burst in bytes for each resolution."""
+        ret = {}
+        for resolution in self.resolutions:
+            _, counts = self.series(resolution)
+            ret[resolution] = int(counts.max()) if len(counts) else 0
+        return ret
+
+    def summary(self, interval=1000000000):
+        """Return the largest burst of each resolution per interval, as
+        the appliance reports `max_traffic.microburst_*_bytes`.
+
+        :param int interval: interval in nanoseconds, a multiple of every
+            resolution
+        :return: dict with the 'time' array of interval starts in
+            nanoseconds and one array of bytes per resolution
+        """
+        for resolution in self.resolutions:
+            if interval % resolution:
+                msg = ('Interval {} is not a multiple of resolution {}'
+                       .format(interval, resolution))
+                raise AppResponseException(msg)
+
+        times, _ = self._arrays()
+        intervals = numpy.unique(times // interval)
+        ret = {'time': intervals * interval}
+        for resolution in self.resolutions:
+            starts, counts = self.series(resolution)
+            groups = starts // interval
+            # bins are sorted, so each interval is a contiguous run
+            first = numpy.searchsorted(groups, intervals)
+            if len(first):
+                ret[resolution] = numpy.maximum.reduceat(counts, first)
+            else:
+                ret[resolution] = counts
+        return ret
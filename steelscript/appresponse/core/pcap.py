@@ -0,0 +1,413 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+import heapq
+import itertools
+import logging
+import struct
+
+from steelscript.appresponse.core.types import AppResponseException
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC_USEC = 0xa1b2c3d4
+MAGIC_NSEC = 0xa1b23c4d
+MAGIC_PCAPNG = 0x0a0d0d0a
+
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+# bytes read from each input at a time by merge
+MERGE_CHUNK_SIZE = 1024 * 1024
+
+# pcapng block types
+SECTION_HEADER_BLOCK = b'\x0a\x0d\x0d\x0a'
+INTERFACE_BLOCK = 1
+SIMPLE_PACKET_BLOCK = 3
+ENHANCED_PACKET_BLOCK = 6
+
+# pcapng interface description options
+IF_TSRESOL = 9
+IF_TSOFFSET = 14
+
+
+class PcapError(AppResponseException):
+    pass
+
+
+def _parse_global_header(header):
+    """Return (byte order, nanosecond, snaplen, linktype) of a classic
+    pcap global header."""
+    if len(header) < GLOBAL_HEADER_LEN:
+        raise PcapError('Truncated pcap header')
+
+    for order in '<>':
+        magic, = struct.unpack(order + 'I', header[:4])
+        if magic in (MAGIC_USEC, MAGIC_NSEC):
+            break
+    else:
+        if struct.unpack('<I', header[:4])[0] == MAGIC_PCAPNG:
+            raise PcapError('pcapng files are not supported')
+        raise PcapError('Not a pcap file')
+
+    _, _, _, _, snaplen, linktype = struct.unpack(
+        order + 'HHiIII', header[4:GLOBAL_HEADER_LEN])
+    return order, magic == MAGIC_NSEC, snaplen, linktype
+
+
+class PcapReader(object):
+    """Read the packets of a classic pcap file one at a time.
+
+    Iterating the reader yields (timestamp, origlen, data) tuples where
+    the timestamp is in nanoseconds since the epoch whatever the
+    resolution of the file, and `data` holds the captured bytes.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        header = fileobj.read(GLOBAL_HEADER_LEN)
+        (self.byteorder, self.nanosecond, self.snaplen,
+         self.linktype) = _parse_global_header(header)
+        self._record = struct.Struct(self.byteorder + 'IIII')
+        self._scale = 1 if self.nanosecond else 1000
+
+    def __iter__(self):
+        read = self.fileobj.read
+        unpack = self._record.unpack
+        scale = self._scale
+        while True:
+            header = read(RECORD_HEADER_LEN)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER_LEN:
+                raise PcapError('Truncated pcap record header')
+
+            sec, frac, caplen, origlen = unpack(header)
+            data = read(caplen)
+            if len(data) < caplen:
+                raise PcapError('Truncated pcap record')
+            yield sec * 1000000000 + frac * scale, origlen, data
+
+
+class PcapWriter(object):
+    """Write packets to a classic pcap file."""
+
+    def __init__(self, fileobj, linktype, snaplen=65535, nanosecond=False):
+        self.fileobj = fileobj
+        self.nanosecond = nanosecond
+        self._record = struct.Struct('<IIII')
+        self._divisor = 1 if nanosecond else 1000
+        magic = MAGIC_NSEC if nanosecond else MAGIC_USEC
+        fileobj.write(struct.pack('<IHHiIII', magic, 2, 4, 0, 0, snaplen,
+                                  linktype))
+
+    def write(self, timestamp, data, origlen=None):
+        """Write one packet.
+
+        :param int timestamp: nanoseconds since the epoch
+        :param data: captured bytes
+        :param int origlen: length of the packet on the wire, defaults to
+            the captured length
+        """
+        sec, nsec = divmod(timestamp, 1000000000)
+        caplen = len(data)
+        self.fileobj.write(self._record.pack(
+            sec, nsec // self._divisor, caplen,
+            caplen if origlen is None else origlen))
+        self.fileobj.write(data)
+
+
+class _Interface(object):
+    """pcapng interface, with what is needed to read its timestamps."""
+
+    def __init__(self, linktype, snaplen, units=1000000, offset=0):
+        self.linktype = linktype
+        self.snaplen = snaplen
+        # timestamp units per second and offset in seconds
+        self.units = units
+        self.offset = offset
+
+    def nanoseconds(self, ts):
+        return ts * 1000000000 // self.units + self.offset * 1000000000
+
+
+class StreamParser(object):
+    """Incremental parser of pcap and pcapng byte streams.
+
+    Chunks of a capture are passed to `feed` as they arrive, which yields
+    a (timestamp, origlen, data) tuple for each packet completed by the
+    chunk, as PcapReader does. The timestamp is in nanoseconds since the
+    epoch, None for pcapng simple packet blocks which carry none. `origlen`
+    is the length of the packet on the wire, which is more than the
+    captured length `len(data)` when the capture was sliced to a snap
+    length. `data` is a memoryview
+    into the chunk itself, copied first only if it is not already bytes,
+    so packets stay valid after later chunks are fed. Only a record split
+    across chunks is copied, into a buffer of its own, and only the bytes
+    of that record are taken from the next chunk.
+    """
+
+    def __init__(self):
+        self.format = None
+        self.linktype = None
+        self.snaplen = None
+        # whether timestamps are finer than microseconds
+        self.nanosecond = False
+        self._pending = bytearray()
+
+        # classic pcap
+        self._record = None
+        self._scale = None
+
+        # pcapng
+        self._order = None
+        self._interfaces = []
+
+    def feed(self, data):
+        """Parse a chunk of the stream, yielding the packets it
+        completes."""
+        if not isinstance(data, bytes):
+            # packets are views into the buffer, which must not change
+            data = bytes(data)
+
+        offset = 0
+        while self._pending:
+            # complete the record split by the previous chunk with only
+            # the bytes it is missing
+            missing = self._unit_size(self._pending) - len(self._pending)
+            if missing > len(data) - offset:
+                self._pending += data[offset:]
+                return
+            if missing > 0:
+                self._pending += data[offset:offset + missing]
+                offset += missing
+                # a completed header may tell the record is longer
+                continue
+            buf = bytes(self._pending)
+            consumed = yield from self._parse(buf, 0)
+            self._pending = bytearray(buf[consumed:])
+
+        if self.format is None and len(data) - offset < 4:
+            self._pending += data[offset:]
+            return
+        consumed = yield from self._parse(data, offset)
+        self._pending += data[consumed:]
+
+    def close(self):
+        """Check the stream ended on a packet boundary."""
+        if self._pending:
+            raise PcapError('Truncated capture, {} trailing bytes'
+                            .format(len(self._pending)))
+
+    def _detect(self, buf, offset):
+        if buf[offset:offset + 4] == SECTION_HEADER_BLOCK:
+            self.format = 'pcapng'
+        else:
+            self.format = 'pcap'
+
+    def _parse(self, buf, offset):
+        """Parse `buf` from `offset`, yielding its complete packets and
+        returning the offset of the first byte left unparsed."""
+        if self.format is None:
+            self._detect(buf, offset)
+        if self.format == 'pcap':
+            return (yield from self._parse_pcap(buf, offset))
+        return (yield from self._parse_pcapng(buf, offset))
+
+    def _unit_size(self, buf):
+        """Return the length of the header, record or block at the start
+        of `buf`, or the number of bytes needed to tell it."""
+        if self.format is None:
+            if len(buf) < 4:
+                return 4
+            self._detect(buf, 0)
+
+        if self.format == 'pcap':
+            if self._record is None:
+                return GLOBAL_HEADER_LEN
+            if len(buf) < RECORD_HEADER_LEN:
+                return RECORD_HEADER_LEN
+            return RECORD_HEADER_LEN + self._record.unpack_from(buf)[2]
+
+        if len(buf) < 12:
+            return 12
+        order = self._order or '<'
+        if buf[:4] == SECTION_HEADER_BLOCK:
+            order = '>' if buf[8:12] == b'\x1a\x2b\x3c\x4d' else '<'
+        blen, = struct.unpack_from(order + 'I', buf, 4)
+        # an invalid length is reported by the parser
+        return max(blen, 12)
+
+    def _parse_pcap(self, buf, offset):
+        end = len(buf)
+        if self._record is None:
+            if end - offset < GLOBAL_HEADER_LEN:
+                return offset
+            (order, self.nanosecond, self.snaplen,
+             self.linktype) = _parse_global_header(
+                buf[offset:offset + GLOBAL_HEADER_LEN])
+            self._record = struct.Struct(order + 'IIII')
+            self._scale = 1 if self.nanosecond else 1000
+            offset += GLOBAL_HEADER_LEN
+
+        view = memoryview(buf)
+        unpack_from = self._record.unpack_from
+        scale = self._scale
+        while end - offset >= RECORD_HEADER_LEN:
+            sec, frac, caplen, origlen = unpack_from(buf, offset)
+            start = offset + RECORD_HEADER_LEN
+            if end - start < caplen:
+                break
+            yield (sec * 1000000000 + frac * scale, origlen,
+                   view[start:start + caplen])
+            offset = start + caplen
+        return offset
+
+    def _parse_pcapng(self, buf, offset):
+        end = len(buf)
+        view = memoryview(buf)
+        while end - offset >= 12:
+            if buf[offset:offset + 4] == SECTION_HEADER_BLOCK:
+                # a new section sets the byte order and its interfaces
+                bom = buf[offset + 8:offset + 12]
+                if bom == b'\x4d\x3c\x2b\x1a':
+                    self._order = '<'
+                elif bom == b'\x1a\x2b\x3c\x4d':
+                    self._order = '>'
+                else:
+                    raise PcapError('Invalid pcapng byte order magic')
+                self._interfaces = []
+            elif self._order is None:
+                raise PcapError('pcapng stream does not start with a '
+                                'section header')
+
+            order = self._order
+            btype, blen = struct.unpack_from(order + 'II', buf, offset)
+            if blen < 12 or blen % 4:
+                raise PcapError('Invalid pcapng block length {}'
+                                .format(blen))
+            if end - offset < blen:
+                break
+
+            body = offset + 8
+            if btype == ENHANCED_PACKET_BLOCK:
+                iface, high, low, caplen, origlen = struct.unpack_from(
+                    order + 'IIIII', buf, body)
+                if iface >= len(self._interfaces):
+                    raise PcapError('Packet of undeclared interface {}'
+                                    .format(iface))
+                start = body + 20
+                ts = self._interfaces[iface].nanoseconds((high << 32) | low)
+                yield ts, origlen, view[start:start + caplen]
+            elif btype == SIMPLE_PACKET_BLOCK:
+                origlen, = struct.unpack_from(order + 'I', buf, body)
+                caplen = min(origlen, blen - 16)
+                snaplen = (self._interfaces[0].snaplen
+                           if self._interfaces else 0)
+                if snaplen:
+                    caplen = min(caplen, snaplen)
+                start = body + 4
+                yield None, origlen, view[start:start + caplen]
+            elif btype == INTERFACE_BLOCK:
+                iface = self._parse_interface(buf, body, offset + blen - 4)
+                self._interfaces.append(iface)
+                if self.linktype is None:
+                    self.linktype = iface.linktype
+                    self.snaplen = iface.snaplen
+                if iface.units > 1000000:
+                    self.nanosecond = True
+
+            offset += blen
+        return offset
+
+    def _parse_interface(self, buf, body, end):
+        order = self._order
+        linktype, _, snaplen = struct.unpack_from(order + 'HHI', buf, body)
+        iface = _Interface(linktype, snaplen)
+
+        offset = body + 8
+        while end - offset >= 4:
+            code, length = struct.unpack_from(order + 'HH', buf, offset)
+            if code == 0:
+                break
+            value = offset + 4
+            if code == IF_TSRESOL and length >= 1:
+                resol = buf[value]
+                if resol & 0x80:
+                    iface.units = 2 ** (resol & 0x7f)
+                else:
+                    iface.units = 10 ** resol
+            elif code == IF_TSOFFSET and length >= 8:
+                iface.offset, = struct.unpack_from(order + 'q', buf, value)
+            offset = value + (length + 3) // 4 * 4
+        return iface
+
+
+def _read_packets(parser, fileobj, chunk_size):
+    """Yield the packets of `fileobj` parsed by `parser`."""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        for packet in parser.feed(chunk):
+            if packet[0] is None:
+                raise PcapError('Cannot merge packets without timestamps')
+            yield packet
+    parser.close()
+
+
+def merge(inputs, output, chunk_size=MERGE_CHUNK_SIZE):
+    """Merge pcap or pcapng files into one pcap file, ordered by packet
+    timestamp.
+
+    The inputs are read a chunk at a time through StreamParser and merged
+    a packet at a time through a k-way heap merge, so memory use does not
+    depend on the size of the files. Each input is expected to be ordered
+    already; packets with the same timestamp keep the order of `inputs`.
+
+    :param list inputs: file objects of the files to merge
+    :param output: file object receiving the merged pcap
+    :param int chunk_size: number of bytes read from an input at a time
+    :return: number of packets written
+    """
+    if not inputs:
+        raise PcapError('No pcap files to merge')
+
+    parsers = []
+    streams = []
+    for f in inputs:
+        parser = StreamParser()
+        packets = _read_packets(parser, f, chunk_size)
+        # reading ahead the first packet parses the headers, which give
+        # the link type of the input
+        first = next(packets, None)
+        if parser.linktype is None:
+            raise PcapError('Not a pcap file, or one without interfaces')
+        if first is not None:
+            packets = itertools.chain([first], packets)
+        parsers.append(parser)
+        streams.append(packets)
+
+    linktypes = set(p.linktype for p in parsers)
+    if len(linktypes) > 1:
+        msg = 'Cannot merge pcap files of link types {}'.format(
+            sorted(linktypes))
+        raise PcapError(msg)
+
+    writer = PcapWriter(output, parsers[0].linktype,
+                        snaplen=max(p.snaplen for p in parsers) or 65535,
+                        nanosecond=any(p.nanosecond for p in parsers))
+
+    count = 0
+    for timestamp, origlen, data in heapq.merge(*streams,
+                                                key=lambda p: p[0]):
+        writer.write(timestamp, data, origlen)
+        count += 1
+
+    logger.debug('Merged {} packets from {} files'
+                 .format(count, len(parsers)))
+    return count
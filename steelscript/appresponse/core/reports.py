@@ -6,14 +6,19 @@
 
 import time
 import logging
+import weakref
 
 from collections import OrderedDict
 
 from steelscript.appresponse.core.types import AppResponseException, \
-     TimeFilter, ResourceObject, Key, Value
+     AppResponseTimeout, TimeFilter, ResourceObject, Key, Value
 from steelscript.appresponse.core.clips import Clip
 from steelscript.appresponse.core.fs import File
 from steelscript.appresponse.core.capture import Job, VIFG, MIFG
+from steelscript.appresponse.core.filters import check_filter, \
+    validate_columns
+from steelscript.appresponse.core.scheduler import get_scheduler, \
+     PRIORITY_INTERACTIVE
 from steelscript.appresponse.core._constants import report_source_to_groups
 from steelscript.common._fs import SteelScriptDir
 
@@ -88,6 +93,7 @@ class ReportService(object):
     def __init__(self, appresponse):
         self.appresponse = appresponse
         self._sources = {}
+        self.scheduler = get_scheduler(appresponse.host)
 
     @property
     def sources(self):
@@ -161,22 +167,44 @@ class ReportService(object):
 
         return
 
-    def create_report(self, data_def_request):
+    def set_max_instances(self, max_instances):
+        """Limit the number of concurrent report instances on the appliance.
+
+        The limit is shared by every client of the same host in this process.
+        """
+        self.scheduler.set_max_instances(max_instances)
+
+    def create_report(self, data_def_request,
+                      priority=PRIORITY_INTERACTIVE, timeout=None):
         """Convenience method to create a report with a data definition request.
 
         :param DataDef data_def_request: DataDef objects
+        :param str priority: 'interactive' or 'batch', see `create_instance`
+        :param timeout: seconds the report may take, see `Report.run`
         :return: one Report object
         """
 
-        report = Report(self.appresponse)
+        report = Report(self.appresponse, priority=priority)
         report.add(data_def_request)
-        report.run()
+        report.run(timeout=timeout)
         return report
 
-    def create_instance(self, data_defs):
+    def create_instance(self, data_defs, priority=PRIORITY_INTERACTIVE,
+                        caller=None, timeout=None):
         """Create a report instance with multiple data definition requests.
 
+        Instance creation goes through the per-appliance scheduler: if the
+        maximum number of concurrent instances is already running, this
+        call blocks until one of them completes or is deleted.
+
         :param data_defs: list of DataDef objects
+        :param str priority: 'interactive' or 'batch'; queued interactive
+            requests are always admitted before batch requests
+        :param caller: hashable identifying the requester, used to queue
+            fairly across callers. Defaults to the current thread.
+        :param timeout: seconds to wait for admission before raising
+            AppResponseTimeout, defaults to the scheduler's
+            `acquire_timeout`
         :return: one ReportInstance object
         """
         if not data_defs:
@@ -205,7 +233,9 @@ class ReportService(object):
                    'cannot be mixed.')
             raise AppResponseException(msg)
 
-        def _create_instance(service_name, data_defs, live):
+        self._check_filters(data_defs)
+
+        def _create_instance(service_name, data_defs, live, clips=None):
             config = dict(data_defs=[dd.to_dict() for dd in data_defs],
                           live=live)
             logger.debug("Creating instance with data definitions %s" % config)
@@ -224,24 +254,53 @@ class ReportService(object):
 
             instance = ReportInstance(data=resp.data,
                                       datarep=report_instance,
-                                      live=live)
+                                      live=live, slot=slot, clips=clips)
             return instance
 
-        if data_defs[0].source.name == 'packets':
-            # Create clip for for capture job sources only
-            # Keep the clip till the instance is completed
-            if data_defs[0].source.path.startswith(SourceProxy.JOB_PREFIX):
-                with self.appresponse.clips.create_clips(data_defs):
+        slot = self.scheduler.acquire(caller=caller, priority=priority,
+                                      timeout=timeout)
+
+        try:
+            if data_defs[0].source.name == 'packets':
+                # Create clip for for capture job sources only
+                # Keep the clip till the instance is completed
+                if data_defs[0].source.path.startswith(
+                        SourceProxy.JOB_PREFIX):
+                    clips = self.appresponse.clips.create_clips(data_defs)
+                    try:
+                        instance = _create_instance(
+                            PACKETS_REPORT_SERVICE_NAME, data_defs, False,
+                            clips=clips)
+                    except Exception:
+                        clips.release()
+                        raise
+                else:
                     instance = _create_instance(PACKETS_REPORT_SERVICE_NAME,
-                                                data_defs, False)
+                                                data_defs, live)
             else:
-                instance = _create_instance(PACKETS_REPORT_SERVICE_NAME,
+                instance = _create_instance(GENERAL_REPORT_SERVICE_NAME,
                                             data_defs, live)
-        else:
-            instance = _create_instance(GENERAL_REPORT_SERVICE_NAME,
-                                        data_defs, live)
+        except Exception:
+            slot.release()
+            raise
+
         return instance
 
+    def _check_filters(self, data_defs):
+        """Check the traffic filters of the data defs, and the columns of
+        their STEELFILTER expressions, before creating an instance.
+
+        Filters added from a TrafficFilter created with `validate` False
+        are not checked.
+        """
+        for dd in data_defs:
+            for i, f in enumerate(dd._filters):
+                if i in dd._unvalidated:
+                    continue
+                node = check_filter(f.get('type'), f['value'])
+                if node is not None and dd.source.name in self.sources:
+                    validate_columns(node, self.sources[dd.source.name])
+
     def get_instances(self, service=None, include_system_reports=False):
         """Get all running report instances on appliance.
 
@@ -323,14 +382,25 @@ class ReportService(object):
 
 class ReportInstance(ResourceObject):
     """Main proxy interface to interact with AR11 report instance."""
+    __slots__ = ('errors', 'live', '_metatime', '_slot', '_clips',
+                 '__weakref__')
 
     resource = 'instance'
 
-    def __init__(self, data, servicedef=None, datarep=None, live=False):
+    def __init__(self, data, servicedef=None, datarep=None, live=False,
+                 slot=None, clips=None):
         super(ReportInstance, self).__init__(data, servicedef, datarep)
         self.errors = []
         self.live = live
         self._metatime = {}
+        # scheduler admission and clips backing the instance, released
+        # once the instance stops consuming appliance resources
+        self._slot = slot
+        self._clips = clips
+        if slot is not None:
+            # an instance dropped without completing must not keep its
+            # slot, or the scheduler runs out of them
+            weakref.finalize(self, slot.release)
 
     def __str__(self):
         return "<{} id:{} svc:{} user_agent:{} live:{}>".format(
@@ -357,32 +427,52 @@ class ReportInstance(ResourceObject):
     def state(self):
         return [s['state'] for s in self.status]
 
-    def _check_state(self, is_state):
-        state = self.state
+    def _check_state(self, is_state, status=None):
+        if status is None:
+            status = self.status
+        state = [s['state'] for s in status]
         if 'error' in state:
-            self.check_for_errors()
-        return all(x == is_state for x in self.state)
-
-    def is_complete(self):
+            self._release_resources()
+            self.check_for_errors(status)
+        return all(x == is_state for x in state)
+
+    def _release_resources(self):
+        if self._clips is not None:
+            self._clips.release()
+            self._clips = None
+        if self._slot is not None:
+            self._slot.release()
+            self._slot = None
+
+    def is_complete(self, status=None):
         """The completed state for regular reports."""
-        return self._check_state('completed')
+        complete = self._check_state('completed', status)
+        if complete:
+            self._release_resources()
+        return complete
 
-    def is_collecting(self):
+    def is_collecting(self, status=None):
         """The steady state for live reports."""
-        return self._check_state('collecting')
+        return self._check_state('collecting', status)
 
-    def is_ready(self):
-        """Return true if report is completed or collecting."""
+    def is_ready(self, status=None):
+        """Return true if report is completed or collecting.
+
+        :param status: status list previously fetched from the instance,
+            fetched from the appliance if not provided
+        """
 
         if self.live:
-            return self.is_collecting()
+            return self.is_collecting(status)
         else:
-            return self.is_complete()
+            return self.is_complete(status)
 
-    def check_for_errors(self):
+    def check_for_errors(self, status=None):
         """Raise exception if any errors found."""
+        if status is None:
+            status = self.status
         # Check errors when all queries have completed
-        for item in self.status:
+        for item in status:
             if item['state'] == 'error':
                 for m in item['messages']:
                     self.errors.append(m['text'])
@@ -427,8 +517,20 @@ class ReportInstance(ResourceObject):
         data = dd.execute('get_data', **kwargs)
         return data.data
 
+    def get_datadef_results(self, index):
+        """Get the full results of one completed data def.
+
+        Unlike `get_data`, this can be called while other data defs of
+        the instance are still running.
+        """
+        dd = self.datarep['data_defs'][index]
+        return dd.execute('get_data', report_id=self.id).data
+
     def delete(self):
-        return self.datarep.execute('delete')
+        try:
+            return self.datarep.execute('delete')
+        finally:
+            self._release_resources()
 
 
 class DataDef(object):
@@ -518,6 +620,8 @@ class DataDef(object):
         self.topbycolumns = topbycolumns or []
 
         self._filters = []
+        # indexes of the filters not to be validated
+        self._unvalidated = set()
         self._data = None
 
         # column names as returned with DataDef results
@@ -568,6 +672,8 @@ class DataDef(object):
 
         :param filter: types.TrafficFilter object
         """
+        if not filter.validate:
+            self._unvalidated.add(len(self._filters))
         self._filters.append(filter.as_dict())
 
     @property
@@ -580,17 +686,73 @@ class DataDef(object):
         self._data = val
 
 
+class ReportProgress(object):
+    """Snapshot of the progress of a running report instance."""
+
+    def __init__(self, status, rows, elapsed, ready):
+        """Initialize a ReportProgress object.
+
+        :param status: status list of the report instance, one item
+            per data def
+        :param rows: list with the number of records fetched so far for
+            each data def, None where data has not been fetched yet
+        :param elapsed: seconds since the report was started
+        :param bool ready: True when the instance is completed (or
+            collecting, for live reports)
+        """
+        self.status = status
+        self.rows = rows
+        self.elapsed = elapsed
+        self.ready = ready
+
+    def __repr__(self):
+        return '<{} {}% elapsed:{:.1f}s rows:{} ready:{}>'.format(
+            self.__class__.__name__, self.percent, self.elapsed,
+            self.rows, self.ready)
+
+    @property
+    def states(self):
+        return [s['state'] for s in self.status]
+
+    @property
+    def percents(self):
+        """Percent complete of each data def."""
+        ret = []
+        for item in self.status:
+            if item['state'] in ('completed', 'collecting'):
+                ret.append(100)
+            else:
+                ret.append(item.get('progress', {}).get('percent', 0))
+        return ret
+
+    @property
+    def percent(self):
+        """Overall percent complete of the report."""
+        percents = self.percents
+        if not percents:
+            return 0
+        return int(sum(percents) / len(percents))
+
+    @property
+    def completed(self):
+        """Indexes of the data defs whose data is available."""
+        return [i for i, r in enumerate(self.rows) if r is not None]
+
+
 class Report(object):
     """Main interface to build and run a report on AppResponse."""
 
-    def __init__(self, appresponse):
+    def __init__(self, appresponse, priority=PRIORITY_INTERACTIVE):
         """Initialize a new report.
 
         :param appresponse: the AppResponse object.
+        :param str priority: scheduling class of the report instance,
+            'interactive' or 'batch'.
         """
         logger.debug("Initializing Report object with appresponse '{}'"
                      .format(appresponse.host))
         self.appresponse = appresponse
+        self.priority = priority
         self._data_defs = []
         self._instance = None
 
@@ -634,33 +796,130 @@ class Report(object):
 
         return records
 
-    def run(self):
-        """Create and run a report instance with stored data definitions."""
-        if not self._instance:
-            self._instance = \
-                self.appresponse.reports.create_instance(self._data_defs)
+    def run(self, timeout=None, progress_callback=None, partial=False):
+        """Create and run a report instance with stored data definitions.
+
+        :param timeout: seconds to wait for the report to be ready,
+            including time queued for admission. When it expires the
+            instance is deleted from the appliance, any clips created for
+            it are released and AppResponseTimeout is raised. None polls
+            until the report is ready, but still waits for admission at
+            most the scheduler's `acquire_timeout` seconds before raising
+            SchedulerTimeout.
+        :param progress_callback: function called with a ReportProgress
+            object every time the instance status is polled
+        :param bool partial: fetch the data of each data def as soon as it
+            completes, see `iter_progress`
+        """
+        for progress in self.iter_progress(timeout=timeout, partial=partial):
+            if progress_callback is not None:
+                progress_callback(progress)
+
+    def iter_progress(self, timeout=None, partial=False, interval=.5):
+        """Run the report, yielding a ReportProgress on every status poll.
 
-            while not self._instance.is_ready():
-                time.sleep(.5)
+        This is the iterator form of `run`: the report instance is created
+        on the first iteration and the generator is exhausted once the
+        instance is ready and, for non-live reports, its data collected.
 
-            if not self._instance.live:
-                # only collect data automatically if we are a single use report
-                self._collect_data()
+        :param timeout: same as in `run`
+        :param bool partial: when True, the data of each data def is
+            fetched as soon as that data def completes, so `get_data` can
+            be used for it while others are still running
+        :param interval: seconds to sleep between status polls
+
+        Leaving the loop before the instance is ready, e.g. with `break`,
+        deletes the instance from the appliance.
+        """
+        if self._instance:
+            return
+
+        started = time.time()
+        deadline = None if timeout is None else started + timeout
+
+        self._instance = self.appresponse.reports.create_instance(
+            self._data_defs, priority=self.priority, timeout=timeout)
+
+        fetched = set()
+        done = False
+        try:
+            while True:
+                status = self._instance.status
+
+                if partial and not self._instance.live:
+                    for i, item in enumerate(status):
+                        if item['state'] == 'completed' and i not in fetched:
+                            res = self._instance.get_datadef_results(i)
+                            self._set_datadef_data(i, res)
+                            fetched.add(i)
+
+                ready = self._instance.is_ready(status)
+                if ready and not self._instance.live:
+                    # only collect data automatically if we are a single
+                    # use report
+                    self._collect_data(skip=fetched)
+                    fetched.update(range(len(self._data_defs)))
+
+                rows = [len(self._data_defs[i].data) if i in fetched
+                        else None for i in range(len(status))]
+                done = ready
+                yield ReportProgress(status, rows, time.time() - started,
+                                     ready)
+
+                if ready:
+                    return
+
+                if deadline is not None and time.time() >= deadline:
+                    self._cancel()
+                    msg = ('Report did not complete within {}s, instance '
+                           'deleted'.format(timeout))
+                    raise AppResponseTimeout(msg)
+                time.sleep(interval)
+        except GeneratorExit:
+            # the caller stopped iterating before the instance was ready,
+            # nobody is left to collect its data
+            if not done:
+                self._cancel()
+            raise
+        finally:
+            if not done and self._instance is not None:
+                # polling failed
+                self._instance._release_resources()
+
+    def _cancel(self):
+        """Delete the running instance, keeping the data definitions."""
+        instance, self._instance = self._instance, None
+        logger.info('Cancelling report instance {}'.format(instance.id))
+        try:
+            instance.delete()
+        except Exception:
+            logger.exception('Failed to delete report instance {}'
+                             .format(instance.id))
+
+    def _collect_data(self, skip=()):
+        """Collect all available data from all data defs.
+
+        :param skip: indexes of data defs whose data was already fetched
+        """
+        if len(skip) == len(self._data_defs):
+            return
 
-    def _collect_data(self):
-        """Collect all available data from all data defs."""
         results = self._instance.get_data()['data_defs']
 
         for i, res in enumerate(results):
-            source_name = self._data_defs[i].source.name
-            self._data_defs[i]._data_columns = res['columns']
-            if 'data' in res:
-                self._data_defs[i].data = self._cast_number(res,
+            if i not in skip:
+                self._set_datadef_data(i, res)
+
+    def _set_datadef_data(self, index, res):
+        source_name = self._data_defs[index].source.name
+        self._data_defs[index]._data_columns = res['columns']
+        if 'data' in res:
+            self._data_defs[index].data = self._cast_number(res,
                                                             source_name)
-            else:
-                self._data_defs[i].data = []
-            logger.debug("Obtained {} records for the {}th data request."
-                         .format(len(self._data_defs[i].data), i))
+        else:
+            self._data_defs[index].data = []
+        logger.debug("Obtained {} records for the {}th data request."
+                     .format(len(self._data_defs[index].data), index))
 
     def get_data(self, index=0):
         """Return data for the indexed data definition requests.
@@ -0,0 +1,243 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+import time
+import logging
+import threading
+
+from collections import OrderedDict, deque
+
+from steelscript.appresponse.core.types import AppResponseException, \
+    AppResponseTimeout
+
+logger = logging.getLogger(__name__)
+
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+
+# Priority classes in the order they are served
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+DEFAULT_MAX_INSTANCES = 10
+
+# Seconds acquire waits for a slot unless told otherwise, so a leaked slot
+# cannot block callers forever
+DEFAULT_ACQUIRE_TIMEOUT = 600
+
+
+class SchedulerTimeout(AppResponseTimeout):
+    pass
+
+
+class Slot(object):
+    """Admission granted to one report instance.
+
+    A slot is released exactly once, either explicitly or when the
+    report instance holding it completes or is deleted.
+    """
+
+    def __init__(self, scheduler, caller, priority, wait_time):
+        self.scheduler = scheduler
+        self.caller = caller
+        self.priority = priority
+        self.wait_time = wait_time
+        self.released = False
+
+    def __repr__(self):
+        return '<{} caller:{} priority:{} released:{}>'.format(
+            self.__class__.__name__, self.caller, self.priority,
+            self.released)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class _Waiter(object):
+
+    def __init__(self, caller, priority):
+        self.caller = caller
+        self.priority = priority
+        self.granted = False
+        self.enqueued = time.time()
+
+
+class ReportScheduler(object):
+    """Admission control for report instances on one AppResponse appliance.
+
+    At most `max_instances` report instances are admitted at a time.
+    Callers beyond that wait in a queue; interactive requests are always
+    served before batch requests, and within a priority class callers are
+    served round-robin so a single caller queuing many reports cannot
+    starve the others.
+
+    `acquire_timeout` is the default number of seconds a caller waits for
+    a slot, None to wait forever.
+    """
+
+    def __init__(self, host, max_instances=DEFAULT_MAX_INSTANCES,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        self.host = host
+        self.max_instances = max_instances
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+
+        # priority -> caller -> deque of waiters, callers kept in
+        # round-robin order
+        self._queues = dict((p, OrderedDict()) for p in PRIORITIES)
+
+        self._granted = 0
+        self._queued = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def __repr__(self):
+        return '<{} host:{} running:{}/{} waiting:{}>'.format(
+            self.__class__.__name__, self.host, self._running,
+            self.max_instances, self.waiting)
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def waiting(self):
+        with self._cond:
+            return sum(len(q) for callers in self._queues.values()
+                       for q in callers.values())
+
+    def set_max_instances(self, max_instances):
+        """Change the concurrency limit, admitting waiters if it grew."""
+        with self._cond:
+            self.max_instances = max_instances
+            self._dispatch()
+
+    def get_stats(self):
+        """Return queue-wait metrics for this appliance.
+
+        :return: dict with running/waiting counts, number of admissions,
+            number of admissions that had to queue, and the average and
+            maximum queue wait in seconds.
+        """
+        with self._cond:
+            waiting = sum(len(q) for callers in self._queues.values()
+                          for q in callers.values())
+            return {'running': self._running,
+                    'waiting': waiting,
+                    'max_instances': self.max_instances,
+                    'granted': self._granted,
+                    'queued': self._queued,
+                    'avg_wait': (self._total_wait / self._granted
+                                 if self._granted else 0.0),
+                    'max_wait': self._max_wait}
+
+    def acquire(self, caller=None, priority=PRIORITY_INTERACTIVE,
+                timeout=None):
+        """Block until a report instance may be created.
+
+        :param caller: hashable identifying the requester for fair
+            queuing, defaults to the current thread
+        :param str priority: 'interactive' or 'batch'
+        :param timeout: seconds to wait before raising SchedulerTimeout,
+            defaults to `acquire_timeout`
+        :return: Slot object to be released once the instance is done
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+
+        if priority not in PRIORITIES:
+            msg = ('Report priority needs to be one of {}'
+                   .format(list(PRIORITIES)))
+            raise AppResponseException(msg)
+
+        if caller is None:
+            caller = threading.current_thread().ident
+
+        waiter = _Waiter(caller, priority)
+
+        with self._cond:
+            callers = self._queues[priority]
+            callers.setdefault(caller, deque()).append(waiter)
+            self._dispatch()
+
+            if not waiter.granted:
+                self._queued += 1
+                logger.debug('Report instance for {} queued on {}, {} running'
+                             .format(caller, self.host, self._running))
+
+            deadline = None if timeout is None else time.time() + timeout
+            while not waiter.granted:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._discard(waiter)
+                        msg = ('Timed out after {}s waiting for a report '
+                               'slot on {}'.format(timeout, self.host))
+                        raise SchedulerTimeout(msg)
+                self._cond.wait(remaining)
+
+            wait_time = time.time() - waiter.enqueued
+            self._granted += 1
+            self._total_wait += wait_time
+            self._max_wait = max(self._max_wait, wait_time)
+
+        return Slot(self, caller, priority, wait_time)
+
+    def _discard(self, waiter):
+        callers = self._queues[waiter.priority]
+        queue = callers.get(waiter.caller)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del callers[waiter.caller]
+
+    def _dispatch(self):
+        """Grant free slots to waiters; caller must hold the lock."""
+        granted = False
+        while self._running < self.max_instances:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            waiter.granted = True
+            self._running += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _next_waiter(self):
+        for priority in PRIORITIES:
+            callers = self._queues[priority]
+            if not callers:
+                continue
+            # Serve the caller at the head, then rotate it to the back
+            caller, queue = next(iter(callers.items()))
+            waiter = queue.popleft()
+            del callers[caller]
+            if queue:
+                callers[caller] = queue
+            return waiter
+        return None
+
+    def _release(self, slot):
+        with self._cond:
+            self._running -= 1
+            self._dispatch()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(host):
+    """Return the ReportScheduler shared by all clients of `host`."""
+    with _schedulers_lock:
+        if host not in _schedulers:
+            _schedulers[host] = ReportScheduler(host)
+        return _schedulers[host]
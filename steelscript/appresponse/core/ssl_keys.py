@@ -82,6 +82,7 @@ class SslKeyStoreService(ServiceClass):
 
 
 class SslKey(ResourceObject):
+    __slots__ = ()
 
     resource = 'key'
 
@@ -94,9 +95,6 @@ class SslKey(ResourceObject):
         return '<%s id: %s, name: %s>' % (self.__class__.__name__,
                                           self.id(), self.name())
 
-    def get_properties(self):
-        return self.__dict__
-
     def get_property_values(self):
         return [
             self.id(), self.name(), self.description(),
@@ -99,6 +99,7 @@ class SystemUpdateService(ServiceClass):
 
 
 class Image(ResourceObject):
+    __slots__ = ()
 
     resource = 'image'
 
@@ -112,9 +113,6 @@ class Image(ResourceObject):
         return '<%s id: %s, state: %s>' % (self.__class__.__name__,
                                            self.id(), self.state())
 
-    def get_properties(self):
-        return self.__dict__
-
     def get_property_values(self):
         return [
             self.id(), self.state(), self.state_description(),
@@ -145,6 +143,7 @@ class Image(ResourceObject):
 
 
 class Update(ResourceObject):
+    __slots__ = ()
 
     resource = 'update'
 
@@ -159,9 +158,6 @@ class Update(ResourceObject):
         return '<%s state: %s>' % (self.__class__.__name__,
                                    self.state())
 
-    def get_properties(self):
-        return self.__dict__
-
     def get_property_values(self):
         return [
             self.state(), self.state_description(),
@@ -0,0 +1,436 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+from requests.exceptions import ConnectionError, ChunkedEncodingError, \
+    Timeout
+
+from steelscript.appresponse.core import pcap
+from steelscript.appresponse.core.types import AppResponseException
+from steelscript.common.exceptions import RvbdHTTPException
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Errors after which a download is resumed rather than failed
+TRANSIENT_ERRORS = (ConnectionError, ChunkedEncodingError, Timeout)
+
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.part.json'
+
+
+class UploadStream(object):
+    """Stream a binary file to the appliance in fixed size chunks.
+
+    The object is passed as the request body: iterating it reads the file
+    one chunk at a time, so memory stays bounded by `chunk_size` however
+    large the file is, and its length lets the request carry a
+    Content-Length header instead of being sent chunked. A SHA-256 digest
+    of the bytes sent is computed along the way.
+
+    `progress_callback`, if given, is called with the stream after each
+    chunk and once more when the file has been read entirely; it can use
+    `bytes_sent`, `total`, `percent`, `rate` and `done`.
+    """
+
+    def __init__(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE,
+                 progress_callback=None):
+        """Initialize an UploadStream object.
+
+        :param fileobj: file object opened in binary mode, streamed from
+            its current position
+        :param int chunk_size: number of bytes read and sent at a time
+        :param progress_callback: callable receiving this object
+        """
+        if chunk_size <= 0:
+            raise ValueError('chunk_size needs to be positive')
+
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.total = _remaining(fileobj)
+        self.bytes_sent = 0
+        self.done = False
+        self.started = None
+        self._hash = hashlib.sha256()
+
+    def __repr__(self):
+        return '<{} {}/{} bytes done:{}>'.format(
+            self.__class__.__name__, self.bytes_sent, self.total, self.done)
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        self.started = time.time()
+        while True:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            self._hash.update(chunk)
+            self.bytes_sent += len(chunk)
+            self._notify()
+            yield chunk
+
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        if self.progress_callback is not None:
+            self.progress_callback(self)
+
+    @property
+    def checksum(self):
+        """Hex SHA-256 digest of the bytes sent so far."""
+        return self._hash.hexdigest()
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100.0 if self.done else 0.0
+        return 100.0 * self.bytes_sent / self.total
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return time.time() - self.started
+
+    @property
+    def rate(self):
+        """Average bytes per second since the upload started."""
+        elapsed = self.elapsed
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+
+def _remaining(fileobj):
+    """Return the number of bytes left to read in `fileobj`."""
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except (AttributeError, OSError, ValueError):
+        pos = fileobj.tell()
+        end = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(pos)
+        return end - pos
+
+
+class TransferState(object):
+    """Progress of a resumable transfer persisted as a small JSON file, so
+    an interrupted transfer can continue from its last confirmed offset,
+    even from another process."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, state):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class DownloadDigest(object):
+    """SHA-256 and packet count of a capture, computed chunk by chunk as
+    it is downloaded so verifying it costs no extra pass over the file.
+
+    Packets are counted from the pcap or pcapng record headers; `packets`
+    is None when the data turns out not to be a capture.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._parser = pcap.StreamParser()
+        self._packets = 0
+
+    def update(self, chunk):
+        self._hash.update(chunk)
+        if self._parser is not None:
+            try:
+                for _ in self._parser.feed(chunk):
+                    self._packets += 1
+            except pcap.PcapError as e:
+                logger.debug('Not counting packets: {}'.format(e))
+                self._parser = None
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    @property
+    def packets(self):
+        if self._parser is None:
+            return None
+        return self._packets
+
+
+class DownloadResult(str):
+    """Local file of a completed download with its integrity data.
+
+    The object is the path of the file itself, the str that downloads
+    returned before, so it can be used wherever a path is expected; the
+    size, SHA-256 and packet count are attributes.
+    """
+
+    def __new__(cls, path, size, sha256, packets):
+        self = super(DownloadResult, cls).__new__(cls, path)
+        self.size = size
+        self.sha256 = sha256
+        self.packets = packets
+        return self
+
+    def __getnewargs__(self):
+        return self.path, self.size, self.sha256, self.packets
+
+    def __repr__(self):
+        return '<{} {} size:{} packets:{} sha256:{}>'.format(
+            self.__class__.__name__, self.path, self.size, self.packets,
+            self.sha256)
+
+    @property
+    def path(self):
+        return str.__str__(self)
+
+
+class ResumableDownload(object):
+    """Download a URL to a local file, resuming after interruptions.
+
+    Data is written to `<path>.part` and the offset known to be on disk is
+    recorded in `<path>.part.json` after each chunk. When the connection
+    drops, the download continues from that offset with an HTTP Range
+    request, up to `retries` times; running the same download again after
+    a crash resumes the same way. The validators of the first response are
+    sent back in If-Range, so a resource that changed in between is
+    downloaded again from the start, as it is when the server does not
+    support ranges. The part file is renamed to `path` once complete.
+    With `persist` False no state file is kept, so only interruptions
+    within one run are resumed.
+
+    The SHA-256 and packet count of the data are computed as it is
+    written, see DownloadDigest, and returned by `run`. Resuming from a
+    previous run reads the part file once to seed them.
+
+    `progress_callback`, if given, is called with the download after each
+    chunk and once when done; it can use `bytes_received`, `total` and
+    `done`.
+    """
+
+    def __init__(self, conn, url, path, overwrite=False,
+                 chunk_size=DEFAULT_CHUNK_SIZE, retries=3, delay=1,
+                 progress_callback=None, persist=True):
+        """Initialize a ResumableDownload object.
+
+        :param conn: Connection to the appliance
+        :param str url: URL of the resource to download
+        :param str path: full path of the local file to create, or an
+            existing directory when not persisting, the file name then
+            comes from the Content-Disposition header
+        :param bool overwrite: True if an existing file can be replaced
+        :param int chunk_size: number of bytes written at a time
+        :param int retries: number of times the download is resumed
+            after a transient error
+        :param delay: seconds before the first resume, doubled each time
+        :param progress_callback: callable receiving this object
+        :param bool persist: keep the state file to resume across runs
+        """
+        self.conn = conn
+        self.url = url
+        self.overwrite = overwrite
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.delay = delay
+        self.progress_callback = progress_callback
+        self.persist = persist
+
+        self.directory = None
+        self.path = None
+        if os.path.isdir(path):
+            if persist:
+                msg = ('Resumable downloads need a full file path, got {}'
+                       .format(path))
+                raise AppResponseException(msg)
+            self.directory = path
+        else:
+            self._set_path(path)
+
+        self.bytes_received = 0
+        self.total = None
+        self.done = False
+        self.digest = DownloadDigest()
+        self._validators = {}
+
+    def _set_path(self, path):
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.state = TransferState(path + STATE_SUFFIX)
+
+    def __repr__(self):
+        return '<{} {} -> {} {}/{} bytes>'.format(
+            self.__class__.__name__, self.url, self.path,
+            self.bytes_received, self.total)
+
+    def run(self):
+        """Download the resource.
+
+        :return: DownloadResult object
+        """
+        if self.path is not None:
+            self._check_path()
+            if self.persist:
+                self._restore()
+            else:
+                self._reset()
+
+        attempt = 0
+        while True:
+            try:
+                self._fetch()
+                break
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.delay * 2 ** attempt
+                attempt += 1
+                logger.info('Download of {} interrupted at {} bytes ({}), '
+                            'resuming in {}s'.format(self.url,
+                                                     self.bytes_received,
+                                                     e, delay))
+                time.sleep(delay)
+
+        os.replace(self.part_path, self.path)
+        self.state.clear()
+        self.done = True
+        self._notify()
+        return DownloadResult(self.path, self.bytes_received,
+                              self.digest.sha256, self.digest.packets)
+
+    def _check_path(self):
+        if os.path.isfile(self.path) and not self.overwrite:
+            msg = 'The file {} already exists'.format(self.path)
+            raise AppResponseException(msg)
+
+    def _restore(self):
+        """Pick up the part file of a previous attempt, if any."""
+        state = self.state.load()
+        if (state is None or state.get('url') != self.url or
+                not os.path.isfile(self.part_path)):
+            self._reset()
+            return
+
+        offset = min(state.get('offset', 0),
+                     os.path.getsize(self.part_path))
+        # Drop whatever was written past the last recorded offset
+        with open(self.part_path, 'r+b') as f:
+            f.truncate(offset)
+            f.seek(0)
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                self.digest.update(chunk)
+        self.bytes_received = offset
+        self.total = state.get('total')
+        self._validators = state.get('validators') or {}
+        logger.info('Resuming download of {} at {} bytes'
+                    .format(self.url, offset))
+
+    def _reset(self):
+        open(self.part_path, 'wb').close()
+        self.bytes_received = 0
+        self.total = None
+        self.digest = DownloadDigest()
+        self._validators = {}
+
+    def _save(self):
+        if not self.persist:
+            return
+        self.state.save({'url': self.url,
+                         'offset': self.bytes_received,
+                         'total': self.total,
+                         'validators': self._validators})
+
+    def _fetch(self):
+        headers = self.conn._prepare_headers(None)
+        # same as Connection.download, avoid hanging on Keep-Alive responses
+        headers['Connection'] = 'Close'
+        if self.bytes_received:
+            headers['Range'] = 'bytes={}-'.format(self.bytes_received)
+            validator = (self._validators.get('etag') or
+                         self._validators.get('last_modified'))
+            if validator:
+                headers['If-Range'] = validator
+
+        try:
+            r = self.conn._request('GET', self.url, None, None, headers,
+                                   stream=True)
+        except RvbdHTTPException as e:
+            if e.status == 416 and self.bytes_received == self.total:
+                # nothing left to download
+                return
+            raise
+
+        try:
+            if self.path is None:
+                self._set_path_from_response(r)
+
+            if r.status_code != 206 and self.bytes_received:
+                logger.info('{} cannot be resumed, downloading it again'
+                            .format(self.url))
+                self._reset()
+
+            if not self.bytes_received:
+                self._validators = {
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified')}
+                length = r.headers.get('Content-Length')
+                self.total = int(length) if length else None
+
+            with open(self.part_path, 'ab') as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    f.flush()
+                    self.digest.update(chunk)
+                    self.bytes_received += len(chunk)
+                    self._save()
+                    self._notify()
+        finally:
+            r.close()
+
+    def _set_path_from_response(self, r):
+        # as Connection.download does for a directory
+        filename = r.headers.get('Content-Disposition')
+        if filename is not None:
+            filename = filename.split('=')[1]
+        if not filename:
+            msg = ('{} is not a valid path. Specify a full path for the '
+                   'file to be created'.format(self.directory))
+            raise AppResponseException(msg)
+
+        self._set_path(os.path.join(self.directory, filename))
+        self._check_path()
+        self._reset()
+
+    def _notify(self):
+        if self.progress_callback is not None:
+            self.progress_callback(self)
@@ -20,6 +20,10 @@ class AppResponseException(Exception):
     pass
 
 
+class AppResponseTimeout(AppResponseException):
+    pass
+
+
 class ServiceClass(object):
     """Service classes are implemented as descriptors:
     They are not fully fledged service objects until
@@ -32,6 +36,14 @@ class ServiceClass(object):
     def _bind_resources(self):
         pass
 
+    def _listing_token(self, datarep):
+        """Return a token that changes only when the collection listing of
+        `datarep` changes, None if unknown. See `ResponseCache.token`."""
+        cache = getattr(self.appresponse, 'response_cache', None)
+        if cache is None:
+            return None
+        return cache.token(datarep.uri)
+
     def __get__(self, obj, objtype):
         # Add threading lock to ensure that the resources are all
         # allocated before claiming to be initialized.
@@ -61,19 +73,63 @@ class InstanceDescriptorMixin(object):
 
 
 class ResourceObject(object):
+    """Proxy to one resource on the appliance.
+
+    Objects are cheap to create in bulk: the raw data dict is kept as
+    is, converted to a DictObject on first access of `data`, and the
+    resource is only bound into a `datarep` the first time it is needed
+    to act on the appliance.
+    """
+
+    __slots__ = ('_raw', '_data', '_datarep', '_servicedef')
 
     resource = None
 
     property_names = None
 
     def __init__(self, data, servicedef=None, datarep=None):
-        logger.debug('Initialized {} object with data {}'
-                     .format(self.__class__.__name__, data))
-        self.data = DictObject.create_from_dict(data)
-        if not datarep:
-            self.datarep = servicedef.bind(self.resource, id=self.data.id)
-        else:
-            self.datarep = datarep
+        logger.debug('Initialized %s object', self.__class__.__name__)
+        self._raw = data
+        self._data = None
+        self._servicedef = servicedef
+        self._datarep = datarep
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = DictObject.create_from_dict(self._raw)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._raw = value
+        self._data = None
+
+    @property
+    def datarep(self):
+        if self._datarep is None and self._servicedef is not None:
+            self._datarep = self._bind(self._servicedef)
+        return self._datarep
+
+    @datarep.setter
+    def datarep(self, value):
+        self._datarep = value
+        if value is None:
+            # the resource is gone, do not bind it again
+            self._servicedef = None
+
+    def _bind(self, servicedef):
+        return servicedef.bind(self.resource, id=self._raw['id'])
+
+    def get_properties(self):
+        """Return the data and datarep of the object, binding it if
+        needed.
+
+        Resource classes used to return their `__dict__`, which held these
+        same two attributes. As they now use `__slots__`, a new dict is
+        returned on each call and changing it does not change the object.
+        """
+        return {'data': self.data, 'datarep': self.datarep}
 
     def get_property_values(self):
         return None
@@ -96,14 +152,18 @@ class ResourceObject(object):
 
     @property
     def id(self):
-        return self.data.id
+        try:
+            return self._raw['id']
+        except KeyError:
+            raise AttributeError('id')
 
     @property
     def name(self):
-        if hasattr(self.data, 'name'):
-            return self.data.name
-        elif hasattr(self.data.config, 'name'):
-            return self.data.config.name
+        if 'name' in self._raw:
+            return self._raw['name']
+        config = self._raw.get('config') or {}
+        if 'name' in config:
+            return config['name']
         return self.id
 
 
@@ -137,7 +197,8 @@ class TrafficFilter(object):
 
     valid_types = ['STEELFILTER', 'WIRESHARK', 'BPF']
 
-    def __init__(self, value, type_=None, id_=None):
+    def __init__(self, value, type_=None, id_=None, validate=True,
+                 strict=False):
         """Initialize a TrafficFilter object.
 
         :param value: string, the actual filter expression
@@ -155,6 +216,12 @@ class TrafficFilter(object):
 
             example BPF expression: host 1.2.3.4 or host 1.1.1.1
         :param id_: string, ID of the filter, optional
+        :param validate: check the syntax of STEELFILTER and BPF
+            expressions now rather than when the appliance gets them,
+            defaults to True. An expression that could not be parsed is
+            logged as a warning. False also skips the checks made when
+            the filter is used in a report or export.
+        :param strict: raise FilterSyntaxError instead of warning
 
         """
         if not value:
@@ -166,6 +233,12 @@ class TrafficFilter(object):
                    .format(self.valid_types))
             raise AppResponseException(msg)
 
+        if validate:
+            # imported here as the filters module depends on this one
+            from steelscript.appresponse.core.filters import check_filter
+            check_filter(type_, value, strict=strict)
+        self.validate = validate
+
         if type_ and type_.upper() == 'WIRESHARK' and not id_:
             # Wireshark filters are checked via ID to ensure they are
             # identical across multiple data defs within one report instance.
@@ -177,6 +250,20 @@ class TrafficFilter(object):
         self.type = type_.upper() if type_ else None
         self.value = value
 
+    @property
+    def canonical(self):
+        """Canonical form of a STEELFILTER expression, so equivalent
+        filters compare equal; other expressions, and STEELFILTER ones
+        that could not be parsed, are returned as is."""
+        if (self.type or 'STEELFILTER') == 'STEELFILTER':
+            from steelscript.appresponse.core.filters import canonicalize, \
+                FilterSyntaxError
+            try:
+                return canonicalize(self.value)
+            except FilterSyntaxError:
+                pass
+        return self.value
+
     def as_dict(self):
         """Convert the object into dictionary"""
 
@@ -0,0 +1,185 @@
+"""Fakes of the appliance shared by the unit tests.
+
+The fakes only record what they are asked to do and return canned data;
+they stand in for the reschema service definitions, the sleepwalker
+data representations, the steelscript Connection and the AppResponse
+object.
+"""
+
+import pytest
+import requests
+
+
+class FakeResult(object):
+    """Result of executing a link, as returned by DataRep.execute."""
+
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeDataRep(object):
+    """Bound resource; links are executed by its servicedef's handler."""
+
+    def __init__(self, servicedef, resource, kwargs):
+        self.servicedef = servicedef
+        self.resource = resource
+        self.kwargs = kwargs
+        self._data = None
+
+    def __repr__(self):
+        return '<FakeDataRep {} {}>'.format(self.resource, self.kwargs)
+
+    def __getitem__(self, key):
+        # sub-resources, such as datarep['data_defs'][0]
+        resource = '{}.{}'.format(self.resource, key)
+        return FakeDataRep(self.servicedef, resource, self.kwargs)
+
+    @property
+    def id(self):
+        return self.kwargs.get('id')
+
+    @property
+    def data(self):
+        # fetched with the 'get' link on first access
+        if self._data is None:
+            self._data = self.execute('get').data
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def execute(self, link, _data=None, **kwargs):
+        self.servicedef.executed.append((self.resource, link, self.id))
+        if self.servicedef.handler is None:
+            return FakeResult(None)
+        return self.servicedef.handler(self, link, _data)
+
+
+class FakeServiceDef(object):
+    """Service definition recording the resources bound.
+
+    :param handler: callable receiving (datarep, link, data) for each
+        executed link and returning a FakeResult
+    """
+
+    def __init__(self, handler=None, connection=None):
+        self.handler = handler
+        self.connection = connection or FakeConnection()
+        self.servicepath = '/api/fake/1.0'
+        self.bound = []
+        self.executed = []
+
+    def bind(self, resource, **kwargs):
+        self.bound.append((resource, kwargs))
+        return FakeDataRep(self, resource, kwargs)
+
+    def links(self):
+        return [link for _, link, _ in self.executed]
+
+
+class FakeResponse(object):
+    """HTTP response, which can drop the connection after `fail_after`
+    bytes of its body were streamed."""
+
+    def __init__(self, status_code=200, body=b'', headers=None,
+                 fail_after=None):
+        self.status_code = status_code
+        self.content = body
+        self.text = body.decode('latin-1')
+        self.headers = headers or {}
+        self.fail_after = fail_after
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise requests.exceptions.ConnectionError('connection reset')
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection(object):
+    """Connection answering requests with the queued `responses`."""
+
+    hostname = 'https://ar'
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.sent = []
+        self.conn = requests.Session()
+
+    def _prepare_headers(self, headers):
+        return dict(headers or {})
+
+    def _request(self, method, path, body, params, headers, stream=False):
+        self.sent.append((method, path, headers))
+        return self.responses.pop(0)
+
+    def json_request(self, method, path, body=None, params=None,
+                     extra_headers=None, raw_response=False):
+        self.sent.append((method, path, extra_headers))
+        return None
+
+
+class FakeAppResponse(object):
+    """AppResponse object recording uploads and downloads; the paths in
+    `fail` fail to upload. Other attributes, such as services, can be
+    passed as keyword arguments."""
+
+    def __init__(self, host='test-host', fail=(), **kwargs):
+        self.host = host
+        self.fail = fail
+        self.uploaded = []
+        self.downloads = []
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def upload(self, dest_path, local_file, progress_callback=None,
+               return_checksum=False):
+        if dest_path in self.fail:
+            raise IOError('connection reset')
+        self.uploaded.append(dest_path)
+        if return_checksum:
+            return None, 'sha256 of {}'.format(local_file)
+
+    def download(self, id_, dest_path, overwrite, resume=False):
+        self.downloads.append(dest_path)
+        return dest_path
+
+
+@pytest.fixture
+def conn():
+    return FakeConnection()
+
+
+@pytest.fixture
+def servicedef(conn):
+    return FakeServiceDef(connection=conn)
+
+
+@pytest.fixture
+def appresponse():
+    return FakeAppResponse()
+
+
+@pytest.fixture
+def make_servicedef():
+    return FakeServiceDef
+
+
+@pytest.fixture
+def make_response():
+    return FakeResponse
+
+
+@pytest.fixture
+def make_appresponse():
+    return FakeAppResponse
+
+
+@pytest.fixture
+def make_result():
+    return FakeResult
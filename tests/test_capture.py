@@ -0,0 +1,97 @@
+import pytest
+
+from steelscript.appresponse.core.capture import CaptureServiceBase
+from steelscript.appresponse.core.types import AppResponseException
+
+
+class JobStore(object):
+    """Handler of the capture job links keeping jobs in memory."""
+
+    def __init__(self, make_result, names):
+        self.make_result = make_result
+        self.jobs = dict((str(i), {'id': str(i), 'config': {'name': name}})
+                         for i, name in enumerate(names, start=1))
+
+    def __call__(self, datarep, link, data):
+        if datarep.resource == 'jobs':
+            if link == 'get':
+                return self.make_result({'items': list(self.jobs.values())})
+            if link == 'create':
+                id_ = str(len(self.jobs) + 1)
+                self.jobs[id_] = dict(data, id=id_)
+                return self.make_result(self.jobs[id_])
+            if link == 'bulk_delete':
+                self.jobs = {}
+                return self.make_result(None)
+        if datarep.resource == 'job' and link == 'get':
+            return self.make_result(self.jobs[datarep.id])
+        raise AssertionError('Unexpected {} {}'.format(datarep.resource,
+                                                       link))
+
+
+@pytest.fixture
+def service(make_servicedef, make_result, make_appresponse):
+    svc = CaptureServiceBase(make_appresponse())
+    svc.servicedef = make_servicedef(JobStore(make_result, ['a', 'b']))
+    svc.jobs = svc.servicedef.bind('jobs')
+    return svc
+
+
+def links(svc):
+    return ['{} {}'.format(resource, link)
+            for resource, link, _ in svc.servicedef.executed]
+
+
+class TestJobCache:
+    def test_lookups_use_index(self, service):
+        assert service.get_job_by_name('a').id == '1'
+        assert service.get_job_by_id('2').name == 'b'
+        assert service.get_job_by_name('b') is service.get_job_by_id('2')
+        assert links(service) == ['jobs get']
+
+    def test_ttl(self, service):
+        service.get_jobs()
+        service.get_jobs()
+        assert links(service) == ['jobs get']
+
+        service._jobs_fetched -= service.JOBS_TTL + 1
+        service.get_job_by_id('1')
+        assert links(service) == ['jobs get', 'jobs get']
+
+    def test_name_miss_reloads_once(self, service):
+        service.get_jobs()
+        service.servicedef.handler.jobs['3'] = {'id': '3',
+                                                'config': {'name': 'c'}}
+        assert service.get_job_by_name('c').id == '3'
+        assert links(service) == ['jobs get', 'jobs get']
+
+        with pytest.raises(AppResponseException):
+            service.get_job_by_name('missing')
+        assert links(service) == ['jobs get', 'jobs get', 'jobs get']
+
+    def test_id_miss_fetches_single_job(self, service):
+        service.get_jobs()
+        service.servicedef.handler.jobs['3'] = {'id': '3',
+                                                'config': {'name': 'c'}}
+        generation = service.jobs_generation
+
+        job = service.get_job_by_id('3')
+        assert job.name == 'c'
+        assert links(service) == ['jobs get', 'job get']
+        assert service.jobs_generation == generation + 1
+
+        # the fetched job joined the index
+        assert service.get_job_by_name('c') is job
+        assert len(service.get_jobs()) == 3
+        assert links(service) == ['jobs get', 'job get']
+
+    def test_invalidation(self, service):
+        service.get_jobs()
+        service.create_job({'name': 'c'})
+        assert service.get_job_by_name('c').id == '3'
+        assert links(service) == ['jobs get', 'jobs create']
+
+        service.delete_jobs()
+        assert service.get_jobs() == []
+        assert links(service) == ['jobs get', 'jobs create',
+                                  'jobs bulk_delete', 'jobs get']
@@ -0,0 +1,151 @@
+import time
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from steelscript.appresponse.core.capture import \
+    CaptureServiceBase  # noqa: E402
+from steelscript.appresponse.core.capture_stats import CaptureStatsPoller, \
+    CounterRing, flatten_counters  # noqa: E402
+from steelscript.appresponse.core.types import \
+    AppResponseException  # noqa: E402
+
+
+class TestCounterRing:
+    def test_flatten_counters(self):
+        stats = {'packets': {'total': 10, 'dropped': '2'}, 'state': 'up'}
+        assert flatten_counters(stats) == {'packets.total': 10,
+                                           'packets.dropped': 2}
+
+    def test_rates_and_wraparound(self):
+        ring = CounterRing(['dropped', 'total'], capacity=3)
+        samples = [(0, 0), (10, 5), (30, 2), (40, 4), (50, 6)]
+        for t, (total, dropped) in enumerate(samples):
+            ring.append(float(t), {'total': total, 'dropped': dropped})
+
+        assert len(ring) == 3
+        series = ring.series()
+        assert list(series['time']) == [2., 3., 4.]
+        assert list(series['total']) == [20., 10., 10.]
+        # counter went backwards at t=2
+        assert numpy.isnan(series['dropped'][0])
+        assert list(series['dropped'][1:]) == [2., 2.]
+
+        raw = ring.series(rates=False)
+        assert list(raw['total']) == [30., 40., 50.]
+
+
+class StatsStore(object):
+    """Handler of the capture job and interface links. Jobs without
+    stats in `jobs` answer 'get_stats' with `job_stats`, as 1.0 jobs
+    do."""
+
+    def __init__(self, make_result):
+        self.make_result = make_result
+        self.jobs = []
+        self.interfaces = []
+        self.job_stats = {}
+
+    def __call__(self, datarep, link, data):
+        if datarep.resource == 'jobs' and link == 'get':
+            return self.make_result({'items': self.jobs})
+        if datarep.resource == 'interfaces' and link == 'get':
+            return self.make_result({'items': self.interfaces})
+        if datarep.resource == 'job' and link == 'get_stats':
+            return self.make_result(self.job_stats[datarep.id])
+        raise AssertionError('Unexpected {} {}'.format(datarep.resource,
+                                                       link))
+
+
+def job(id_, total=None):
+    state = {} if total is None else {'stats': {'packets': total}}
+    return {'id': id_, 'state': state}
+
+
+def interface(name, total):
+    return {'name': name, 'state': {'stats': {'packets': total}}}
+
+
+@pytest.fixture
+def store(make_result):
+    return StatsStore(make_result)
+
+
+@pytest.fixture
+def capture(make_servicedef, make_appresponse, store):
+    svc = CaptureServiceBase(make_appresponse())
+    svc.servicedef = make_servicedef(store)
+    svc.jobs = svc.servicedef.bind('jobs')
+    svc.interfaces = svc.servicedef.bind('interfaces')
+    return svc
+
+
+def links(svc):
+    return ['{} {}'.format(resource, link)
+            for resource, link, _ in svc.servicedef.executed]
+
+
+class TestCaptureStatsPoller:
+    def test_poll(self, capture, store):
+        store.jobs = [job('1', 10), job('2')]
+        store.job_stats = {'2': {'packets': 5}}
+        store.interfaces = [interface('eth0', 100)]
+        poller = CaptureStatsPoller(capture, capacity=4)
+
+        poller.poll()
+        # one request per collection, and per job without stats
+        assert links(capture) == ['jobs get', 'interfaces get',
+                                  'job get_stats']
+
+        store.jobs = [job('1', 30), job('2')]
+        store.job_stats = {'2': {'packets': 9}}
+        store.interfaces = [interface('eth0', 160)]
+        poller.poll()
+
+        assert sorted(poller.get_jobs()) == ['1', '2']
+        assert poller.get_interfaces() == ['eth0']
+        raw = poller.get_job_series('1', rates=False)
+        assert list(raw['packets']) == [10., 30.]
+        assert list(poller.get_job_series('2', rates=False)['packets']) == \
+            [5., 9.]
+        assert list(poller.get_interface_series('eth0',
+                                                rates=False)['packets']) == \
+            [100., 160.]
+
+    def test_gone_jobs_are_dropped(self, capture, store):
+        store.jobs = [job('1', 10), job('2', 20)]
+        store.interfaces = [interface('eth0', 1), interface('eth1', 1)]
+        poller = CaptureStatsPoller(capture)
+        poller.poll()
+
+        store.jobs = [job('2', 25)]
+        store.interfaces = [interface('eth1', 2)]
+        poller.poll()
+
+        assert poller.get_jobs() == ['2']
+        assert poller.get_interfaces() == ['eth1']
+        with pytest.raises(AppResponseException):
+            poller.get_job_series('1')
+        assert len(poller.get_job_series('2')['time']) == 2
+
+    def test_start_stop(self, capture, store):
+        store.jobs = [job('1', 10)]
+        poller = CaptureStatsPoller(capture, interval=.001)
+        poller.start()
+        thread = poller._thread
+        poller.start()
+        assert poller._thread is thread
+
+        deadline = time.time() + 5
+        while (links(capture).count('jobs get') < 2 and
+               time.time() < deadline):
+            time.sleep(.001)
+        poller.stop()
+
+        assert not poller.running
+        assert not thread.is_alive()
+        assert len(poller.get_job_series('1')['time']) >= 2
+        polls = links(capture).count('jobs get')
+        time.sleep(.01)
+        assert links(capture).count('jobs get') == polls
@@ -0,0 +1,230 @@
+import threading
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from steelscript.appresponse.core.classification import \
+    ClassificationService, HostGroupConfig, compact_hostgroups, \
+    replicate_hostgroups
+from steelscript.appresponse.core.types import AppResponseException
+
+
+class HostGroupStore(object):
+    """Handler of the hostgroup links keeping hostgroups in memory.
+
+    The first `failures` listings raise `error`.
+    """
+
+    def __init__(self, make_result, hostgroups=(), error=None, failures=0):
+        self.make_result = make_result
+        self.hostgroups = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.error = error
+        self.failures = failures
+        for hg in hostgroups:
+            self.add(dict(hg))
+
+    def add(self, data):
+        data['id'] = self.next_id
+        self.next_id += 1
+        self.hostgroups[data['id']] = data
+        return data
+
+    def __call__(self, datarep, link, data):
+        with self.lock:
+            if link == 'get':
+                if self.failures:
+                    self.failures -= 1
+                    raise self.error
+                items = list(self.hostgroups.values())
+                return self.make_result({'items': items})
+            if link == 'bulk_create':
+                items = [self.add(dict(item)) for item in data['items']]
+                return self.make_result({'items': items})
+            if link == 'set':
+                item = dict(data, id=datarep.id)
+                self.hostgroups[datarep.id] = item
+                return self.make_result(item)
+            if link == 'bulk_delete':
+                for id_ in data['delete_ids']:
+                    del self.hostgroups[id_]
+                return self.make_result(None)
+        raise AssertionError('Unexpected {}'.format(link))
+
+
+@pytest.fixture
+def service(make_servicedef, make_result):
+    """Return a factory of ClassificationService objects backed by a
+    HostGroupStore."""
+    def _service(hostgroups=(), **kwargs):
+        svc = ClassificationService(appresponse=None)
+        store = HostGroupStore(make_result, hostgroups, **kwargs)
+        svc.servicedef = make_servicedef(store)
+        svc.hostgroups = svc.servicedef.bind('hostgroups')
+        return svc
+    return _service
+
+
+def config(name, hosts, **kwargs):
+    return HostGroupConfig(name=name, hosts=hosts, enabled=True, **kwargs)
+
+
+class TestSync:
+    def test_minimal_diff(self, service):
+        svc = service([config('same', ['10.0.0.0/8', '1.1.1.1/32']),
+                       config('changed', ['10.1.0.0/16']),
+                       config('stale', ['10.2.0.0/16'])])
+
+        result = svc.sync([config('same', ['1.1.1.1/32', '10.0.0.0/8']),
+                           config('changed', ['10.1.0.0/24']),
+                           config('new1', ['10.3.0.0/16']),
+                           {'name': 'new2', 'hosts': ['10.4.0.0/16']}],
+                          chunk_size=1)
+
+        assert result.created == ['new1', 'new2']
+        assert result.updated == ['changed']
+        assert result.deleted == ['stale']
+        assert result.unchanged == ['same']
+        assert list(result.timings) == ['fetch', 'create', 'update',
+                                        'delete']
+
+        links = svc.servicedef.links()
+        assert links == ['get', 'bulk_create', 'bulk_create', 'set',
+                         'bulk_delete']
+        names = sorted(hg['name']
+                       for hg in svc.servicedef.handler.hostgroups.values())
+        assert names == ['changed', 'new1', 'new2', 'same']
+
+        # a second run has nothing left to do
+        again = svc.sync([config('same', ['10.0.0.0/8', '1.1.1.1/32']),
+                          config('changed', ['10.1.0.0/24']),
+                          config('new1', ['10.3.0.0/16']),
+                          {'name': 'new2', 'hosts': ['10.4.0.0/16']}])
+        assert not again.changed
+        assert len(again.unchanged) == 4
+
+    def test_dry_run_and_keep(self, service):
+        svc = service([config('old', ['10.0.0.0/8'])])
+        result = svc.sync([config('new', ['10.1.0.0/16'])], dry_run=True)
+        assert result.created == ['new']
+        assert result.deleted == ['old']
+        assert svc.servicedef.links() == ['get']
+
+        result = svc.sync([config('new', ['10.1.0.0/16'])], delete=False)
+        assert result.deleted == []
+        assert result.unchanged == ['old']
+        assert 'bulk_delete' not in svc.servicedef.links()
+
+    def test_parallel_updates(self, service):
+        svc = service([config('hg%d' % i, ['10.%d.0.0/16' % i])
+                       for i in range(20)])
+        result = svc.sync([config('hg%d' % i, ['10.%d.1.0/24' % i])
+                           for i in range(20)], max_workers=8)
+        assert len(result.updated) == 20
+        assert svc.servicedef.links().count('set') == 20
+        assert all(hg['hosts'][0].endswith('.1.0/24')
+                   for hg in svc.servicedef.handler.hostgroups.values())
+
+    def test_duplicate_names(self, service):
+        svc = service()
+        with pytest.raises(AppResponseException):
+            svc.sync([config('a', []), config('a', [])])
+
+
+class TestCompact:
+    def test_preview(self):
+        configs = [config('a', ['10.0.0.%d' % i for i in range(4)]),
+                   config('b', ['10.1.0.0/24', '10.1.0.5'])]
+        assert compact_hostgroups(configs, preview=True) == (6, 2)
+        assert len(configs[0].hosts) == 4
+
+        assert configs[0].compact() == ['10.0.0.0/30']
+        assert configs[0].hosts == ['10.0.0.0/30']
+
+    def test_create_compacted(self, service):
+        svc = service()
+        hosts = ['10.0.0.%d' % i for i in range(8)]
+        obj = config('a', hosts)
+        svc.create_hostgroups([obj], compact=True)
+        assert obj.hosts == hosts
+        created, = svc.servicedef.handler.hostgroups.values()
+        assert created['hosts'] == ['10.0.0.0/29']
+
+        result = svc.sync([config('a', hosts)], compact=True)
+        assert result.unchanged == ['a']
+
+
+class TestCache:
+    def test_lookups_use_cache(self, service):
+        svc = service([config('a', ['10.0.0.0/8']),
+                       config('b', ['10.1.0.0/16'])])
+        assert svc.get_hostgroup_by_name('a').id == 1
+        assert svc.get_hostgroup_by_id(2).name == 'b'
+        assert svc.get_hostgroup_by_id('2').name == 'b'
+        assert svc.servicedef.links() == ['get']
+
+        # a miss reloads the hostgroups, unless the lookup just did
+        with pytest.raises(ValueError):
+            svc.get_hostgroup_by_name('c')
+        assert svc.servicedef.links() == ['get', 'get']
+        svc.invalidate_hostgroups()
+        with pytest.raises(ValueError):
+            svc.get_hostgroup_by_name('c')
+        assert svc.servicedef.links() == ['get', 'get', 'get']
+
+    def test_ttl(self, service):
+        svc = service([config('a', ['10.0.0.0/8'])])
+        svc.get_hostgroups()
+        svc.get_hostgroups()
+        assert svc.servicedef.links() == ['get']
+        svc._hostgroups_fetched -= svc.HOSTGROUPS_TTL + 1
+        svc.get_hostgroups()
+        assert svc.servicedef.links() == ['get', 'get']
+
+    def test_invalidation(self, service):
+        svc = service([config('a', ['10.0.0.0/8'])])
+        svc.get_hostgroups()
+
+        svc.create_hostgroups([config('b', ['10.1.0.0/16'])])
+        assert svc.get_hostgroup_by_name('b').id == 2
+        assert svc.servicedef.links() == ['get', 'bulk_create']
+
+        hg = svc.get_hostgroup_by_name('a')
+        hg.update(config('renamed', ['10.0.0.0/8']))
+        assert svc.get_hostgroup_by_name('renamed').id == 1
+        assert svc.servicedef.links() == ['get', 'bulk_create', 'set', 'get']
+        with pytest.raises(ValueError):
+            svc.get_hostgroup_by_name('a')
+
+        svc.bulk_delete(ids=[2])
+        assert [hg.name for hg in svc.get_hostgroups()] == ['renamed']
+
+
+class TestReplicate:
+    def test_fleet(self, service, make_appresponse):
+        services = [service(),
+                    service(error=ConnectionError('reset'), failures=1),
+                    service(error=ValueError('bad'), failures=1),
+                    service(error=ConnectionError('down'), failures=5),
+                    service()]
+        fleet = [make_appresponse('ar%d' % i, classification=svc)
+                 for i, svc in enumerate(services)]
+
+        configs = [config('a', ['10.0.0.%d' % i for i in range(4)]),
+                   config('b', ['10.1.0.0/16'])]
+        results = replicate_hostgroups(fleet, configs, max_workers=3,
+                                       retries=2, delay=0, compact=True)
+
+        assert [r.host for r in results] == ['ar0', 'ar1', 'ar2', 'ar3',
+                                             'ar4']
+        assert [r.ok for r in results] == [True, True, False, False, True]
+        assert [r.attempts for r in results] == [1, 2, 1, 3, 1]
+        assert isinstance(results[2].error, ValueError)
+        assert results[0].result.created == ['a', 'b']
+        # the caller's configs are left as they are
+        assert len(configs[0].hosts) == 4
+
+        store = services[1].servicedef.handler
+        hosts = sorted(hg['hosts'][0] for hg in store.hostgroups.values())
+        assert hosts == ['10.0.0.0/30', '10.1.0.0/16']
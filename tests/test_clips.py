@@ -0,0 +1,189 @@
+import gc
+
+import pytest
+
+from steelscript.appresponse.core import clips as clips_module
+from steelscript.appresponse.core.capture import Job
+from steelscript.appresponse.core.clips import Clip, ClipCache, Clips, \
+    ClipService
+from steelscript.appresponse.core.reports import SourceProxy
+from steelscript.appresponse.core.types import AppResponseException, \
+    TimeFilter
+
+
+class FakeClip(Clip):
+
+    def __init__(self, id_):
+        self.clip_id = id_
+        self.from_job = True
+        self.deleted = False
+
+    @property
+    def id(self):
+        return self.clip_id
+
+    def delete(self):
+        self.deleted = True
+
+
+@pytest.fixture
+def created():
+    return []
+
+
+@pytest.fixture
+def create(created):
+    def _create():
+        clip = FakeClip(len(created))
+        created.append(clip)
+        return clip
+    return _create
+
+
+class TestClipCache:
+    def test_reuse_and_delete_after_last_release(self, create, created):
+        cache = ClipCache(grace_period=0)
+        key = ('job1', '10', '20')
+
+        first = cache.acquire(key, create)
+        second = cache.acquire(key, create)
+        assert first is second
+        assert len(created) == 1
+
+        cache.release(first)
+        assert not first.deleted
+        cache.release(second)
+        assert first.deleted
+        assert len(cache) == 0
+
+    def test_grace_period_and_flush(self, create, created):
+        cache = ClipCache(grace_period=60)
+        key = ('job1', '10', '20')
+
+        clip = cache.acquire(key, create)
+        cache.release(clip)
+        assert not clip.deleted
+
+        # acquiring during the grace period revives the cached clip
+        assert cache.acquire(key, create) is clip
+        cache.release(clip)
+
+        cache.flush()
+        assert clip.deleted
+        assert len(created) == 1
+
+    def test_failed_create_is_not_cached(self, create, created):
+        cache = ClipCache(grace_period=0)
+        key = ('job1', '10', '20')
+
+        def fail():
+            raise AppResponseException('No packets found')
+
+        with pytest.raises(AppResponseException):
+            cache.acquire(key, fail)
+        assert len(cache) == 0
+        assert cache.acquire(key, create) is created[0]
+
+    def test_exit_hook_holds_caches_weakly(self, create):
+        cache = ClipCache(grace_period=60)
+        clip = cache.acquire(('job1', '10', '20'), create)
+        cache.release(clip)
+
+        clips_module._flush_caches()
+        assert clip.deleted
+
+        del cache
+        gc.collect()
+        assert not any(c.grace_period == 60 for c in clips_module._caches)
+
+    def test_clips_release_through_cache(self, create):
+        cache = ClipCache(grace_period=0)
+        clip = cache.acquire(('job1', '10', '20'), create)
+
+        with Clips([clip, 'not a clip'], cache=cache):
+            pass
+        assert clip.deleted
+
+
+class FakeDataDef(object):
+
+    def __init__(self, source, timefilter):
+        self.source = source
+        self.timefilter = timefilter
+
+
+class TestCreateClips:
+    @pytest.fixture
+    def data_defs(self):
+        tf = TimeFilter(start=10, end=20)
+        return [FakeDataDef(Job(data={'id': j, 'name': j}, datarep=object()),
+                            tf)
+                for j in ('a', 'b', 'c')]
+
+    def test_parallel_creation_keeps_order(self, data_defs):
+        service = ClipService(None)
+        service.clip_cache = ClipCache(grace_period=0)
+        service._acquire_job_clip = lambda job_id, tf: FakeClip(job_id)
+
+        clips = service.create_clips(data_defs)
+        assert [c.id for c in clips] == ['a', 'b', 'c']
+
+    def test_failure_releases_created_clips(self, data_defs):
+        service = ClipService(None)
+        service.clip_cache = ClipCache(grace_period=0)
+        created = []
+
+        def acquire(job_id, tf):
+            if job_id == 'b':
+                raise AppResponseException('No packets found')
+            clip = FakeClip(job_id)
+            created.append(clip)
+            return clip
+
+        service._acquire_job_clip = acquire
+
+        with pytest.raises(AppResponseException):
+            service.create_clips(data_defs)
+        assert all(c.deleted for c in created)
+
+    @pytest.mark.parametrize('packets, error', [(5, False), (0, True)])
+    def test_job_source_creates_clip(self, data_defs, make_servicedef,
+                                     make_result, packets, error):
+        def handler(datarep, link, data):
+            if link == 'create':
+                # the created clip is returned as a bound resource
+                job_id = data['config']['job_id']
+                clip = datarep.servicedef.bind('clip', id=job_id)
+                clip.data = {'id': job_id,
+                             'status': {'packets_written': packets}}
+                return clip
+            return make_result(None)
+
+        service = ClipService(None)
+        service.clip_cache = ClipCache(grace_period=0)
+        service.servicedef = make_servicedef(handler)
+        service.clips = service.servicedef.bind('clips')
+
+        if error:
+            with pytest.raises(AppResponseException, match='No packets'):
+                service.create_clips(data_defs[:1])
+            assert service.servicedef.links() == ['create', 'delete']
+        else:
+            clips = service.create_clips(data_defs[:1])
+            assert [c.id for c in clips] == ['a']
+            clips.release()
+            assert service.servicedef.links() == ['create', 'delete']
+
+    def test_job_path_source_is_kept(self, make_servicedef):
+        # DataDef wraps its source in a SourceProxy, whose reports read
+        # from the job itself
+        tf = TimeFilter(start=10, end=20)
+        source = SourceProxy(name='packets', path='jobs/a')
+        service = ClipService(None)
+        service.servicedef = make_servicedef()
+        service.clips = service.servicedef.bind('clips')
+
+        clips = service.create_clips([FakeDataDef(source, tf)])
+        assert list(clips) == [source]
+        clips.release()
+        assert service.servicedef.links() == []
@@ -0,0 +1,270 @@
+import io
+import os
+import types
+from decimal import Decimal
+
+import pytest
+
+from steelscript.appresponse.core import export, pcap
+from steelscript.appresponse.core.export import Export, ExportManager, \
+    PacketExportService, split_timefilter
+from steelscript.appresponse.core.types import AppResponseException, \
+    AppResponseTimeout, TimeFilter
+from steelscript.common.exceptions import RvbdHTTPException
+
+
+@pytest.fixture
+def make_export(appresponse, servicedef, make_result):
+    """Return a factory of Export objects whose state goes through
+    `states`, the last one repeating."""
+    def _make(states):
+        states = list(states)
+
+        def handler(datarep, link, data):
+            state = states.pop(0) if len(states) > 1 else states[0]
+            return make_result({'id': '1', 'status': {'state': state}})
+
+        servicedef.handler = handler
+        exp = Export.__new__(Export)
+        exp.appresponse = appresponse
+        exp.exp_id = '1'
+        exp.datarep = servicedef.bind('export', id='1')
+        return exp
+    return _make
+
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(export, 'POLL_INTERVAL', .001)
+    monkeypatch.setattr(export, 'MAX_POLL_INTERVAL', .004)
+
+
+class TestExport:
+    def test_download_once_running(self, make_export, servicedef):
+        exp = make_export(['UNINITIALIZED', 'UNINITIALIZED', 'RUNNING'])
+        assert exp.download('out.pcap', overwrite=True) == 'out.pcap'
+        assert servicedef.links() == ['get'] * 3
+        assert exp.appresponse.downloads == ['out.pcap']
+
+    def test_deadline(self, make_export):
+        exp = make_export(['UNINITIALIZED'])
+        with pytest.raises(AppResponseTimeout):
+            exp.download('out.pcap', overwrite=True, timeout=.02)
+        assert exp.appresponse.downloads == []
+
+    @pytest.mark.parametrize('state', ['FAILED', 'error', 'ABORTED'])
+    def test_failed_export(self, make_export, servicedef, state):
+        exp = make_export(['UNINITIALIZED', state])
+        with pytest.raises(AppResponseException):
+            exp.wait_until_ready(timeout=60)
+        assert servicedef.links() == ['get'] * 2
+
+    @pytest.mark.parametrize('state', ['RUNNING', 'DONE', 'completed'])
+    def test_ready_states(self, make_export, servicedef, state):
+        exp = make_export(['INITIALIZING', state])
+        assert exp.wait_until_ready(timeout=60) == state
+        assert servicedef.links() == ['get'] * 2
+
+    def test_default_deadline(self, make_export, monkeypatch):
+        monkeypatch.setattr(export, 'READY_TIMEOUT', .02)
+        exp = make_export(['UNINITIALIZED'])
+        with pytest.raises(AppResponseTimeout):
+            exp.download('out.pcap', overwrite=True)
+
+        # the budget of the old retry loop still applies when given
+        with pytest.raises(AppResponseTimeout):
+            exp.download('out.pcap', overwrite=True, retries=2, delay=.01)
+
+    def test_download_retries_back_off(self, make_export, monkeypatch):
+        # without a state, the download itself finds out the export is
+        # still initializing
+        exp = make_export([None])
+        error = RvbdHTTPException.__new__(RvbdHTTPException)
+        error.error_text = 'Export state is not RUNNING'
+        attempts = []
+
+        def download(id_, dest_path, overwrite, resume=False):
+            attempts.append(dest_path)
+            if len(attempts) < 5:
+                raise error
+            return dest_path
+        exp.appresponse.download = download
+        sleeps = []
+        monkeypatch.setattr(export.time, 'sleep', sleeps.append)
+
+        assert exp.download('out.pcap', overwrite=True) == 'out.pcap'
+        assert len(attempts) == 5
+        assert sleeps == [.001, .002, .004, .004]
+
+
+class FakeSliceExport(object):
+    """Export of the `packets` (timestamp, data) stamped within its time
+    filter, both ends included."""
+
+    def __init__(self, timefilter, packets):
+        self.timefilter = timefilter
+        self.packets = packets
+        self.deleted = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deleted = True
+
+    def download(self, filename, overwrite, timeout=None):
+        start = int(Decimal(self.timefilter.start) * 10 ** 9)
+        end = int(Decimal(self.timefilter.end) * 10 ** 9)
+        with open(filename, 'wb') as f:
+            writer = pcap.PcapWriter(f, 1, nanosecond=True)
+            for ts, data in self.packets:
+                if start <= ts <= end:
+                    writer.write(ts, data)
+
+
+class TestDownloadParallel:
+    def test_split_timefilter(self):
+        windows = split_timefilter(TimeFilter(start=100, end=110), 4)
+        assert [(w.start, w.end) for w in windows] == [
+            ('100', '102.499999999'), ('102.5', '104.999999999'),
+            ('105', '107.499999999'), ('107.5', '110')]
+
+        windows = split_timefilter(TimeFilter(start=100, end=102), 4)
+        assert len(windows) == 2
+
+    @pytest.fixture
+    def service(self, appresponse, monkeypatch):
+        """Return a PacketExportService exporting `service.packets`."""
+        service = PacketExportService(appresponse)
+        service.packets = []
+        service.created = []
+
+        def create(source, timefilter, filters):
+            exp = FakeSliceExport(timefilter, service.packets)
+            service.created.append(exp)
+            return exp
+        monkeypatch.setattr(service, 'create', create)
+        return service
+
+    def test_merge_slices(self, tmp_path, service):
+        service.packets = [(i * 1000000000, b'packet')
+                           for i in range(100, 108)]
+
+        filename = str(tmp_path / 'out.pcap')
+        timefilter = TimeFilter(start=100, end=108)
+        count = service.download_parallel('job', timefilter, [], filename,
+                                          slices=4)
+
+        assert count == 8
+        assert all(e.deleted for e in service.created)
+        assert os.listdir(str(tmp_path)) == ['out.pcap']
+        with open(filename, 'rb') as f:
+            times = [ts for ts, _, _ in pcap.PcapReader(f)]
+        assert times == [i * 1000000000 for i in range(100, 108)]
+
+    def test_boundary_packets_once(self, tmp_path, service):
+        # packets on, and a nanosecond around, each slice boundary
+        service.packets = sorted(
+            (b * 1000000000 + d, b'packet')
+            for b in (100, 102, 104, 106, 108) for d in (-1, 0, 1)
+            if 100 * 1000000000 <= b * 1000000000 + d <= 108 * 1000000000)
+
+        filename = str(tmp_path / 'out.pcap')
+        count = service.download_parallel(
+            'job', TimeFilter(start=100, end=108), [], filename, slices=4)
+
+        with open(filename, 'rb') as f:
+            times = [ts for ts, _, _ in pcap.PcapReader(f)]
+        assert times == [ts for ts, _ in service.packets]
+        assert count == len(service.packets)
+
+
+class TestIterPackets:
+    def test_stream_packets(self, make_export, servicedef, conn,
+                            make_response):
+        f = io.BytesIO()
+        writer = pcap.PcapWriter(f, 1)
+        writer.write(1000, b'one')
+        writer.write(2000, b'two')
+
+        exp = make_export(['RUNNING'])
+        response = make_response(200, f.getvalue())
+        conn.responses.append(response)
+        servicedef.servicepath = '/api/npm.packet_export/1.0'
+        exp.appresponse.export = types.SimpleNamespace(servicedef=servicedef)
+
+        packets = [(ts, origlen, bytes(data))
+                   for ts, origlen, data in exp.iter_packets(chunk_size=5)]
+        assert packets == [(1000, 3, b'one'), (2000, 3, b'two')]
+        assert conn.sent[0][1] == \
+            '/api/npm.packet_export/1.0/packets/items/1'
+        assert response.closed
+
+
+class TestExportManager:
+    @pytest.fixture
+    def register(self, servicedef):
+        """Return a function registering an export with a manager; the
+        delete of export '2' fails."""
+        def handler(datarep, link, data):
+            if datarep.id == '2':
+                raise IOError('connection reset')
+
+        servicedef.handler = handler
+
+        def _register(manager, exp_id):
+            manager.acquire()
+            exp = Export.__new__(Export)
+            exp.exp_id = exp_id
+            exp.manager = manager
+            exp.datarep = servicedef.bind('export', id=exp_id)
+            manager.register(exp)
+            return exp
+        return _register
+
+    def test_limit(self, register):
+        manager = ExportManager('test-host', max_exports=2)
+        first = register(manager, '1')
+        register(manager, '3')
+        with pytest.raises(AppResponseTimeout):
+            manager.acquire(timeout=.01)
+
+        assert first.delete()
+        assert len(manager) == 1
+        manager.acquire(timeout=.01)
+        manager.release()
+
+    def test_cleanup_keeps_failed_deletes(self, register, servicedef):
+        manager = ExportManager('test-host')
+        for i in range(4):
+            register(manager, str(i))
+
+        assert manager.cleanup(max_age=60) == 0
+        assert manager.cleanup() == 3
+        assert [e.exp_id for e in manager.exports] == ['2']
+        assert sorted(id_ for _, link, id_ in servicedef.executed
+                      if link == 'delete') == ['0', '1', '2', '3']
+
+    def test_exit_hook_deletes_sequentially(self, register, servicedef,
+                                            monkeypatch):
+        manager = ExportManager('test-host')
+        for i in range(3):
+            register(manager, str(i))
+        monkeypatch.setattr(export, '_managers', {'test-host': manager})
+
+        def no_threads(*args, **kwargs):
+            raise RuntimeError('cannot schedule new futures after '
+                               'interpreter shutdown')
+        monkeypatch.setattr(export, 'ThreadPoolExecutor', no_threads)
+
+        export._cleanup_exports()
+        assert [e.exp_id for e in manager.exports] == ['2']
+        assert [id_ for _, link, id_ in servicedef.executed
+                if link == 'delete'] == ['0', '1', '2']
+
+    def test_default_acquire_timeout(self, register):
+        manager = ExportManager('test-host', max_exports=1,
+                                acquire_timeout=.01)
+        register(manager, '1')
+        with pytest.raises(AppResponseTimeout):
+            manager.acquire()
@@ -0,0 +1,146 @@
+import logging
+
+import pytest
+
+from steelscript.appresponse.core.capture import Job
+from steelscript.appresponse.core.export import PacketExportService
+from steelscript.appresponse.core.filters import FilterSyntaxError, \
+    canonicalize, check_bpf, check_filter, parse_steelfilter, \
+    validate_columns
+from steelscript.appresponse.core.reports import DataDef, ReportService
+from steelscript.appresponse.core.types import AppResponseException, \
+    TimeFilter, TrafficFilter
+
+SOURCE = {'name': 'packets',
+          'filters_on_metrics': False,
+          'columns': {'tcp.port': {'id': 'tcp.port', 'grouped_by': True},
+                      'ip.addr': {'id': 'ip.addr', 'grouped_by': True},
+                      'sum_traffic.total_bytes': {
+                          'id': 'sum_traffic.total_bytes'}}}
+
+
+class TestSteelFilter:
+    def test_canonical_form(self):
+        assert canonicalize("tcp.port == 80") == 'tcp.port==80'
+        assert (canonicalize("ip.addr=='1.2.3.4' OR tcp.port==80") ==
+                canonicalize('tcp.port==80 || ip.addr=="1.2.3.4"') ==
+                'ip.addr=="1.2.3.4" or tcp.port==80')
+        assert (canonicalize('a==1 and (b==2 and c==3)') ==
+                canonicalize('(a==1 && b==2) AND c==3'))
+        assert (canonicalize('not (a==1 or b==2) and c') ==
+                'c and not (a==1 or b==2)')
+
+    def test_operators(self):
+        assert (canonicalize('alert.id="12"') ==
+                canonicalize("alert.id == '12'") == 'alert.id=="12"')
+        assert canonicalize('tcp.port=80') == canonicalize('tcp.port==80')
+        assert (canonicalize(r'http.host ~ "^www\.ex"') ==
+                r'http.host~"^www\.ex"')
+        assert canonicalize("app.name !~ 'ssh'") == 'app.name!~"ssh"'
+        assert (canonicalize('tcp.port in {443 80}') ==
+                canonicalize('tcp.port IN [80, 443]') ==
+                'tcp.port in {443 80}')
+        with pytest.raises(FilterSyntaxError):
+            parse_steelfilter('tcp.port in {}')
+
+    @pytest.mark.parametrize('expression', [
+        '', 'tcp.port==', '(tcp.port==80', 'tcp.port==80)',
+        'tcp.port==80 ip.addr==1.2.3.4', 'tcp.port==80 and', '==80'])
+    def test_syntax_errors(self, expression):
+        with pytest.raises(FilterSyntaxError):
+            parse_steelfilter(expression)
+
+    def test_validate_columns(self):
+        validate_columns(parse_steelfilter('tcp.port==80 or ip.addr'),
+                         SOURCE)
+
+        with pytest.raises(AppResponseException) as e:
+            validate_columns(parse_steelfilter('tcp.prot==80'), SOURCE)
+        assert 'tcp.prot' in str(e.value)
+
+        with pytest.raises(AppResponseException):
+            validate_columns(
+                parse_steelfilter('sum_traffic.total_bytes>100'), SOURCE)
+
+
+class TestBpf:
+    @pytest.mark.parametrize('expression', [
+        'host 1.2.3.4 or host 1.1.1.1', 'tcp and (port 80 or port 443)',
+        'not tcp', 'ip[0] & 0xf != 5'])
+    def test_valid(self, expression):
+        check_bpf(expression)
+
+    @pytest.mark.parametrize('expression', [
+        '', 'host 1.2.3.4 and', 'or tcp', '(port 80', 'port 80)', '()'])
+    def test_invalid(self, expression):
+        with pytest.raises(FilterSyntaxError):
+            check_bpf(expression)
+
+
+class TestTrafficFilter:
+    def test_fails_fast(self):
+        with pytest.raises(FilterSyntaxError):
+            TrafficFilter('tcp.port==80 or', type_='steelfilter',
+                          strict=True)
+        with pytest.raises(FilterSyntaxError):
+            TrafficFilter('host 1.2.3.4 and', type_='bpf', strict=True)
+
+        # WIRESHARK expressions and unvalidated filters are left alone
+        TrafficFilter('ip.addr==1.2.3.4 or', type_='wireshark')
+        TrafficFilter('tcp.port==80 or', validate=False)
+
+    def test_canonical(self):
+        assert (TrafficFilter('b==1 OR a==2').canonical ==
+                TrafficFilter('a==2 or b==1', type_='steelfilter').canonical)
+
+    def test_warns_by_default(self, caplog):
+        assert check_filter('steelfilter', 'tcp.port==80 or') is None
+        tf = TrafficFilter('host 1.2.3.4 and', type_='bpf')
+        assert [r.levelno for r in caplog.records] == [logging.WARNING] * 2
+        assert 'appliance' in caplog.records[0].getMessage()
+        assert tf.canonical == 'host 1.2.3.4 and'
+        assert TrafficFilter('a==1 or').canonical == 'a==1 or'
+
+
+class TestUnvalidated:
+    def test_report_skips_check(self):
+        service = ReportService.__new__(ReportService)
+        service._sources = {'packets': SOURCE}
+
+        dd = DataDef('packets', columns=[], time_range='last 1 m')
+        dd.add_filter(TrafficFilter('tcp.prot==80', validate=False))
+        service._check_filters([dd])
+
+        dd.add_filter(TrafficFilter('ip.adr==1.2.3.4'))
+        with pytest.raises(AppResponseException):
+            service._check_filters([dd])
+
+    def test_export_skips_check(self, make_appresponse, servicedef,
+                                make_result, caplog):
+        sent = []
+
+        def handler(datarep, link, data):
+            sent.append(data['config']['filters']['items'])
+            return make_result({'id': str(len(sent))})
+
+        servicedef.handler = handler
+        appresponse = make_appresponse('filters-host')
+        service = appresponse.export = PacketExportService(appresponse)
+        service.servicedef = servicedef
+        service.exports = servicedef.bind('exports')
+        job = Job(data={'id': '1'}, datarep=object())
+        timefilter = TimeFilter(start=100, end=110)
+
+        def warnings():
+            return [r for r in caplog.records
+                    if r.levelno == logging.WARNING]
+
+        exp = service.create(job, timefilter, [{'value': 'tcp.port==80 or'}])
+        service.manager.unregister(exp)
+        assert len(warnings()) == 1
+
+        filters = [TrafficFilter('tcp.port==80 or', validate=False)]
+        exp = service.create(job, timefilter, filters)
+        service.manager.unregister(exp)
+        assert len(warnings()) == 1
+        assert sent[1] == [filters[0].as_dict()]
@@ -0,0 +1,144 @@
+import copy
+
+import pytest
+from requests.adapters import HTTPAdapter
+
+from steelscript.appresponse.core.fs import FileIndex, FileSystemService, \
+    _ensure_pool_size
+
+
+def _file(path, type_='PCAP_FILE'):
+    return {'id': path, 'type': type_}
+
+
+LISTING = {'items': [
+    {'id': '/uploads',
+     'files': {'items': [_file('/uploads/a.pcap'),
+                         _file('/uploads/b.pcap')]},
+     'dirs': {'items': [
+         {'id': '/uploads/msa',
+          'files': {'items': [_file('/uploads/msa/m1',
+                                    'MULTISEGMENT_FILE')]}}]}},
+    {'id': '/tmp', 'files': {'items': [_file('/tmp/c.pcap')]}}
+]}
+
+
+@pytest.fixture
+def fs(servicedef, make_result):
+    service = FileSystemService(appresponse=None)
+    service.listing = copy.deepcopy(LISTING)
+    servicedef.handler = lambda datarep, link, data: \
+        make_result(service.listing)
+    service.servicedef = servicedef
+    service.filesystem = servicedef.bind('filesystem')
+    return service
+
+
+class TestFileSystemService:
+    def test_iter_files_in_listing_order(self, fs):
+        assert [f.path for f in fs.iter_files()] == [
+            '/uploads/a.pcap', '/uploads/b.pcap', '/uploads/msa/m1',
+            '/tmp/c.pcap']
+
+    def test_find_files(self, fs):
+        assert [f.path for f in fs.find_files('/uploads')] == [
+            '/uploads/a.pcap', '/uploads/b.pcap', '/uploads/msa/m1']
+        assert [f.path for f in fs.get_msa_files()] == ['/uploads/msa/m1']
+        assert fs.find_files('/missing') == []
+
+    def test_refresh_only_rebuilds_changed_dirs(self, fs):
+        before = dict((f.path, f) for f in fs.get_files())
+
+        listing = copy.deepcopy(LISTING)
+        listing['items'][1]['files']['items'] = [_file('/tmp/d.pcap')]
+        fs.listing = listing
+        after = dict((f.path, f) for f in fs.get_files(force=True))
+
+        assert sorted(after) == ['/tmp/d.pcap', '/uploads/a.pcap',
+                                 '/uploads/b.pcap', '/uploads/msa/m1']
+        assert after['/uploads/a.pcap'] is before['/uploads/a.pcap']
+        assert [f.path for f in fs.find_files('/tmp')] == ['/tmp/d.pcap']
+
+
+class TestFileIndex:
+    def test_remove_prunes_empty_dirs(self, fs):
+        index = FileIndex()
+        for f in fs.iter_files():
+            index.add(f)
+        assert len(index) == 4
+
+        index.remove('/uploads/msa/m1')
+        index.remove('/uploads/msa/m1')
+        assert len(index) == 3
+        assert index.get('/uploads/msa/m1') is None
+        assert 'msa' not in index._root.children['uploads'].children
+
+
+class TestUploadMany:
+    @pytest.fixture
+    def local_files(self, tmp_path):
+        paths = []
+        for name, size in [('a.pcap', 10), ('b.pcap', 20), ('e.pcap', 5)]:
+            path = tmp_path / name
+            path.write_bytes(b'\x00' * size)
+            paths.append(str(path))
+        return paths
+
+    def test_skip_create_and_failures(self, fs, local_files, monkeypatch,
+                                      make_appresponse):
+        listing = copy.deepcopy(LISTING)
+        listing['items'][0]['files']['items'][0]['size'] = 10
+        listing['items'][0]['files']['items'][1]['size'] = 99
+        fs.listing = listing
+        fs.appresponse = make_appresponse(fail=['/uploads/e.pcap'])
+
+        created = []
+        monkeypatch.setattr(fs, 'create_dir', created.append)
+
+        results = fs.upload_many(local_files, 'uploads', max_concurrency=2)
+
+        assert created == []
+        assert [r.status for r in results] == ['skipped', 'uploaded',
+                                               'failed']
+        assert sorted(fs.appresponse.uploaded) == ['/uploads/b.pcap']
+        assert not results[2].ok and isinstance(results[2].error, IOError)
+        assert results[1].checksum == 'sha256 of ' + local_files[1]
+        assert results[2].checksum is None
+
+    def test_creates_missing_dirs(self, fs, local_files, monkeypatch,
+                                  appresponse):
+        fs.appresponse = appresponse
+        created = []
+        monkeypatch.setattr(fs, 'create_dir', created.append)
+
+        fs.upload_many(local_files[:1], '/uploads/new/dir')
+        assert created == ['/uploads/new', '/uploads/new/dir']
+        assert fs.appresponse.uploaded == ['/uploads/new/dir/a.pcap']
+
+    def test_pool_grows_with_concurrency(self, conn):
+        conn.conn.mount('https://ar', HTTPAdapter(max_retries=3,
+                                                  pool_block=True))
+        assert _ensure_pool_size(conn, 4) == 4
+        adapter = conn.conn.get_adapter('https://ar')
+        assert adapter.poolmanager.connection_pool_kw['maxsize'] == 10
+
+        assert _ensure_pool_size(conn, 20) == 20
+        adapter = conn.conn.get_adapter('https://ar')
+        assert adapter.poolmanager.connection_pool_kw['maxsize'] == 20
+        assert adapter.poolmanager.connection_pool_kw['block']
+        assert adapter.max_retries.total == 3
+
+    def test_custom_adapter_is_kept(self, fs, local_files, conn,
+                                    appresponse):
+        class TLSAdapter(HTTPAdapter):
+            pass
+
+        adapter = TLSAdapter(pool_maxsize=2)
+        conn.conn.mount('https://ar', adapter)
+        assert _ensure_pool_size(conn, 20) == 2
+        assert conn.conn.get_adapter('https://ar') is adapter
+
+        fs.appresponse = appresponse
+        results = fs.upload_many(local_files, '/uploads', max_concurrency=8)
+        assert all(r.ok for r in results)
+        assert conn.conn.get_adapter('https://ar') is adapter
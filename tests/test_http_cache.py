@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from steelscript.appresponse.core.http_cache import ResponseCache, \
+    CachingConnection
+
+JOBS = '/api/npm.packet_capture/2.0/jobs'
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache()
+
+
+class TestResponseCache:
+    def test_etag_revalidation(self, conn, cache, make_response):
+        body = json.dumps({'items': [{'id': '1'}]}).encode()
+        conn.responses = [make_response(200, body, {'ETag': '"v1"'}),
+                          make_response(304)]
+        wrapped = CachingConnection(conn, cache)
+
+        first = wrapped.json_request('GET', JOBS)
+        token = cache.token(JOBS)
+        second = wrapped.json_request('GET', JOBS)
+
+        assert second is first
+        assert cache.token(JOBS) == token
+        assert conn.sent[1][2]['If-None-Match'] == '"v1"'
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_content_hash_without_validators(self, conn, cache, make_response):
+        body = json.dumps({'items': []}).encode()
+        changed = json.dumps({'items': [{'id': '2'}]}).encode()
+        conn.responses = [make_response(200, body), make_response(200, body),
+                          make_response(200, changed)]
+        wrapped = CachingConnection(conn, cache)
+
+        first = wrapped.json_request('GET', JOBS)
+        token = cache.token(JOBS)
+        assert wrapped.json_request('GET', JOBS) is first
+        assert wrapped.json_request('GET', JOBS) == {'items': [{'id': '2'}]}
+        assert cache.token(JOBS) != token
+
+    def test_uncached_paths_and_invalidation(self, conn, cache, make_response):
+        body = json.dumps({'items': []}).encode()
+        conn.responses = [make_response(200, body)]
+        wrapped = CachingConnection(conn, cache)
+
+        wrapped.json_request('GET', '/api/npm.reports/1.0/instances')
+        assert cache.get('/api/npm.reports/1.0/instances') is None
+
+        wrapped.json_request('GET', JOBS)
+        assert cache.token(JOBS) is not None
+        wrapped.json_request('DELETE', JOBS + '/items/1')
+        assert cache.token(JOBS) is None
@@ -0,0 +1,95 @@
+import pytest
+
+from steelscript.appresponse.core.classification import HostGroup
+from steelscript.appresponse.core.iptools import HostGroupIndex, \
+    RadixTree, compact_hosts, parse_hosts
+from steelscript.appresponse.core.types import AppResponseException
+
+
+def hostgroup(name, hosts):
+    return HostGroup(data={'id': name, 'name': name, 'hosts': hosts},
+                     datarep=object())
+
+
+@pytest.fixture
+def index():
+    return HostGroupIndex([
+        hostgroup('private', ['10.0.0.0/8']),
+        hostgroup('lab', ['10.1.0.0/16', '192.168.1.10-192.168.1.20']),
+        hostgroup('server', ['10.1.2.3']),
+        hostgroup('dup', ['10.1.0.0/16']),
+        hostgroup('v6', ['2001:db8::/32', '2001:db8:1::1'])])
+
+
+class TestRadixTree:
+    def test_parse_hosts(self):
+        assert [str(n) for n in parse_hosts('10.0.0.1-10.0.0.6')] == \
+            ['10.0.0.1/32', '10.0.0.2/31', '10.0.0.4/31', '10.0.0.6/32']
+        assert [str(n) for n in parse_hosts('10.1.1.1/16')] == \
+            ['10.1.0.0/16']
+        with pytest.raises(AppResponseException):
+            parse_hosts('10.0.0.300')
+
+    def test_compact_hosts(self):
+        hosts = ['10.0.0.%d' % i for i in range(256)]
+        hosts += ['10.0.1.0-10.0.1.127', '10.0.1.128/25', '10.0.1.7',
+                  '10.9.0.1', '2001:db8::/33', '2001:db8:8000::/33',
+                  '192.168.0.0/16', '192.168.3.0/24']
+        assert compact_hosts(hosts) == ['10.0.0.0/23', '10.9.0.1',
+                                        '192.168.0.0/16', '2001:db8::/32']
+        assert compact_hosts([]) == []
+
+    def test_prefixes(self):
+        tree = RadixTree()
+        for spec, value in (('0.0.0.0/0', 'all'), ('128.0.0.0/1', 'top')):
+            tree.insert(parse_hosts(spec)[0], value)
+        assert list(tree.prefixes(4)) == [(0, 0xffffffff, 'all'),
+                                          (0x80000000, 0xffffffff, 'top')]
+        assert tree.lookup('1.2.3.4') == 'all'
+        assert tree.lookup('200.0.0.1') == 'top'
+
+
+class TestHostGroupIndex:
+    def test_longest_prefix(self, index):
+        assert index.lookup('10.9.9.9') == 'private'
+        assert index.lookup('10.1.9.9') == 'lab'
+        assert index.lookup('10.1.2.3') == 'server'
+        assert index.lookup('192.168.1.15') == 'lab'
+        assert index.lookup('192.168.1.21') is None
+        assert index.lookup('2001:db8:1::1') == 'v6'
+        assert index.lookup('2001:db9::1') is None
+
+    def test_lookup_many(self, index):
+        pytest.importorskip('numpy')
+        addresses = ['10.9.9.9', '10.1.2.3', '10.1.2.4', '11.0.0.0',
+                     '192.168.1.20', '0.0.0.0', '255.255.255.255']
+        assert list(index.lookup_many(addresses)) == \
+            [index.lookup(a) for a in addresses]
+
+        mixed = ['10.1.2.3', '2001:db8::5', 'bogus', None, '10.2.0.0']
+        assert list(index.lookup_many(mixed)) == \
+            ['server', 'v6', None, None, 'private']
+
+    def test_lookup_many_matches_tree(self, index):
+        numpy = pytest.importorskip('numpy')
+        rng = numpy.random.RandomState(0)
+        values = rng.randint(0x0a000000, 0x0a020000, size=2000)
+        values = numpy.append(values, rng.randint(0xc0a80100, 0xc0a80200,
+                                                  size=500))
+        addresses = ['.'.join(str(v >> s & 0xff) for s in (24, 16, 8, 0))
+                     for v in values]
+        assert list(index.lookup_many(addresses)) == \
+            [index.lookup(a) for a in addresses]
+
+    def test_enrich(self, index):
+        pandas = pytest.importorskip('pandas')
+        df = pandas.DataFrame({
+            'src_ip.addr': ['10.1.2.3', '10.9.9.9', None, '10.1.2.3'],
+            'dst_ip.addr': ['8.8.8.8', '2001:db8::1', '10.1.0.1', '1.1.1.1'],
+            'sum_traffic.total_bytes': [1, 2, 3, 4]})
+        index.enrich(df)
+        # pandas shows the addresses in no hostgroup as missing values
+        assert list(df['src_ip.hostgroup'].fillna('-')) == \
+            ['server', 'private', '-', 'server']
+        assert list(df['dst_ip.hostgroup'].fillna('-')) == \
+            ['-', 'v6', 'lab', '-']
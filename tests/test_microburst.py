@@ -0,0 +1,60 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from steelscript.appresponse.core.microburst import MicroburstAnalyzer, \
+    RESOLUTION_10US, RESOLUTION_1MS  # noqa: E402
+from steelscript.appresponse.core.types import \
+    AppResponseException  # noqa: E402
+
+SECOND = 1000000000
+
+
+@pytest.fixture
+def analyzer():
+    analyzer = MicroburstAnalyzer()
+    # a 3 packet burst within 10us, then sparse packets, then a second
+    # interval with a single packet
+    analyzer.add([1000, 5000, 9000, 2000000, 2500000, SECOND + 3000],
+                 [100, 200, 300, 400, 500, 600])
+    return analyzer
+
+
+class TestMicroburstAnalyzer:
+    def test_series(self, analyzer):
+        starts, counts = analyzer.series(RESOLUTION_10US)
+        assert starts.tolist() == [0, 2000000, 2500000, SECOND]
+        assert counts.tolist() == [600, 400, 500, 600]
+
+        starts, counts = analyzer.series(RESOLUTION_1MS)
+        assert starts.tolist() == [0, 2000000, SECOND]
+        assert counts.tolist() == [600, 900, 600]
+
+    def test_summary(self, analyzer):
+        summary = analyzer.summary()
+        assert summary['time'].tolist() == [0, SECOND]
+        assert summary[RESOLUTION_10US].tolist() == [600, 600]
+        assert summary[RESOLUTION_1MS].tolist() == [900, 600]
+
+        with pytest.raises(AppResponseException):
+            analyzer.summary(interval=15000)
+
+    def test_add_packets_in_batches(self):
+        analyzer = MicroburstAnalyzer()
+        packets = [(i * 1000, 10, b'') for i in range(25)]
+        packets.append((None, 99, b''))
+        analyzer.add_packets(iter(packets), batch_size=10)
+
+        assert len(analyzer) == 25
+        assert analyzer.max_bursts()[RESOLUTION_10US] == 100
+
+    def test_sliced_packets_count_in_full(self):
+        analyzer = MicroburstAnalyzer()
+        analyzer.add_packets(iter([(0, 1500, b'x' * 64),
+                                   (1000, 1500, b'x' * 64)]))
+        assert analyzer.max_bursts()[RESOLUTION_10US] == 3000
+
+    def test_empty(self):
+        analyzer = MicroburstAnalyzer()
+        assert analyzer.max_bursts()[RESOLUTION_1MS] == 0
+        assert analyzer.summary()['time'].tolist() == []
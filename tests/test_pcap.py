@@ -0,0 +1,161 @@
+import io
+import struct
+
+import pytest
+
+from steelscript.appresponse.core import pcap
+
+
+def _pcap(packets, nanosecond=False, linktype=1):
+    f = io.BytesIO()
+    writer = pcap.PcapWriter(f, linktype, nanosecond=nanosecond)
+    for ts, data in packets:
+        writer.write(ts, data)
+    f.seek(0)
+    return f
+
+
+class TestPcap:
+    def test_round_trip(self):
+        packets = [(1500000000123456000, b'abc'),
+                   (1500000001000001000, b'defg')]
+        reader = pcap.PcapReader(_pcap(packets))
+        assert reader.linktype == 1
+        assert [(ts, data) for ts, _, data in reader] == packets
+
+    def test_big_endian_nanosecond(self):
+        f = io.BytesIO(struct.pack('>IHHiIII', pcap.MAGIC_NSEC, 2, 4, 0, 0,
+                                   65535, 1) +
+                       struct.pack('>IIII', 10, 5, 2, 60) + b'xy')
+        reader = pcap.PcapReader(f)
+        assert list(reader) == [(10000000005, 60, b'xy')]
+
+    def test_truncated_record(self):
+        f = _pcap([(0, b'abcdef')])
+        f = io.BytesIO(f.getvalue()[:-2])
+        with pytest.raises(pcap.PcapError):
+            list(pcap.PcapReader(f))
+
+    def test_merge_in_time_order(self):
+        a = _pcap([(1000, b'a1'), (3000, b'a2'), (5000, b'a3')])
+        b = _pcap([(2000, b'b1'), (3000, b'b2')], nanosecond=True)
+        out = io.BytesIO()
+
+        assert pcap.merge([a, b], out) == 5
+        out.seek(0)
+        reader = pcap.PcapReader(out)
+        assert reader.nanosecond
+        assert [data for _, _, data in reader] == [b'a1', b'b1', b'a2',
+                                                   b'b2', b'a3']
+
+    def test_merge_rejects_mixed_linktypes(self):
+        with pytest.raises(pcap.PcapError):
+            pcap.merge([_pcap([]), _pcap([], linktype=101)], io.BytesIO())
+
+
+def _block(btype, body):
+    length = 12 + len(body)
+    return (struct.pack('<II', btype, length) + body +
+            struct.pack('<I', length))
+
+
+def _pcapng(packets, origlen=None):
+    shb = _block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0, -1))
+    # nanosecond resolution, then end of options
+    options = struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0)
+    idb = _block(1, struct.pack('<HHI', 1, 0, 65535) + options)
+    epbs = b''
+    for ts, data in packets:
+        padded = data + b'\x00' * (-len(data) % 4)
+        epbs += _block(6, struct.pack('<IIIII', 0, ts >> 32,
+                                      ts & 0xffffffff, len(data),
+                                      origlen or len(data)) + padded)
+    return shb + idb + epbs
+
+
+def _parse(stream, chunk_size):
+    parser = pcap.StreamParser()
+    packets = []
+    for i in range(0, len(stream), chunk_size):
+        for ts, origlen, data in parser.feed(stream[i:i + chunk_size]):
+            assert isinstance(data, memoryview) and origlen >= len(data)
+            packets.append((ts, bytes(data)))
+    parser.close()
+    return parser, packets
+
+
+class TestMergePcapng:
+    def test_merge_with_pcap(self):
+        a = io.BytesIO(_pcapng([(1000, b'a1'), (3001, b'a2')]))
+        b = _pcap([(2000, b'b1'), (3000, b'b2')])
+        out = io.BytesIO()
+
+        assert pcap.merge([a, b], out, chunk_size=7) == 4
+        out.seek(0)
+        reader = pcap.PcapReader(out)
+        assert reader.nanosecond
+        assert [(ts, data) for ts, _, data in reader] == [
+            (1000, b'a1'), (2000, b'b1'), (3000, b'b2'), (3001, b'a2')]
+
+    def test_empty_inputs(self):
+        out = io.BytesIO()
+        assert pcap.merge([io.BytesIO(_pcapng([])), _pcap([])], out) == 0
+        with pytest.raises(pcap.PcapError):
+            pcap.merge([io.BytesIO(b'')], io.BytesIO())
+
+
+class TestStreamParser:
+    packets = [(1500000000123456000, b'abc'),
+               (1500000001000001000, b'defgh')]
+
+    @pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+    def test_pcap(self, chunk_size):
+        stream = _pcap(self.packets).getvalue()
+        parser, packets = _parse(stream, chunk_size)
+        assert parser.format == 'pcap'
+        assert packets == self.packets
+
+    @pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+    def test_pcapng(self, chunk_size):
+        parser, packets = _parse(_pcapng(self.packets), chunk_size)
+        assert parser.format == 'pcapng'
+        assert parser.linktype == 1
+        assert packets == self.packets
+
+    def test_wire_length(self):
+        f = io.BytesIO()
+        writer = pcap.PcapWriter(f, 1)
+        writer.write(1000, b'head', origlen=1500)
+        streams = [f.getvalue(), _pcapng([(1000, b'head')], origlen=1500)]
+        for stream in streams:
+            (ts, origlen, data), = pcap.StreamParser().feed(stream)
+            assert (ts, origlen, bytes(data)) == (1000, 1500, b'head')
+
+    def test_truncated_stream(self):
+        parser = pcap.StreamParser()
+        list(parser.feed(_pcap(self.packets).getvalue()[:-1]))
+        with pytest.raises(pcap.PcapError):
+            parser.close()
+
+    @pytest.mark.parametrize('build', [_pcap, _pcapng])
+    def test_split_record_copies_only_its_bytes(self, build):
+        packets = [(1000 * i, bytes([i]) * 40) for i in range(1, 6)]
+        stream = build(packets)
+        stream = stream.getvalue() if hasattr(stream, 'getvalue') else stream
+        # split in the middle of the second packet
+        cut = stream.index(packets[1][1]) + 10
+        first, second = stream[:cut], stream[cut:]
+
+        parser = pcap.StreamParser()
+        seen = list(parser.feed(first))
+        assert len(seen) == 1 and seen[0][2].obj is first
+        assert len(parser._pending) < 100
+
+        seen = list(parser.feed(second))
+        assert [bytes(data) for _, _, data in seen] == \
+            [data for _, data in packets[1:]]
+        # the completed packet has its own buffer, the others are views
+        # into the chunk
+        assert seen[0][2].obj is not second
+        assert all(data.obj is second for _, _, data in seen[1:])
+        parser.close()
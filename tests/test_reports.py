@@ -0,0 +1,289 @@
+import gc
+
+import pytest
+
+from steelscript.appresponse.core.capture import Job
+from steelscript.appresponse.core.reports import DataDef, Report, \
+    ReportInstance, ReportProgress, ReportService
+from steelscript.appresponse.core.scheduler import ReportScheduler
+from steelscript.appresponse.core.types import AppResponseTimeout
+
+
+class InstanceStore(object):
+    """Handler of the report instance links.
+
+    Each status poll returns the next item of `polls`, the last one
+    repeatedly; a poll that is an exception is raised instead.
+    """
+
+    def __init__(self, make_result, polls):
+        self.make_result = make_result
+        self.polls = list(polls)
+
+    def __call__(self, datarep, link, data):
+        if link == 'get_status':
+            status = self.polls.pop(0) if len(self.polls) > 1 \
+                else self.polls[0]
+            if isinstance(status, Exception):
+                raise status
+            return self.make_result(status)
+        if link == 'get_data':
+            if datarep.resource == 'instance':
+                items = [{'columns': ['name'], 'data': [['all']]}] * 2
+                return self.make_result({'data_defs': items})
+            return self.make_result({'columns': ['name'],
+                                     'data': [[datarep.resource]]})
+        if link == 'delete':
+            return self.make_result(None)
+        raise AssertionError('Unexpected {}'.format(link))
+
+
+class FakeReports(object):
+    """Report service creating instances admitted by a scheduler."""
+
+    sources = {'src': {'columns': {'name': {'type': 'string'}}}}
+
+    def __init__(self, servicedef, scheduler):
+        self.servicedef = servicedef
+        self.scheduler = scheduler
+
+    def create_instance(self, data_defs, priority, timeout=None):
+        slot = self.scheduler.acquire(priority=priority, timeout=timeout)
+        live = all(dd.live for dd in data_defs)
+        return ReportInstance({'id': '1'}, servicedef=self.servicedef,
+                              live=live, slot=slot)
+
+
+class FakeClips(object):
+    """Clips object recording its release."""
+
+    released = False
+
+    def release(self):
+        self.released = True
+
+
+class FakeClipService(object):
+    """Clip service handing out FakeClips, or raising `error`."""
+
+    def __init__(self):
+        self.error = None
+        self.created = []
+
+    def create_clips(self, data_defs):
+        if self.error is not None:
+            raise self.error
+        clips = FakeClips()
+        self.created.append(clips)
+        return clips
+
+
+def state(*states):
+    return [{'state': s, 'messages': []} for s in states]
+
+
+@pytest.fixture
+def scheduler():
+    return ReportScheduler('test-host', max_instances=1)
+
+
+@pytest.fixture
+def report(make_servicedef, make_result, make_appresponse, scheduler):
+    """Return a factory of two data def Reports whose instance goes
+    through the status `polls`."""
+    def _report(*polls):
+        polls = polls or [state('running')]
+        servicedef = make_servicedef(InstanceStore(make_result, polls))
+        reports = FakeReports(servicedef, scheduler)
+        report = Report(make_appresponse(reports=reports))
+        for _ in range(2):
+            report.add(DataDef('src', columns=[], time_range='last 1 m'))
+        return report
+    return _report
+
+
+class TestCreateInstance:
+    @pytest.fixture
+    def service(self, servicedef, make_result, make_appresponse,
+                scheduler):
+        """Return a ReportService admitting instances through
+        `scheduler`; `servicedef.error` makes instance creation fail."""
+        servicedef.error = None
+
+        def handler(datarep, link, data):
+            if servicedef.error is not None:
+                raise servicedef.error
+            return make_result({'id': '7'})
+
+        servicedef.handler = handler
+        appresponse = make_appresponse(find_service=lambda name: servicedef,
+                                       clips=FakeClipService())
+        service = ReportService(appresponse)
+        service.scheduler = scheduler
+        service._sources = FakeReports.sources
+        return service
+
+    def data_def(self, source='src'):
+        return DataDef(source, columns=[], time_range='last 1 m')
+
+    def test_slot_handed_to_instance(self, service, servicedef, scheduler):
+        instance = service.create_instance([self.data_def()])
+        assert scheduler.running == 1
+        assert instance.id == '7'
+        assert servicedef.links() == ['create']
+        assert servicedef.bound[-1] == ('instance', {'id': '7'})
+        assert service.appresponse.clips.created == []
+
+        instance._release_resources()
+        assert scheduler.running == 0
+
+    def test_slot_released_when_create_fails(self, service, servicedef,
+                                             scheduler):
+        servicedef.error = IOError('connection reset')
+        with pytest.raises(IOError):
+            service.create_instance([self.data_def()])
+        assert scheduler.running == 0
+
+    def test_clips_handed_to_instance(self, service, scheduler):
+        job = Job(data={'id': '1', 'name': 'job'}, datarep=object())
+        instance = service.create_instance([self.data_def(job)])
+        clips, = service.appresponse.clips.created
+        assert not clips.released
+
+        instance._release_resources()
+        assert clips.released
+        assert scheduler.running == 0
+
+    def test_released_when_clips_fail(self, service, scheduler):
+        service.appresponse.clips.error = IOError('connection reset')
+        job = Job(data={'id': '1', 'name': 'job'}, datarep=object())
+        with pytest.raises(IOError):
+            service.create_instance([self.data_def(job)])
+        assert scheduler.running == 0
+
+    def test_clips_released_when_create_fails(self, service, servicedef,
+                                              scheduler):
+        servicedef.error = IOError('connection reset')
+        job = Job(data={'id': '1', 'name': 'job'}, datarep=object())
+        with pytest.raises(IOError):
+            service.create_instance([self.data_def(job)])
+        clips, = service.appresponse.clips.created
+        assert clips.released
+        assert scheduler.running == 0
+
+
+class TestSlots:
+    def test_released_when_completed(self, report, scheduler):
+        r = report(state('running', 'running'),
+                   state('completed', 'completed'))
+        r.run()
+        assert r.get_data(None) == [[('all',)], [('all',)]]
+        assert scheduler.running == 0
+
+    def test_released_on_polling_error(self, report, scheduler):
+        r = report(state('running', 'running'), IOError('connection reset'))
+        with pytest.raises(IOError):
+            for _ in r.iter_progress(interval=0):
+                pass
+        assert scheduler.running == 0
+
+    def test_released_on_break(self, report, scheduler):
+        r = report(state('running', 'running'))
+        progress = r.iter_progress(interval=0)
+        next(progress)
+        assert scheduler.running == 1
+        progress.close()
+        assert scheduler.running == 0
+
+    def test_released_when_dropped(self, report, scheduler):
+        reports = report().appresponse.reports
+        instance = reports.create_instance([], priority='batch')
+        assert scheduler.running == 1
+        del instance
+        gc.collect()
+        assert scheduler.running == 0
+
+
+class TestTimeout:
+    def test_deadline_cancels_instance(self, report, scheduler):
+        r = report(state('running', 'running'))
+        with pytest.raises(AppResponseTimeout):
+            for _ in r.iter_progress(timeout=.05, interval=.01):
+                pass
+
+        links = r.appresponse.reports.servicedef.links()
+        assert links[-1] == 'delete'
+        assert r._instance is None
+        assert scheduler.running == 0
+
+    def test_run_raises(self, report, scheduler):
+        r = report(state('running', 'running'))
+        seen = []
+        with pytest.raises(AppResponseTimeout):
+            r.run(timeout=0, progress_callback=seen.append)
+        assert len(seen) == 1
+        assert 'delete' in r.appresponse.reports.servicedef.links()
+        assert scheduler.running == 0
+
+    def test_delete_failure(self, report, scheduler):
+        r = report(state('running', 'running'))
+        store = r.appresponse.reports.servicedef.handler
+
+        def handler(datarep, link, data):
+            if link == 'delete':
+                raise IOError('connection reset')
+            return store(datarep, link, data)
+        r.appresponse.reports.servicedef.handler = handler
+
+        # the instance could not be deleted but its slot is released
+        with pytest.raises(AppResponseTimeout):
+            r.run(timeout=0)
+        assert scheduler.running == 0
+
+
+class TestProgress:
+    def test_report_progress(self):
+        status = [{'state': 'running', 'progress': {'percent': 40}},
+                  {'state': 'completed'}]
+        progress = ReportProgress(status, [None, 3], 1.5, False)
+        assert progress.states == ['running', 'completed']
+        assert progress.percents == [40, 100]
+        assert progress.percent == 70
+        assert progress.completed == [1]
+        assert '70%' in repr(progress)
+        assert ReportProgress([], [], 0, True).percent == 0
+
+    def test_partial_results(self, report, scheduler):
+        r = report(state('running', 'running'),
+                   state('completed', 'running'),
+                   state('completed', 'completed'))
+        seen = list(r.iter_progress(partial=True, interval=0))
+
+        assert [p.rows for p in seen] == [[None, None], [1, None], [1, 1]]
+        assert [p.ready for p in seen] == [False, False, True]
+        # each data def was fetched on its own, once
+        assert r.get_data(None) == [[('instance.data_defs.0',)],
+                                    [('instance.data_defs.1',)]]
+        links = r.appresponse.reports.servicedef.links()
+        assert links.count('get_data') == 2
+        assert scheduler.running == 0
+
+    def test_break_deletes_instance(self, report, scheduler):
+        r = report(state('running', 'running'))
+        for progress in r.iter_progress(interval=0):
+            break
+        del progress
+
+        assert r.appresponse.reports.servicedef.links()[-1] == 'delete'
+        assert r._instance is None
+        assert scheduler.running == 0
+
+    def test_break_when_ready_keeps_instance(self, report):
+        r = report(state('collecting', 'collecting'))
+        for dd in r._data_defs:
+            dd.live = True
+        for progress in r.iter_progress(interval=0):
+            break
+
+        assert 'delete' not in r.appresponse.reports.servicedef.links()
+        assert r._instance is not None
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from steelscript.appresponse.core.scheduler import ReportScheduler, \
+    SchedulerTimeout, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+@pytest.fixture
+def scheduler():
+    return ReportScheduler('test-host', max_instances=1)
+
+
+def _acquire_in_thread(scheduler, order, **kwargs):
+    def run():
+        slot = scheduler.acquire(**kwargs)
+        order.append(kwargs.get('caller'))
+        slot.release()
+
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+
+def _wait_for_waiters(scheduler, count):
+    while scheduler.waiting < count:
+        time.sleep(.01)
+
+
+class TestReportScheduler:
+    def test_limit_and_release(self, scheduler):
+        slot = scheduler.acquire()
+        assert scheduler.running == 1
+        with pytest.raises(SchedulerTimeout):
+            scheduler.acquire(timeout=.05)
+        assert scheduler.waiting == 0
+
+        slot.release()
+        slot.release()
+        assert scheduler.running == 0
+
+    def test_default_timeout(self, scheduler):
+        slot = scheduler.acquire()
+        scheduler.acquire_timeout = .05
+        with pytest.raises(SchedulerTimeout):
+            scheduler.acquire()
+        slot.release()
+
+    def test_interactive_before_batch(self, scheduler):
+        slot = scheduler.acquire()
+        order = []
+        threads = [_acquire_in_thread(scheduler, order, caller='batch',
+                                      priority=PRIORITY_BATCH)]
+        _wait_for_waiters(scheduler, 1)
+        threads.append(_acquire_in_thread(scheduler, order,
+                                          caller='interactive',
+                                          priority=PRIORITY_INTERACTIVE))
+        _wait_for_waiters(scheduler, 2)
+
+        slot.release()
+        for t in threads:
+            t.join()
+        assert order == ['interactive', 'batch']
+
+    def test_round_robin_across_callers(self, scheduler):
+        slot = scheduler.acquire()
+        order = []
+        threads = []
+        for caller in ['a', 'a', 'b']:
+            threads.append(_acquire_in_thread(scheduler, order,
+                                              caller=caller))
+            _wait_for_waiters(scheduler, len(threads))
+
+        slot.release()
+        for t in threads:
+            t.join()
+        assert order == ['a', 'b', 'a']
+
+        stats = scheduler.get_stats()
+        assert stats['granted'] == 4
+        assert stats['queued'] == 3
+        assert stats['max_wait'] > 0
@@ -0,0 +1,150 @@
+import hashlib
+import io
+import os
+import pickle
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from steelscript.appresponse.core import pcap
+from steelscript.appresponse.core.transfer import UploadStream, \
+    ResumableDownload, TransferState
+
+
+class TestUploadStream:
+    def test_chunks_progress_and_checksum(self):
+        payload = bytes(range(256)) * 40
+        f = io.BytesIO(payload)
+        f.seek(240)
+
+        seen = []
+        stream = UploadStream(f, chunk_size=1000,
+                              progress_callback=lambda s: seen.append(
+                                  (s.bytes_sent, s.done)))
+        assert len(stream) == len(payload) - 240
+
+        chunks = list(stream)
+        assert [len(c) for c in chunks] == [1000] * 10
+        assert b''.join(chunks) == payload[240:]
+        assert seen[-1] == (len(stream), True)
+        assert [s[0] for s in seen[:-1]] == list(range(1000, 10001, 1000))
+        assert stream.percent == 100.0
+        assert stream.checksum == hashlib.sha256(payload[240:]).hexdigest()
+
+    def test_real_file(self, tmp_path):
+        path = tmp_path / 'trace.pcap'
+        path.write_bytes(b'\xd4\xc3\xb2\xa1' + b'\x00' * 100)
+        with open(str(path), 'rb') as f:
+            stream = UploadStream(f, chunk_size=64)
+            assert len(stream) == 104
+            assert len(list(stream)) == 2
+
+    def test_invalid_chunk_size(self):
+        with pytest.raises(ValueError):
+            UploadStream(io.BytesIO(b''), chunk_size=0)
+
+
+PAYLOAD = bytes(range(256)) * 4
+
+
+class TestResumableDownload:
+    def test_resume_after_drop(self, tmp_path, conn, make_response):
+        conn.responses.extend([
+            make_response(200, PAYLOAD, {'ETag': '"v1"'},
+                          fail_after=300),
+            make_response(206, PAYLOAD[300:])])
+        path = str(tmp_path / 'export.pcap')
+
+        download = ResumableDownload(conn, '/packets', path,
+                                     chunk_size=100, delay=0)
+        result = download.run()
+        assert result.path == path
+        assert result.sha256 == hashlib.sha256(PAYLOAD).hexdigest()
+        assert result.packets is None
+
+        # the result is the path, as downloads used to return
+        assert result == path and isinstance(result, str)
+        assert os.path.exists(result) and os.fspath(result) == path
+        copied = pickle.loads(pickle.dumps(result))
+        assert (copied, copied.size) == (path, len(PAYLOAD))
+
+        with open(path, 'rb') as f:
+            assert f.read() == PAYLOAD
+        assert 'Range' not in conn.sent[0][2]
+        assert conn.sent[1][2]['Range'] == 'bytes=300-'
+        assert conn.sent[1][2]['If-Range'] == '"v1"'
+        assert not os.path.exists(path + '.part')
+        assert not os.path.exists(path + '.part.json')
+
+    def test_resume_from_saved_state(self, tmp_path, conn, make_response):
+        path = str(tmp_path / 'export.pcap')
+        with open(path + '.part', 'wb') as f:
+            # 50 bytes were written after the last recorded offset
+            f.write(PAYLOAD[:250])
+        TransferState(path + '.part.json').save(
+            {'url': '/packets', 'offset': 200, 'total': len(PAYLOAD),
+             'validators': {}})
+
+        # the server ignores the range and sends everything again
+        conn.responses.append(make_response(200, PAYLOAD))
+        ResumableDownload(conn, '/packets', path).run()
+
+        assert conn.sent[0][2]['Range'] == 'bytes=200-'
+        with open(path, 'rb') as f:
+            assert f.read() == PAYLOAD
+
+    def test_gives_up_after_retries(self, tmp_path, conn, make_response):
+        conn.responses.extend([
+            make_response(200, PAYLOAD, fail_after=100),
+            make_response(206, PAYLOAD[100:], fail_after=0)])
+        path = str(tmp_path / 'export.pcap')
+
+        with pytest.raises(ConnectionError):
+            ResumableDownload(conn, '/packets', path, chunk_size=100,
+                              retries=1, delay=0).run()
+        assert TransferState(path + '.part.json').load()['offset'] == 100
+
+
+class TestDownloadDigest:
+    def _capture(self):
+        f = io.BytesIO()
+        writer = pcap.PcapWriter(f, 1)
+        for i in range(5):
+            writer.write(i * 1000, b'x' * 100)
+        return f.getvalue()
+
+    def test_count_while_downloading(self, tmp_path, conn, make_response):
+        capture = self._capture()
+        conn.responses.extend([
+            make_response(200, capture, fail_after=200),
+            make_response(206, capture[200:])])
+
+        result = ResumableDownload(conn, '/packets',
+                                   str(tmp_path / 'export.pcap'),
+                                   chunk_size=50, delay=0).run()
+        assert result.packets == 5
+        assert result.size == len(capture)
+        assert result.sha256 == hashlib.sha256(capture).hexdigest()
+
+    def test_seeded_from_part_file(self, tmp_path, conn, make_response):
+        capture = self._capture()
+        path = str(tmp_path / 'export.pcap')
+        with open(path + '.part', 'wb') as f:
+            f.write(capture[:300])
+        TransferState(path + '.part.json').save(
+            {'url': '/packets', 'offset': 300, 'total': len(capture)})
+
+        conn.responses.append(make_response(206, capture[300:]))
+        result = ResumableDownload(conn, '/packets', path).run()
+        assert result.packets == 5
+        assert result.sha256 == hashlib.sha256(capture).hexdigest()
+
+    def test_directory_without_persisting(self, tmp_path, conn,
+                                          make_response):
+        conn.responses.append(make_response(
+            200, PAYLOAD, {'Content-Disposition': 'filename=1.pcap'}))
+
+        result = ResumableDownload(conn, '/packets', str(tmp_path),
+                                   persist=False).run()
+        assert result.path == str(tmp_path / '1.pcap')
+        assert os.listdir(str(tmp_path)) == ['1.pcap']
@@ -0,0 +1,45 @@
+import pytest
+
+from steelscript.appresponse.core.capture import Interface, Job
+from steelscript.appresponse.core.certificate import Certificate
+from steelscript.appresponse.core.ssl_keys import SslKey
+from steelscript.appresponse.core.system_update import Image, Update
+
+
+class TestResourceObject:
+    def test_bind_on_first_use(self, servicedef):
+        jobs = [Job(data={'id': str(i), 'config': {'name': 'job%d' % i}},
+                    servicedef=servicedef) for i in range(3)]
+
+        assert [job.name for job in jobs] == ['job0', 'job1', 'job2']
+        assert jobs[1].id == '1'
+        assert servicedef.bound == []
+
+        datarep = jobs[1].datarep
+        assert (datarep.resource, datarep.kwargs) == ('job', {'id': '1'})
+        assert jobs[1].datarep is datarep
+        assert servicedef.bound == [('job', {'id': '1'})]
+
+    def test_interface_binds_by_name(self, servicedef):
+        iface = Interface(data={'name': 'mgmt0'}, servicedef=servicedef)
+        assert servicedef.bound == []
+        iface.datarep
+        assert servicedef.bound == [('phys_interface', {'name': 'mgmt0'})]
+
+    def test_data_and_slots(self):
+        job = Job(data={'id': '1', 'config': {'name': 'a'}},
+                  datarep=object())
+        assert job.data.config.name == 'a'
+
+        job.data = {'id': '1', 'config': {'name': 'b'}}
+        assert job.data.config.name == 'b'
+        assert not hasattr(job, '__dict__')
+
+    @pytest.mark.parametrize('cls', [Certificate, SslKey, Image, Update])
+    def test_get_properties(self, servicedef, cls):
+        obj = cls(data={'id': '1'}, servicedef=servicedef)
+        props = obj.get_properties()
+        assert sorted(props) == ['data', 'datarep']
+        assert props['data'].id == '1'
+        assert props['datarep'] is obj.datarep
+        assert servicedef.bound == [(cls.resource, {'id': '1'})]